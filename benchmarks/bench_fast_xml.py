@@ -0,0 +1,86 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compares the serialization of resourcelists through ResourceDoc/Resource/resync with the fast_xml path.
+
+Both paths start from elasticsearch-like _source dicts and write a resourcelist to disk; the outputs
+are checked to be byte-identical. Run from the repository root::
+
+    python benchmarks/bench_fast_xml.py [number of resources]
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+from resync import Resource
+from resync import ResourceList
+
+from omtdrspub.elastic.fast_xml import FragmentResourceList, UrlFragmentSerializer
+from omtdrspub.elastic.model.location import LocationResolver
+from omtdrspub.elastic.model.resource_doc import ResourceDoc
+
+RES_ROOT_DIR = "/data/resources/"
+URL_PREFIX = "http://example.com/"
+PER = 100000
+
+
+def sources(n):
+    for i in range(n):
+        name = "dir%03d/file%08d.xml" % (i % 1000, i)
+        yield {
+            'resync_id': str(i),
+            'resource_set': "bench",
+            'location': {'type': "abs_path", 'value': RES_ROOT_DIR + name},
+            'length': 1000 + i,
+            'md5': "%032x" % i,
+            'mime': "application/xml",
+            'lastmod': "2017-02-03T12:25:00Z",
+            'ln': [{'href': {'type': "rel_path", 'value': name + ".pdf"}, 'rel': "describes",
+                    'mime': "application/pdf"}],
+            'timestamp': "2017-02-03T12:25:00Z"
+        }
+
+
+def resync_path(e_sources, path):
+    resolver = LocationResolver(URL_PREFIX, RES_ROOT_DIR)
+    resourcelist = ResourceList()
+    for e_source in e_sources:
+        e_doc = ResourceDoc.from_source(e_source)
+        ln = [{'href': resolver.uri(link.href), 'rel': link.rel, 'mime': link.mime} for link in e_doc.ln]
+        resourcelist.add(Resource(uri=resolver.uri(e_doc.location), length=e_doc.length, lastmod=e_doc.lastmod,
+                                  md5=e_doc.md5, mime_type=e_doc.mime, ln=ln))
+    resourcelist.write(path)
+
+
+def fast_path(e_sources, path):
+    serializer = UrlFragmentSerializer(LocationResolver(URL_PREFIX, RES_ROOT_DIR))
+    resourcelist = FragmentResourceList()
+    for e_source in e_sources:
+        resourcelist.add_fragment(*serializer.fragment(e_source))
+    resourcelist.write_fragments(path)
+
+
+def main(n=PER):
+    e_sources = list(sources(n))
+    tmp_dir = tempfile.mkdtemp()
+    paths = {name: os.path.join(tmp_dir, name + ".xml") for name in ("resync", "fast_xml")}
+    timings = {
+        "resync": min(timeit.repeat(lambda: resync_path(e_sources, paths["resync"]), number=1, repeat=3)),
+        "fast_xml": min(timeit.repeat(lambda: fast_path(e_sources, paths["fast_xml"]), number=1, repeat=3))
+    }
+    with open(paths["resync"], "rb") as f1, open(paths["fast_xml"], "rb") as f2:
+        identical = f1.read() == f2.read()
+
+    for name, seconds in timings.items():
+        print("%-10s %8.3f s per %d resources" % (name, seconds * PER / n, PER))
+    print("speedup    %8.2fx" % (timings["resync"] / timings["fast_xml"]))
+    print("identical  %s" % identical)
+    for path in paths.values():
+        os.remove(path)
+    os.rmdir(tmp_dir)
+    return 0 if identical else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else PER))
@@ -0,0 +1,186 @@
+import copy
+import os
+from xml.etree.ElementTree import tostring
+
+import logging
+from resync import ChangeList
+from resync.sitemap import RS_NS, XML_ATT_NAME, Sitemap, SitemapParseError
+
+from omtdrspub.elastic.utils import iter_preamble, parse_xml_without_urls
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+PY_ATT_NAME = {xml_att: att for att, xml_att in XML_ATT_NAME.items()}
+
+
+def in_element_order(atts: dict, element) -> dict:
+    """atts, parsed from element, in the order of the attributes of element (then the others)."""
+    names = [PY_ATT_NAME.get(xml_att, xml_att) for xml_att in element.attrib]
+    ordered = [(att, atts[att]) for att in names if att in atts]
+    return dict(ordered + [(att, value) for att, value in atts.items() if att not in names])
+
+
+class AppendChangeList(ChangeList):
+    """
+    A changelist already on disk, to which new changes are appended without parsing its <url> elements.
+
+    Only the preamble (<rs:md> and <rs:ln>) is read. When saved, the new changes are written before the
+    closing </urlset> tag; if the preamble has been changed (e.g. a rel="index" link has been added), the
+    file is copied once with the new preamble. The result is the same document resync would write.
+
+    An append interrupted by a crash leaves a changelist without its closing tag, or longer than the size
+    recorded when it was last saved: it is then copied, up to the last complete <url> element within that size,
+    before the new changes are added.
+    """
+
+    def __init__(self, path, count, size=None):
+        super(AppendChangeList, self).__init__()
+        self.count = count
+        # of the file, when it was last saved
+        self.size = size
+        with open(path, "r", encoding="utf-8") as cl_file:
+            parse_xml_without_urls(Sitemap(), fh=cl_file, resources=self)
+        # resync writes attributes in the order they were set, the parser in an order of its own: keep the order
+        # of the document, so that a rewritten preamble is what resync would write
+        with open(path, "rb") as cl_file:
+            links = iter(range(len(self.ln)))
+            for e in iter_preamble(cl_file):
+                if e.tag == "{" + RS_NS + "}md":
+                    self.md = in_element_order(self.md, e)
+                elif e.tag == "{" + RS_NS + "}ln":
+                    i = next(links)
+                    self.ln[i] = in_element_order(self.ln[i], e)
+        self._disk_md = copy.deepcopy(self.md)
+        self._disk_ln = copy.deepcopy(self.ln)
+
+    def __len__(self):
+        return self.count + len(self.resources)
+
+    def preamble_changed(self):
+        return self.md != self._disk_md or self.ln != self._disk_ln
+
+    def write_appended(self, path, pretty_xml=False):
+        sm = Sitemap()
+        sm.pretty_xml = pretty_xml
+        fragments = "".join([tostring(sm.resource_etree_element(r), encoding="unicode")
+                             for r in self.resources]).encode("utf-8")
+        torn = self.size is not None and os.path.getsize(path) != self.size
+        if not torn and not self.preamble_changed():
+            try:
+                self._append(path, fragments)
+            except SitemapParseError:
+                torn = True
+        if torn:
+            LOG.warning("Recovering %s from an interrupted append" % path)
+            self._rewrite(path, fragments, pretty_xml, recover=True)
+        elif self.preamble_changed():
+            self._rewrite(path, fragments, pretty_xml)
+        self._disk_md = copy.deepcopy(self.md)
+        self._disk_ln = copy.deepcopy(self.ln)
+        self.size = os.path.getsize(path)
+
+    @staticmethod
+    def _closing_tag_offset(fh):
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        tail_start = max(0, size - 1024)
+        fh.seek(tail_start)
+        pos = fh.read().rfind(b"</urlset>")
+        if pos < 0:
+            raise SitemapParseError("Closing </urlset> not found in changelist")
+        return tail_start + pos
+
+    @staticmethod
+    def _last_url_end(fh, body_offset, limit):
+        """The offset after the last complete <url> element before limit, and its tail, or body_offset."""
+        end = limit
+        while end > body_offset:
+            start = max(body_offset, end - CHUNK_SIZE)
+            fh.seek(start)
+            pos = fh.read(end - start).rfind(b"</url>")
+            if pos >= 0:
+                offset = start + pos + len(b"</url>")
+                fh.seek(offset)
+                tail = fh.read(min(CHUNK_SIZE, limit - offset))
+                return offset + len(tail) - len(tail.lstrip())
+            if start == body_offset:
+                break
+            # chunks overlap, so that a tag across two of them is found
+            end = start + len(b"</url>") - 1
+        return body_offset
+
+    def _append(self, path, fragments):
+        with open(path, "r+b") as cl_file:
+            offset = self._closing_tag_offset(cl_file)
+            cl_file.seek(offset)
+            closing = cl_file.read()
+            cl_file.seek(offset)
+            # a single write, so that a crash leaves as little as possible to recover
+            cl_file.write(fragments + closing)
+            cl_file.truncate()
+            cl_file.flush()
+            os.fsync(cl_file.fileno())
+
+    def _empty_xml(self, pretty_xml):
+        preamble = ChangeList()
+        preamble.md = copy.deepcopy(self.md)
+        preamble.ln = copy.deepcopy(self.ln)
+        preamble.pretty_xml = pretty_xml
+        xml = preamble.as_xml()
+        split = xml.rindex("</urlset>")
+        return xml[:split].encode("utf-8"), xml[split:].encode("utf-8")
+
+    def _preamble_xml(self, pretty_xml):
+        return self._empty_xml(pretty_xml)[0]
+
+    def _closing_xml(self, pretty_xml):
+        return self._empty_xml(pretty_xml)[1]
+
+    @staticmethod
+    def _body_offset(fh, recover=False):
+        # the body starts at the first <url>, or at the closing tag of an empty changelist
+        fh.seek(0)
+        buf = b""
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            buf += chunk
+            for tag in (b"<url>", b"</urlset>"):
+                pos = buf.find(tag)
+                if pos >= 0:
+                    return pos
+            if not chunk:
+                if recover:
+                    # cut within the first <url> tag: the body starts after the last tag of the preamble
+                    return buf.rfind(b">") + 1
+                raise SitemapParseError("Neither <url> nor </urlset> found in changelist")
+
+    def _rewrite(self, path, fragments, pretty_xml, recover=False):
+        tmp_path = path + ".tmp"
+        preamble_xml = self._preamble_xml(pretty_xml)
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            body_offset = self._body_offset(src, recover=recover)
+            if recover:
+                limit = self.size if self.size is not None else os.fstat(src.fileno()).st_size
+                closing_offset = self._last_url_end(src, body_offset, limit)
+            else:
+                closing_offset = self._closing_tag_offset(src)
+            dst.write(preamble_xml)
+            src.seek(body_offset)
+            remaining = closing_offset - body_offset
+            while remaining > 0:
+                chunk = src.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                dst.write(chunk)
+                remaining -= len(chunk)
+            dst.write(fragments)
+            if recover:
+                dst.write(self._closing_xml(pretty_xml))
+            else:
+                src.seek(closing_offset)
+                dst.write(src.read())
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, path)
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import math
+import os
+import threading
+
+from omtdrspub.elastic.utils import write_atomically
+
+
+class BloomFilter(object):
+    """
+    A set of strings that answers "maybe" or "certainly not": with capacity strings added, "maybe" is wrong for
+    about error_rate of the strings that were not. Strings cannot be removed.
+
+    The num_hashes positions of a string are derived from a single blake2b digest (double hashing). The number of
+    strings added is estimated from the bits set (see :func:`count`), so that it keeps growing as the filter
+    fills up, when new strings set fewer and fewer new bits.
+    """
+
+    def __init__(self, capacity, error_rate=0.01, num_bits=None, num_hashes=None, bits: bytearray=None):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = num_bits or max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = num_hashes or max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.bits_set = bin(int.from_bytes(self.bits, "little")).count("1") if bits is not None else 0
+        # setting a bit is a read and a write of its byte
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    @property
+    def count(self) -> int:
+        """The number of distinct strings added, estimated from the bits set: -m/k * ln(1 - X/m)."""
+        if self.bits_set >= self.num_bits:
+            # full, and certainly over capacity
+            return self.num_bits
+        return int(round(-self.num_bits / self.num_hashes * math.log(1 - self.bits_set / self.num_bits)))
+
+    def add(self, key: str) -> bool:
+        """Add key; returns False if it was (maybe) there already."""
+        positions = self._positions(key)
+        added = False
+        with self._lock:
+            bits = self.bits
+            for position in positions:
+                mask = 1 << (position & 7)
+                if not bits[position >> 3] & mask:
+                    bits[position >> 3] |= mask
+                    self.bits_set += 1
+                    added = True
+        return added
+
+    def __contains__(self, key: str):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def save(self, path, **metadata):
+        """Save the filter to path, with metadata (json serializable) returned by :func:`load`."""
+        header = {'capacity': self.capacity, 'error_rate': self.error_rate, 'num_bits': self.num_bits,
+                  'num_hashes': self.num_hashes, 'count': self.count, 'metadata': metadata}
+
+        def write(tmp_path):
+            with open(tmp_path, "wb") as file:
+                file.write((json.dumps(header) + "\n").encode("utf-8"))
+                with self._lock:
+                    file.write(self.bits)
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        write_atomically(path, write)
+
+    @staticmethod
+    def load(path) -> ['BloomFilter', dict]:
+        """The filter saved at path and its metadata."""
+        with open(path, "rb") as file:
+            header = json.loads(file.readline().decode("utf-8"))
+            bits = bytearray(file.read())
+        if len(bits) != (header['num_bits'] + 7) // 8:
+            raise ValueError("Truncated bloom filter: %s" % path)
+        bloom_filter = BloomFilter(header['capacity'], header['error_rate'], num_bits=header['num_bits'],
+                                   num_hashes=header['num_hashes'], bits=bits)
+        return bloom_filter, header['metadata']
@@ -0,0 +1,89 @@
+import json
+import os
+
+import logging
+from rspub.core.executors import SitemapData
+
+LOG = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = ".resourcelist-checkpoint.json"
+
+
+class ResourceListCheckpoint(object):
+    """
+    Progress of a resourcelist generation, saved in the metadata dir after every finished resourcelist.
+
+    cursor is the _id of the last resource written: resources are scrolled in _uid order, so that a
+    restarted run can continue right after it. files holds the SitemapData of the finished resourcelists.
+    """
+
+    def __init__(self, path, date_start_processing=None, index_url=None, changes_erased=False, cursor=None,
+                 count=0, files=None):
+        self.path = path
+        self.date_start_processing = date_start_processing
+        self.index_url = index_url
+        self.changes_erased = changes_erased
+        self.cursor = cursor
+        self.count = count
+        self.files = files if files is not None else []
+
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as cp_file:
+            dct = json.load(cp_file)
+        return ResourceListCheckpoint(path, **dct)
+
+    def finished_file(self, sitemap_data: SitemapData, cursor):
+        self.files.append(dict(sitemap_data.__dict__))
+        self.count += sitemap_data.resource_count
+        self.cursor = cursor
+        self.save()
+
+    def finished_paths(self):
+        return {os.path.abspath(f['path']) for f in self.files}
+
+    def matches(self, manifest) -> bool:
+        """
+        Whether the finished resourcelists are still the ones in the metadata dir, as recorded in its
+        :class:`PublicationManifest`: the checkpoint of a run is useless once another run has written them.
+        """
+        for ordinal, dct in enumerate(self.files):
+            entry = manifest.get(dct['path'])
+            if dct['ordinal'] != ordinal or entry is None or entry['ordinal'] != ordinal \
+                    or entry['md_completed'] != dct['doc_end'] or not os.path.exists(dct['path']):
+                return False
+        return True
+
+    def sitemap_data(self) -> [SitemapData]:
+        sitemap_data_iter = []
+        for dct in self.files:
+            sitemap_data = SitemapData()
+            for key, value in dct.items():
+                setattr(sitemap_data, key, value)
+            sitemap_data_iter.append(sitemap_data)
+        return sitemap_data_iter
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as cp_file:
+            json.dump({
+                'date_start_processing': self.date_start_processing,
+                'index_url': self.index_url,
+                'changes_erased': self.changes_erased,
+                'cursor': self.cursor,
+                'count': self.count,
+                'files': self.files
+            }, cp_file)
+            cp_file.flush()
+            os.fsync(cp_file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        remove_checkpoint(self.path)
+
+
+def remove_checkpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,268 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import heapq
+import json
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+
+import logging
+import yaml
+from rspub.core.rs_enum import Strategy
+from rspub.util import defaults
+
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_changedump import ElasticNewChangeDumpExecutor
+from omtdrspub.elastic.exe_elastic_changelist import ElasticNewChangeListExecutor, \
+    ElasticIncrementalChangeListExecutor
+from omtdrspub.elastic.exe_elastic_resourcedump import ElasticResourceDumpExecutor
+from omtdrspub.elastic.exe_elastic_resourcelist import ElasticResourceListExecutor
+from omtdrspub.elastic.trigger import ChangeTrigger
+
+LOG = logging.getLogger(__name__)
+
+# job name -> executor
+EXECUTORS = {
+    Strategy.resourcelist.name: ElasticResourceListExecutor,
+    Strategy.new_changelist.name: ElasticNewChangeListExecutor,
+    Strategy.inc_changelist.name: ElasticIncrementalChangeListExecutor,
+    "resourcedump": ElasticResourceDumpExecutor,
+    "new_changedump": ElasticNewChangeDumpExecutor
+}
+
+# scheduled check of the change trigger of a set
+TRIGGER_JOB = "change_trigger"
+
+
+class PublicationSet(object):
+    """
+    A resource set published by the daemon: its parameters, built once, its schedules (job name -> seconds
+    between runs) and the outcome of its last runs. Jobs of the same set never run concurrently.
+
+    With a trigger, pending changes are also published by the incremental changelist strategy as soon as the
+    trigger is due; it is checked every trigger_interval seconds, see :class:`ChangeTrigger`.
+    """
+
+    def __init__(self, para: ElasticRsParameters, schedules: dict=None, trigger: ChangeTrigger=None,
+                 trigger_interval=30):
+        for job in (schedules or {}):
+            if job not in EXECUTORS:
+                raise ValueError("Unknown job for resource set %s: %s" % (para.resource_set, job))
+        self.para = para
+        self.schedules = dict(schedules) if schedules is not None else {}
+        self.trigger = trigger
+        if trigger is not None:
+            self.schedules[TRIGGER_JOB] = trigger_interval
+        self.lock = threading.Lock()
+        self.running = None
+        # job name -> {'start': ..., 'end': ..., 'error': ...}
+        self.runs = {}
+
+    @property
+    def name(self):
+        return self.para.resource_set
+
+    def status(self) -> dict:
+        return {'running': self.running, 'schedules': self.schedules, 'runs': self.runs}
+
+
+class ElasticDaemon(object):
+    """
+    Keeps generating the documents of a number of resource sets, in a single long-running process.
+
+    Parameters are built once per set and elasticsearch clients are shared by all runs (see
+    :class:`ElasticQueryManager`), so that a run only pays for the documents it generates. Jobs run on their
+    schedules in a pool of workers threads, and can be triggered through the control interface, a line based
+    protocol on a local tcp port:
+
+        run <resource_set> <job>    queue a run of a job
+        status                      state of every set, as json
+        stop                        stop the daemon after the running jobs
+
+    A changelist or changedump job on a set without resourcelists runs the resourcelist job instead, as
+    :class:`ElasticResourceSync` does.
+    """
+
+    def __init__(self, sets: [PublicationSet], workers=4, control_host="127.0.0.1", control_port=None):
+        self.sets = {publication_set.name: publication_set for publication_set in sets}
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.control_address = (control_host, control_port) if control_port is not None else None
+        self._control_server = None
+        self._condition = threading.Condition()
+        self._stopped = False
+        # (due time, sequence, set name, job)
+        self._schedule = []
+        self._sequence = 0
+        # set once serve_forever is accepting commands
+        self.ready = threading.Event()
+
+    @staticmethod
+    def from_yaml(config_file):
+        with open(config_file, 'r') as f:
+            config = yaml.load(f)['daemon']
+        sets = []
+        for set_config in config['sets']:
+            para = ElasticRsParameters.from_yaml_params(set_config['config'])
+            trigger_config = set_config.get('trigger') or {}
+            trigger = None
+            if len(trigger_config) > 0:
+                trigger = ChangeTrigger(para, max_changes=trigger_config.get('max_changes'),
+                                        max_age=trigger_config.get('max_age'))
+            sets.append(PublicationSet(para, schedules=set_config.get('schedules'), trigger=trigger,
+                                       trigger_interval=trigger_config.get('interval', 30)))
+        return ElasticDaemon(sets, workers=config.get('workers', 4),
+                             control_host=config.get('control_host', "127.0.0.1"),
+                             control_port=config.get('control_port'))
+
+    def run_job(self, set_name, job, wait=True):
+        """Run a job of a set in the calling thread. Returns False if wait is False and the set is busy."""
+        publication_set = self.sets[set_name]
+        if not publication_set.lock.acquire(blocking=wait):
+            return False
+        try:
+            self._run_locked(publication_set, job)
+        finally:
+            publication_set.lock.release()
+        return True
+
+    @staticmethod
+    def _run_locked(publication_set: PublicationSet, job):
+        # the caller holds the lock of the set
+        para = publication_set.para
+        if job != Strategy.resourcelist.name and job != "resourcedump" and \
+                len(glob(para.abs_metadata_path("resourcelist_*.xml"))) == 0:
+            # always start a fresh publication with a resourcelist
+            job = Strategy.resourcelist.name
+        publication_set.running = job
+        run = {'start': defaults.w3c_now(), 'end': None, 'error': None}
+        publication_set.runs[job] = run
+        LOG.info("Running %s of %s" % (job, publication_set.name))
+        try:
+            EXECUTORS[job](para).execute()
+        except Exception as err:
+            LOG.exception("%s of %s failed" % (job, publication_set.name))
+            run['error'] = repr(err)
+        finally:
+            run['end'] = defaults.w3c_now()
+            publication_set.running = None
+
+    def trigger(self, set_name, job):
+        """Queue a run of a job of a set."""
+        if set_name not in self.sets:
+            raise KeyError("Unknown resource set: %s" % set_name)
+        if job not in EXECUTORS:
+            raise KeyError("Unknown job: %s" % job)
+        return self.pool.submit(self.run_job, set_name, job)
+
+    def status(self) -> dict:
+        return {name: publication_set.status() for name, publication_set in self.sets.items()}
+
+    def schedule(self, set_name, job, due):
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._schedule, (due, self._sequence, set_name, job))
+            self._condition.notify()
+
+    def serve_forever(self):
+        """Run scheduled jobs, and serve the control interface, until stop is called."""
+        now = time.monotonic()
+        for publication_set in self.sets.values():
+            for job in publication_set.schedules:
+                self.schedule(publication_set.name, job, now)
+        if self.control_address is not None:
+            self._control_server = ControlServer(self.control_address, self)
+            threading.Thread(target=self._control_server.serve_forever, name="daemon-control",
+                             daemon=True).start()
+            LOG.info("Control interface listening on %s:%d" % self._control_server.server_address[:2])
+        self.ready.set()
+        try:
+            while True:
+                with self._condition:
+                    while not self._stopped and \
+                            (len(self._schedule) == 0 or self._schedule[0][0] > time.monotonic()):
+                        timeout = self._schedule[0][0] - time.monotonic() if len(self._schedule) > 0 else None
+                        self._condition.wait(timeout)
+                    if self._stopped:
+                        break
+                    due, sequence, set_name, job = heapq.heappop(self._schedule)
+                self.pool.submit(self._run_scheduled, set_name, job)
+                # a daemon that fell behind does not catch up with the runs it missed
+                self.schedule(set_name, job, max(due + self.sets[set_name].schedules[job], time.monotonic()))
+        finally:
+            if self._control_server is not None:
+                self._control_server.shutdown()
+                self._control_server.server_close()
+            self.pool.shutdown(wait=True)
+
+    def _run_scheduled(self, set_name, job):
+        publication_set = self.sets[set_name]
+        if not publication_set.lock.acquire(blocking=False):
+            if job != TRIGGER_JOB:
+                LOG.info("Skipping %s of %s: a previous job is still running" % (job, set_name))
+            return
+        try:
+            if job == TRIGGER_JOB:
+                # checked under the lock of the set: no job of the set is using its parameters meanwhile
+                try:
+                    if not publication_set.trigger.is_due():
+                        return
+                except Exception:
+                    LOG.exception("Change trigger of %s failed" % set_name)
+                    return
+                job = Strategy.inc_changelist.name
+            self._run_locked(publication_set, job)
+        finally:
+            publication_set.lock.release()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        daemon = self.server.daemon
+        for line in self.rfile:
+            command = line.decode("utf-8").split()
+            if len(command) == 0:
+                continue
+            try:
+                if command[0] == "run" and len(command) == 3:
+                    daemon.trigger(command[1], command[2])
+                    response = {'queued': command[2], 'resource_set': command[1]}
+                elif command[0] == "status" and len(command) == 1:
+                    response = daemon.status()
+                elif command[0] == "stop" and len(command) == 1:
+                    daemon.stop()
+                    response = {'stopping': True}
+                else:
+                    response = {'error': "Unknown command: %s" % " ".join(command)}
+            except KeyError as err:
+                response = {'error': str(err.args[0])}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class ControlServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, daemon: ElasticDaemon):
+        self.daemon = daemon
+        super(ControlServer, self).__init__(server_address, ControlHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate ResourceSync documents of resource sets on schedule")
+    parser.add_argument("config", help="yaml file with a 'daemon' section")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    ElasticDaemon.from_yaml(args.config).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
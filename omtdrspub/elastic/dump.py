@@ -0,0 +1,216 @@
+import base64
+import hashlib
+import os
+import queue
+import shutil
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+from resync import Resource
+from rspub.util import defaults
+
+LOG = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+# chunks read ahead of compression, per package
+READ_AHEAD = 8
+
+MANIFEST_NAME = "manifest.xml"
+
+RESOURCES_DIR = "resources"
+
+
+class PackageWriter(object):
+    """
+    Writes ResourceSync dump packages: ZIP files holding a set of resources and their manifest.
+
+    Entries are (Resource, file path) pairs. They are grouped into packages of at most max_size bytes
+    (as known from the resource length) and max_items resources, and every package is written by one of
+    workers threads: bitstreams are copied in chunks of CHUNK_SIZE, read by a separate thread up to READ_AHEAD
+    chunks ahead of compression, so that memory does not depend on the size of the files. At most two packages
+    per worker are waiting to be written.
+    The manifest (manifest_class, e.g. resync's ResourceDumpManifest) records the length and md5 of the
+    bytes actually packaged and the path of each resource in the package; it is written last, as manifest.xml.
+    Entries without a file path (deleted resources in a changedump) are only listed in the manifest. Files that
+    cannot be read are left out of the package and of its manifest; if one fails partway, after its bytes were
+    started in the package, the package is copied once without it.
+
+    package_location(ordinal) gives the path and uri of a package. md, if given, is set on every manifest and
+    package resource (e.g. md_from and md_until), instead of the time the package was written (md_at and
+    md_completed).
+    """
+
+    def __init__(self, manifest_class, package_location, res_root_dir, max_size, max_items, workers=None,
+                 pretty_xml=False, md: dict=None):
+        self.manifest_class = manifest_class
+        self.package_location = package_location
+        self.res_root_dir = os.path.abspath(res_root_dir)
+        self.max_size = max_size
+        self.max_items = max_items
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.pretty_xml = pretty_xml
+        self.md = md
+
+    def packages(self, entries: iter) -> iter:
+        """Write packages from entries, yield a Resource for every package, in order."""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for ordinal, batch in enumerate(self.batches(entries)):
+                pending.append(pool.submit(self.write_package, ordinal, batch))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def batches(self, entries: iter) -> iter:
+        batch = []
+        batch_size = 0
+        for resource, file_path in entries:
+            length = resource.length
+            if length is None and file_path is not None:
+                try:
+                    length = os.path.getsize(file_path)
+                except OSError:
+                    length = 0
+            length = length or 0
+            if len(batch) > 0 and (batch_size + length > self.max_size or len(batch) >= self.max_items):
+                yield batch
+                batch = []
+                batch_size = 0
+            batch.append((resource, file_path))
+            batch_size += length
+        if len(batch) > 0:
+            yield batch
+
+    def write_package(self, ordinal, batch) -> Resource:
+        path, uri = self.package_location(ordinal)
+        md = self.md if self.md is not None else {'md_at': defaults.w3c_now()}
+        manifest = self.manifest_class()
+        for key, value in md.items():
+            setattr(manifest, key, value)
+        tmp_path = path + ".tmp"
+        try:
+            self.write_entries(tmp_path, manifest, md, batch)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        LOG.info("Package # %d written with %d resources: %s" % (ordinal, len(manifest), path))
+        package_resource = Resource(uri=uri, length=os.path.getsize(path), mime_type="application/zip")
+        for key, value in md.items():
+            setattr(package_resource, key, value)
+        return package_resource
+
+    def write_entries(self, tmp_path, manifest, md: dict, batch):
+        chunks = queue.Queue(maxsize=READ_AHEAD)
+        stop = threading.Event()
+        reader = threading.Thread(target=self.read_files, args=(batch, chunks, stop), name="package-reader",
+                                  daemon=True)
+        reader.start()
+        # entries whose bytes are incomplete
+        torn = set()
+        try:
+            with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as package:
+                for resource, file_path in batch:
+                    if file_path is None:
+                        manifest.add(resource)
+                        continue
+                    arcname = self.arcname(file_path)
+                    if arcname is None:
+                        LOG.warning("Not packaging %s: outside of %s" % (file_path, self.res_root_dir))
+                        continue
+                    try:
+                        resource.length, resource.md5 = self.write_file(package, chunks, arcname)
+                    except OSError as err:
+                        LOG.warning("Not packaging %s: %s" % (file_path, err))
+                        if arcname in package.namelist():
+                            torn.add(arcname)
+                        continue
+                    resource.path = "/" + arcname
+                    manifest.add(resource)
+                if self.md is None:
+                    md['md_completed'] = defaults.w3c_now()
+                    manifest.md_completed = md['md_completed']
+                manifest.pretty_xml = self.pretty_xml
+                package.writestr(MANIFEST_NAME, manifest.as_xml())
+        finally:
+            stop.set()
+            reader.join()
+        if len(torn) > 0:
+            self.copy_without(tmp_path, torn)
+
+    @staticmethod
+    def copy_without(path, arcnames: set):
+        """Copy the package at path without the entries arcnames."""
+        copy_path = path + ".copy"
+        try:
+            with zipfile.ZipFile(path) as src, \
+                    zipfile.ZipFile(copy_path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as dst:
+                for info in src.infolist():
+                    if info.filename in arcnames:
+                        continue
+                    with src.open(info) as src_entry, dst.open(info.filename, "w", force_zip64=True) as dst_entry:
+                        shutil.copyfileobj(src_entry, dst_entry, CHUNK_SIZE)
+            os.replace(copy_path, path)
+        finally:
+            if os.path.exists(copy_path):
+                os.remove(copy_path)
+
+    def arcname(self, file_path):
+        rel_path = os.path.relpath(os.path.abspath(file_path), self.res_root_dir)
+        if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+            return None
+        return RESOURCES_DIR + "/" + rel_path.replace(os.sep, "/")
+
+    def read_files(self, batch, chunks: queue.Queue, stop: threading.Event):
+        """
+        Put the chunks of every packaged file in chunks, followed by None; an exception instead, if the file
+        cannot be read.
+        """
+        def put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        for resource, file_path in batch:
+            if file_path is None or self.arcname(file_path) is None:
+                continue
+            try:
+                with open(file_path, "rb") as src:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not put(chunk if chunk else None):
+                            return
+                        if not chunk:
+                            break
+            except OSError as err:
+                if not put(err):
+                    return
+
+    @staticmethod
+    def write_file(package: zipfile.ZipFile, chunks: queue.Queue, arcname) -> [int, str]:
+        md5 = hashlib.md5()
+        length = 0
+        chunk = chunks.get()
+        if isinstance(chunk, Exception):
+            raise chunk
+        with package.open(arcname, "w", force_zip64=True) as dst:
+            while chunk is not None:
+                if isinstance(chunk, Exception):
+                    # the file could not be read completely
+                    raise chunk
+                md5.update(chunk)
+                dst.write(chunk)
+                length += len(chunk)
+                chunk = chunks.get()
+        # resync expresses md5 hashes in base64
+        return length, base64.b64encode(md5.digest()).decode("ascii")
@@ -1,7 +1,16 @@
 #! /usr/bin/env python3
 # -*- coding: utf-8 -*-
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
 from rspub.core.rs_enum import Strategy
 from omtdrspub.elastic.elastic_rs import ElasticResourceSync
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_changedump import ElasticNewChangeDumpExecutor
+from omtdrspub.elastic.exe_elastic_resourcedump import ElasticResourceDumpExecutor
+
+LOG = logging.getLogger(__name__)
 
 
 class ElasticGenerator(object):
@@ -25,3 +34,68 @@ class ElasticGenerator(object):
         self.config.strategy = Strategy.inc_changelist.value
         return self._generate()
 
+    def generate_resourcedump(self):
+        executor = ElasticResourceDumpExecutor(ElasticRsParameters(**self.config.__dict__))
+        return executor.execute()
+
+    def generate_new_changedump(self):
+        executor = ElasticNewChangeDumpExecutor(ElasticRsParameters(**self.config.__dict__))
+        return executor.execute()
+
+
+class GenerationResult(object):
+    """Outcome of the generation of a resource set: the new sitemaps or, if it failed, the error."""
+
+    def __init__(self, resource_set, sitemaps=None, error: Exception=None, trace: str=None):
+        self.resource_set = resource_set
+        self.sitemaps = sitemaps
+        self.error = error
+        self.trace = trace
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+class ElasticBatchGenerator(object):
+    """
+    Generates the documents of many resource sets concurrently, at most max_workers at a time.
+
+    Sets run in threads of the same process, so that they share the Elasticsearch connections (see
+    :class:`ElasticQueryManager`); generation mostly waits on Elasticsearch and on the disk. A set that fails
+    does not stop the others: every method returns a :class:`GenerationResult` per resource set.
+    """
+
+    def __init__(self, configs: list, max_workers=4):
+        resource_sets = [config.resource_set for config in configs]
+        if len(set(resource_sets)) < len(resource_sets):
+            raise ValueError("Every resource set can only be generated once per batch: %s" % resource_sets)
+        self.configs = configs
+        self.max_workers = max_workers
+
+    def _generate(self, method_name) -> {str: GenerationResult}:
+        def generate(config):
+            try:
+                return GenerationResult(config.resource_set, sitemaps=getattr(ElasticGenerator(config), method_name)())
+            except Exception as err:
+                LOG.exception("Generation of %s failed" % config.resource_set)
+                return GenerationResult(config.resource_set, error=err, trace=traceback.format_exc())
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(generate, self.configs))
+        return {result.resource_set: result for result in results}
+
+    def generate_resourcelist(self):
+        return self._generate("generate_resourcelist")
+
+    def generate_new_changelist(self):
+        return self._generate("generate_new_changelist")
+
+    def generate_inc_changelist(self):
+        return self._generate("generate_inc_changelist")
+
+    def generate_resourcedump(self):
+        return self._generate("generate_resourcedump")
+
+    def generate_new_changedump(self):
+        return self._generate("generate_new_changedump")
@@ -1,9 +1,12 @@
-from datetime import datetime
+import os
+import threading
+from datetime import datetime, timedelta
 
 from elasticsearch import Elasticsearch
 from rspub.util import defaults
 
 from omtdrspub.elastic import utils
+from omtdrspub.elastic.bloom import BloomFilter
 from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
 from omtdrspub.elastic.model.change_doc import ChangeDoc
 from omtdrspub.elastic.model.location import Location
@@ -42,6 +45,77 @@ def location_query(resource_set, location: Location):
     }
 
 
+def locations_query(resource_set, locations: [Location]):
+    values = {}
+    for location in locations:
+        values.setdefault(location.loc_type, set()).add(location.value)
+    return {
+        "query": {
+            "bool": {
+                "must": [
+                    {
+                        "term": {"resource_set": resource_set}
+                    },
+                    {
+                        "nested": {
+                            "path": "location",
+                            "query": {
+                                "bool": {
+                                    "should": [
+                                        {
+                                            "bool": {
+                                                "must": [
+                                                    {
+                                                        "term": {"location.type": loc_type}
+                                                    },
+                                                    {
+                                                        "terms": {"location.value": sorted(loc_values)}
+                                                    }
+                                                ]
+                                            }
+                                        } for loc_type, loc_values in sorted(values.items())
+                                    ]
+                                }
+                            }
+                        }
+                    }
+                ]
+            }
+        }
+    }
+
+
+def location_prefix_query(resource_set, loc_type, prefix):
+    return {
+        "query": {
+            "bool": {
+                "must": [
+                    {
+                        "term": {"resource_set": resource_set}
+                    },
+                    {
+                        "nested": {
+                            "path": "location",
+                            "query": {
+                                "bool": {
+                                    "must": [
+                                        {
+                                            "term": {"location.type": loc_type}
+                                        },
+                                        {
+                                            "prefix": {"location.value": prefix}
+                                        }
+                                    ]
+                                }
+                            }
+                        }
+                    }
+                ]
+            }
+        }
+    }
+
+
 def resource_set_query(resource_set):
     return {
         "query": {
@@ -85,7 +159,44 @@ class ResourceNotFound(TypeError):
     pass
 
 
+# margin on the time a location filter was saved or refreshed, when catching up with the documents indexed
+# since: covers the clocks of the producers and the time documents take to be written and searchable once stamped
+LOCATION_FILTER_MARGIN = timedelta(minutes=1)
+
+
+def location_key(location) -> str:
+    return location.loc_type + "\0" + location.value
+
+
+class LocationFilter(object):
+    """A bloom filter of the locations of a resource set, see :func:`ElasticQueryManager.use_location_filter`."""
+
+    __slots__ = ('bloom_filter', 'path', 'refresh', 'max_items_in_list', 'refreshed_at', 'ready', 'lock')
+
+    def __init__(self, bloom_filter: BloomFilter, path, refresh, max_items_in_list):
+        self.bloom_filter = bloom_filter
+        self.path = path
+        # seconds a negative answer is trusted without catching up with the writes of other processes
+        self.refresh = timedelta(seconds=refresh)
+        self.max_items_in_list = max_items_in_list
+        # the documents indexed before this time (less the margin) are in the filter
+        self.refreshed_at = None
+        # consulted once filled
+        self.ready = False
+        # one refresh at a time
+        self.lock = threading.Lock()
+
+
 class ElasticQueryManager:
+    # Elasticsearch clients are thread safe: query managers of the same process share one per host and port,
+    # so that its connections are kept open between executions
+    _clients = {}
+    _clients_lock = threading.Lock()
+    # filters of the locations of resource sets, shared as the clients and updated by every write of the process:
+    # (host, port, index, doc_type, resource_set) -> LocationFilter
+    _location_filters = {}
+    _location_filters_lock = threading.Lock()
+
     def __init__(self, host: str, port: str):
         self._host = host
         self._port = port
@@ -100,13 +211,19 @@ class ElasticQueryManager:
         return self._port
 
     def resource_exists(self, index, doc_type, resource_set, location):
+        location_filter = ElasticQueryManager._location_filters.get((self.host, self.port, index, doc_type,
+                                                                      resource_set))
+        if location_filter is not None and location_filter.ready and \
+                not self._may_be_indexed(location_filter, index, doc_type, resource_set, location):
+            # certainly not indexed, see use_location_filter
+            return False
         return False if self.get_document_by_location(index=index, doc_type=doc_type,
                                                       resource_set=resource_set, location=location) is None else True
 
     def get_document_by_location(self, index, doc_type, resource_set, location: Location):
         query = location_query(resource_set=resource_set, location=location)
         result = self._instance.search(index=index, doc_type=doc_type, body=query)
-        hits = [ResourceDoc.as_resource_doc(hit['_source']) for hit in result['hits']['hits']]
+        hits = [ResourceDoc.from_source(hit['_source']) for hit in result['hits']['hits']]
         if len(hits) == 0:
             return None
         elif len(hits) > 1:
@@ -115,12 +232,27 @@ class ElasticQueryManager:
         elif len(hits) == 1:
             return hits[0]
 
+    def get_documents_by_locations(self, index, doc_type, resource_set, locations: [Location]):
+        """The hits of the resource documents of the given locations, more than one for duplicated locations."""
+        if len(locations) == 0:
+            return []
+        # room for a few duplicates
+        result = self._instance.search(index=index, doc_type=doc_type, body=locations_query(resource_set, locations),
+                                       size=2 * len(locations) + 10)
+        return result['hits']['hits']
+
     def get_document_by_elastic_id(self, index, doc_type, elastic_id):
         return self._instance.get(index=index, doc_type=doc_type, id=elastic_id, ignore=404)
 
     def es_instance(self) -> Elasticsearch:
-        return Elasticsearch([{"host": self.host, "port": self.port}], timeout=30, max_retries=10,
-                             retry_on_timeout=True)
+        key = (self.host, self.port)
+        with ElasticQueryManager._clients_lock:
+            instance = ElasticQueryManager._clients.get(key)
+            if instance is None:
+                instance = Elasticsearch([{"host": self.host, "port": self.port}], timeout=30, max_retries=10,
+                                         retry_on_timeout=True)
+                ElasticQueryManager._clients[key] = instance
+        return instance
 
     def create_index(self, index, mapping):
         return self._instance.indices.create(index=index, body=mapping, ignore=400)
@@ -132,9 +264,28 @@ class ElasticQueryManager:
         return self._instance.delete(index=index, doc_type=doc_type, id=elastic_id, ignore=404)
 
     def index_document(self, index, doc_type, doc, elastic_id=None, op_type='index'):
+        self._remember_location(index, doc_type, doc)
         return self._instance.index(index=index, doc_type=doc_type, id=elastic_id, body=doc, op_type=op_type,
                                     ignore=409)
 
+    def bulk(self, index, operations):
+        """
+        Send (op_type, doc_type, elastic_id, doc) operations in a single bulk request; doc is None for deletes
+        and elastic_id is None for documents indexed with a generated id. Returns the item of each operation.
+        """
+        body = []
+        for op_type, doc_type, elastic_id, doc in operations:
+            action = {'_index': index, '_type': doc_type}
+            if elastic_id is not None:
+                action['_id'] = elastic_id
+            body.append({op_type: action})
+            if doc is not None:
+                self._remember_location(index, doc_type, doc)
+                body.append(doc)
+        if len(body) == 0:
+            return []
+        return self._instance.bulk(body=body)['items']
+
     def delete_document_by_location(self, index, resource_doc_type, resource_set, location: Location):
         query = location_query(resource_set=resource_set, location=location)
         return self._instance.delete_by_query(index=index, doc_type=resource_doc_type, body=query)
@@ -143,6 +294,102 @@ class ElasticQueryManager:
         query = resource_set_query(resource_set)
         self._instance.delete_by_query(index=index, doc_type=doc_type, body=query)
 
+    def use_location_filter(self, params: ElasticRsParameters, rebuild=False) -> BloomFilter:
+        """
+        Answer :func:`resource_exists` for the resource set of params from a bloom filter of its locations when
+        they are certainly not indexed, without querying Elasticsearch.
+
+        The filter is loaded from params.abs_location_filter_path() and caught up with the resource documents
+        indexed since it was saved (according to their timestamp), or, if there is none or rebuild, built from a
+        scroll of all the locations. From then on, every resource document indexed by a query manager of this
+        process is added to it. The writes of other processes (e.g. the ingest service, a journal replayer or
+        another producer) are only seen when the filter catches up, on the first negative answer
+        params.location_filter_refresh seconds after the last: meanwhile, a location they have just indexed can
+        be reported as not indexed. Use it when this process is the only writer of the resource set, or when
+        such a false negative is harmless. Documents indexed without a timestamp by other processes are only
+        seen when the filter is built again.
+        """
+        index = params.elastic_index
+        doc_type = params.elastic_resource_doc_type
+        key = (self.host, self.port, index, doc_type, params.resource_set)
+        path = params.abs_location_filter_path()
+        started_at = datetime.now()
+        bloom_filter = None
+        since = None
+        if not rebuild and os.path.exists(path):
+            bloom_filter, metadata = BloomFilter.load(path)
+            since = datetime.strptime(metadata['saved_at'], "%Y-%m-%dT%H:%M:%SZ")
+        if bloom_filter is None or bloom_filter.count > bloom_filter.capacity:
+            count = self.count_documents(index=index, doc_type=doc_type,
+                                         query=resource_set_query(params.resource_set))
+            bloom_filter = BloomFilter(max(params.location_filter_capacity, 2 * count))
+            since = None
+
+        location_filter = LocationFilter(bloom_filter, path, params.location_filter_refresh,
+                                         params.max_items_in_list)
+        with ElasticQueryManager._location_filters_lock:
+            # writes from now on are added while the filter is filled
+            ElasticQueryManager._location_filters[key] = location_filter
+        self._add_locations(location_filter, index, doc_type, params.resource_set, since)
+        location_filter.refreshed_at = started_at
+        location_filter.ready = True
+        return bloom_filter
+
+    def refresh_location_filter(self, location_filter: LocationFilter, index, doc_type, resource_set):
+        """Add the locations indexed since the filter was last refreshed, by any process."""
+        with location_filter.lock:
+            refreshed_at = location_filter.refreshed_at
+            started_at = datetime.now()
+            if started_at - refreshed_at < location_filter.refresh:
+                # refreshed by another thread in the meantime
+                return
+            self._add_locations(location_filter, index, doc_type, resource_set, refreshed_at)
+            location_filter.refreshed_at = started_at
+
+    def save_location_filters(self):
+        """Save the location filters of this process, see use_location_filter."""
+        with ElasticQueryManager._location_filters_lock:
+            location_filters = [location_filter for location_filter in ElasticQueryManager._location_filters.values()
+                                if location_filter.ready]
+        for location_filter in location_filters:
+            # what was indexed since the last refresh is not known to be in the filter
+            location_filter.bloom_filter.save(location_filter.path,
+                                              saved_at=utils.formatted_date(location_filter.refreshed_at))
+
+    def _may_be_indexed(self, location_filter: LocationFilter, index, doc_type, resource_set, location) -> bool:
+        key = location_key(location)
+        if key in location_filter.bloom_filter:
+            return True
+        if datetime.now() - location_filter.refreshed_at < location_filter.refresh:
+            return False
+        self.refresh_location_filter(location_filter, index, doc_type, resource_set)
+        return key in location_filter.bloom_filter
+
+    def _add_locations(self, location_filter: LocationFilter, index, doc_type, resource_set, since=None):
+        """Add the locations of the resource set to the filter, or only of those indexed since (a datetime)."""
+        query = resource_set_query(resource_set)
+        if since is not None:
+            query["query"]["bool"]["must"].append(
+                {"range": {"timestamp": {"gte": utils.formatted_date(since - LOCATION_FILTER_MARGIN)}}})
+        query["_source"] = ["location"]
+        bloom_filter = location_filter.bloom_filter
+        for e_page in self.scan_and_scroll(index=index, doc_type=doc_type, query=query,
+                                           max_items_in_list=location_filter.max_items_in_list,
+                                           max_result_window=10000):
+            for e_hit in e_page:
+                bloom_filter.add(location_key(Location.from_source(e_hit['_source']['location'])))
+
+    def _remember_location(self, index, doc_type, doc):
+        if len(ElasticQueryManager._location_filters) == 0 or not isinstance(doc, dict):
+            return
+        location_filter = ElasticQueryManager._location_filters.get((self.host, self.port, index, doc_type,
+                                                                     doc.get('resource_set')))
+        if location_filter is not None and doc.get('location') is not None:
+            location_filter.bloom_filter.add(location_key(Location.from_source(doc['location'])))
+
+    def count_documents(self, index, doc_type, query):
+        return self._instance.count(index=index, doc_type=doc_type, body=query)['count']
+
     def refresh_index(self, index):
         return self._instance.indices.refresh(index=index)
 
@@ -194,7 +441,7 @@ class ElasticQueryManager:
                                    length=length, md5=md5, mime=mime, lastmod=lastmod,
                                    ln=ln, timestamp=utils.formatted_date(datetime.now()))
         response = self.index_document(index=index, doc_type=params.elastic_resource_doc_type,
-                                       doc=resource_doc.to_dict(), elastic_id=elastic_id, op_type='index')
+                                       doc=resource_doc.to_source(), elastic_id=elastic_id, op_type='index')
 
         if response.get('error') is None and record_change:
             if response.get('created') is False:
@@ -206,7 +453,7 @@ class ElasticQueryManager:
                                    location=location, lastmod=lastmod, change=change,
                                    datetime=utils.formatted_date(datetime.now()),
                                    timestamp=utils.formatted_date(datetime.now()))
-            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_dict())
+            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_source())
 
         return response
 
@@ -216,16 +463,17 @@ class ElasticQueryManager:
         index = params.elastic_index
 
         resource_doc = ResourceDoc(resync_id=elastic_id, resource_set=params.resource_set, location=location,
-                                   length=length, md5=md5, mime=mime, lastmod=lastmod, ln=ln)
+                                   length=length, md5=md5, mime=mime, lastmod=lastmod,
+                                   ln=ln, timestamp=utils.formatted_date(datetime.now()))
         response = self.index_document(index=index, doc_type=params.elastic_resource_doc_type,
-                                       doc=resource_doc.to_dict(), elastic_id=elastic_id, op_type='create')
+                                       doc=resource_doc.to_source(), elastic_id=elastic_id, op_type='create')
 
         if response.get('error') is None and record_change:
             change_doc = ChangeDoc(resource_set=params.resource_set,
                                    location=location, lastmod=lastmod, change='created',
                                    datetime=utils.formatted_date(datetime.now()),
                                    timestamp=utils.formatted_date(datetime.now()))
-            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_dict())
+            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_source())
 
         return response
 
@@ -235,16 +483,17 @@ class ElasticQueryManager:
         index = params.elastic_index
 
         resource_doc = ResourceDoc(resync_id=elastic_id, resource_set=params.resource_set, location=location,
-                                   length=length, md5=md5, mime=mime, lastmod=lastmod, ln=ln)
+                                   length=length, md5=md5, mime=mime, lastmod=lastmod,
+                                   ln=ln, timestamp=utils.formatted_date(datetime.now()))
         response = self.index_document(index=index, doc_type=params.elastic_resource_doc_type,
-                                       doc=resource_doc.to_dict(), elastic_id=elastic_id, op_type='index')
+                                       doc=resource_doc.to_source(), elastic_id=elastic_id, op_type='index')
 
         if response.get('error') is None and record_change:
             change_doc = ChangeDoc(resource_set=params.resource_set,
                                    location=location, lastmod=lastmod, change='updated',
                                    datetime=utils.formatted_date(datetime.now()),
                                    timestamp=utils.formatted_date(datetime.now()))
-            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_dict())
+            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_source())
 
         return response
 
@@ -260,7 +509,7 @@ class ElasticQueryManager:
                                    location=location, change='deleted',
                                    datetime=utils.formatted_date(datetime.now()),
                                    timestamp=utils.formatted_date(datetime.now()))
-            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_dict())
+            self.index_document(index=index, doc_type=params.elastic_change_doc_type, doc=change_doc.to_source())
 
         return response
 
@@ -7,6 +7,8 @@ import yaml
 from rspub.core.rs_paras import RsParameters, WELL_KNOWN_URL
 from rspub.util import defaults
 
+DEFAULT_WATCH_IGNORE = [".*.swp", ".*.swx", "*~", ".#*", "*.tmp"]
+
 
 class ElasticRsParameters(RsParameters):
     def __init__(self, **kwargs):
@@ -19,6 +21,49 @@ class ElasticRsParameters(RsParameters):
         self.elastic_resource_doc_type = kwargs['elastic_resource_doc_type']
         self.elastic_change_doc_type = kwargs['elastic_change_doc_type']
         self.tmp_dir = kwargs.get('tmp_dir')
+        # serialize resourcelists straight from the elasticsearch documents, see fast_xml.py
+        self.fast_xml = kwargs.get('fast_xml', False)
+        # created_resource events are sent every progress_batch_size resources or progress_interval_ms,
+        # optionally from a background thread, see progress.py
+        self.progress_batch_size = kwargs.get('progress_batch_size', 1)
+        self.progress_interval_ms = kwargs.get('progress_interval_ms')
+        self.progress_in_background = kwargs.get('progress_in_background', False)
+        # keep a checkpoint of resourcelist generation, so that an interrupted run can be resumed
+        self.resumable = kwargs.get('resumable', False)
+        # maximum number of changes held in memory while building changelists; beyond it they are
+        # deduplicated with an external sort in tmp_dir, see external_sort.py. None keeps them all in memory
+        self.changes_memory_budget = kwargs.get('changes_memory_budget')
+        # dump packages hold at most dump_package_max_size bytes of resources and are written by
+        # dump_workers threads (default: the number of cpus), see dump.py
+        self.dump_package_max_size = kwargs.get('dump_package_max_size', 100 * 1024 * 1024)
+        self.dump_workers = kwargs.get('dump_workers')
+        # files are hashed by ingest_workers threads (default: the number of cpus) and written to elasticsearch
+        # in bulk requests of ingest_bulk_size resources, with locations of type ingest_location_type,
+        # see ingest.py
+        self.ingest_workers = kwargs.get('ingest_workers')
+        self.ingest_bulk_size = kwargs.get('ingest_bulk_size', 500)
+        self.ingest_location_type = kwargs.get('ingest_location_type', 'rel_path')
+        # keep the md5 of ingested files in stat_cache_dir (relative to the parent of the metadata dir, as
+        # tmp_dir), so that unchanged files are not hashed again, see stat_cache.py. None hashes every file
+        self.stat_cache_dir = kwargs.get('stat_cache_dir')
+        # operations written through an IngestJournal are kept in journal_dir (relative to the parent of the
+        # metadata dir, as tmp_dir), one sub dir per resource set, until they are in elasticsearch, see journal.py
+        self.journal_dir = kwargs.get('journal_dir', "journal")
+        # keep a bloom filter of the locations of the resource set in location_filter_dir (relative to the parent
+        # of the metadata dir, as tmp_dir), sized for at least location_filter_capacity locations, see
+        # ElasticQueryManager.use_location_filter
+        self.location_filter_dir = kwargs.get('location_filter_dir', "location_filters")
+        self.location_filter_capacity = kwargs.get('location_filter_capacity', 1000000)
+        # seconds a location filter answers without catching up with the documents indexed by other processes
+        self.location_filter_refresh = kwargs.get('location_filter_refresh', 10)
+        # files the watcher does not record, by shell pattern on their name (default: editor swap and backup
+        # files and temporary files), see watcher.py
+        self.watch_ignore = kwargs.get('watch_ignore', DEFAULT_WATCH_IGNORE)
+        # generate resourcelists in a staging dir next to the metadata dir and swap it into place when complete,
+        # see staging.py
+        self.staged_publication = kwargs.get('staged_publication', False)
+        # set while documents are being generated in the staging dir
+        self.staging_dir = None
 
     # def abs_metadata_dir(self) -> str:
     #     """
@@ -38,10 +83,58 @@ class ElasticRsParameters(RsParameters):
     #
     #     self._metadata_dir = path
 
+    def abs_description_lock_path(self) -> str:
+        """
+        ``derived`` :samp:`The lock held while updating the source description`
+
+        The source description is shared by all the resource sets with the same description_dir.
+        """
+        description_dir = getattr(self, 'description_dir', None) or self.resource_dir
+        return os.path.join(os.path.abspath(description_dir), ".resourcesync.lock")
+
     def abs_tmp_dir(self) -> str:
-        parent = str(Path(self.abs_metadata_dir()).parent)
+        parent = str(Path(self.abs_live_metadata_dir()).parent)
         return os.path.join(parent, self.tmp_dir)
 
+    def abs_stat_cache_dir(self) -> str:
+        parent = str(Path(self.abs_live_metadata_dir()).parent)
+        return os.path.join(parent, self.stat_cache_dir)
+
+    def abs_journal_dir(self) -> str:
+        parent = str(Path(self.abs_live_metadata_dir()).parent)
+        return os.path.join(parent, self.journal_dir, self.resource_set)
+
+    def abs_location_filter_path(self) -> str:
+        parent = str(Path(self.abs_live_metadata_dir()).parent)
+        return os.path.join(parent, self.location_filter_dir, self.resource_set + ".bloom")
+
+    def abs_live_metadata_dir(self) -> str:
+        """
+        ``derived`` :samp:`The metadata directory served to harvesters`
+
+        Same as :func:`abs_metadata_dir`, unless documents are being generated in a staging dir.
+        """
+        return super(ElasticRsParameters, self).abs_metadata_dir()
+
+    def abs_metadata_dir(self) -> str:
+        if self.staging_dir is not None:
+            return self.staging_dir
+        return self.abs_live_metadata_dir()
+
+    def abs_metadata_path(self, filename) -> str:
+        return os.path.join(self.abs_metadata_dir(), filename)
+
+    def live_path(self, path) -> str:
+        """The path a document of the staging dir will have, once published."""
+        if self.staging_dir is not None:
+            rel_path = os.path.relpath(path, self.staging_dir)
+            if rel_path != os.pardir and not rel_path.startswith(os.pardir + os.sep):
+                return os.path.join(self.abs_live_metadata_dir(), rel_path)
+        return path
+
+    def uri_from_path(self, path) -> str:
+        return super(ElasticRsParameters, self).uri_from_path(self.live_path(path))
+
     @property
     def url_prefix(self):
         return self._url_prefix
@@ -62,7 +155,7 @@ class ElasticRsParameters(RsParameters):
             # return urllib.parse.urlunsplit([r[0], r[1], WELL_KNOWN_URL, "", ""])
             return urllib.parse.urljoin(self.url_prefix, WELL_KNOWN_URL)
         else:
-            path = self.abs_metadata_path(WELL_KNOWN_URL)
+            path = self.live_path(self.abs_metadata_path(WELL_KNOWN_URL))
             rel_path = os.path.relpath(path, self.resource_dir)
             return self.url_prefix + defaults.sanitize_url_path(rel_path)
 
@@ -0,0 +1,170 @@
+import os
+from glob import glob
+
+import logging
+from resync import ChangeList
+from resync import Resource
+from resync.change_dump import ChangeDump
+from resync.change_dump_manifest import ChangeDumpManifest
+from resync.w3c_datetime import str_to_datetime
+from rspub.core.executors import SitemapData, ExecutorEvent
+
+from omtdrspub.elastic.dump import PackageWriter
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_changelist import ElasticChangeListExecutor
+from omtdrspub.elastic.model.change_doc import ChangeDoc
+
+LOG = logging.getLogger(__name__)
+
+
+class ElasticNewChangeDumpExecutor(ElasticChangeListExecutor):
+    """
+    :samp:`Implements the new changedump strategy`
+
+    Every run creates a new changedump with the net changes since the previous changedump, or since the
+    resourcelist was completed: for every resource only its last change is kept, and the current bytes of
+    created and updated resources are packaged into ZIP files with a changedump manifest, see
+    :class:`PackageWriter`. Deleted resources are listed in the manifest only.
+    Changes are read from the published changelists and from the changes not published yet, which are not
+    erased: changelists are generated as usual. Each changedump covers a closed period, md:from - md:until.
+    """
+    def __init__(self, rs_parameters: ElasticRsParameters=None):
+        super(ElasticNewChangeDumpExecutor, self).__init__(rs_parameters)
+        # set in generate_rs_documents
+        self.changedump_files = []
+        self.dump_ordinal = None
+
+    def generate_rs_documents(self, filenames: iter=None) -> [SitemapData]:
+        self.query_manager.refresh_index(self.para.elastic_index)
+        self.update_previous_state()
+        self.changedump_files = sorted(glob(self.para.abs_metadata_path("changedump_*.xml")))
+        if len(self.changedump_files) == 0:
+            self.date_changelist_from = self.date_resourcelist_completed
+        else:
+            last_changedump = self.read_sitemap_preamble(self.changedump_files[-1], ChangeDump())
+            self.date_changelist_from = last_changedump.md_until
+        self.dump_ordinal = self.find_ordinal(ChangeDump().capability_name) + 1
+
+        counts, grouped_changes, sorter = self.last_changes(self.period_changes())
+        try:
+            self.observers_inform(self, ExecutorEvent.found_changes, created=counts["created"],
+                                  updated=counts["updated"], deleted=counts["deleted"])
+            writer = PackageWriter(ChangeDumpManifest, self.package_location, self.para.res_root_dir,
+                                   max_size=self.para.dump_package_max_size,
+                                   max_items=self.para.max_items_in_list,
+                                   workers=self.para.dump_workers,
+                                   pretty_xml=self.para.is_saving_pretty_xml,
+                                   md={'md_from': self.date_changelist_from,
+                                       'md_until': self.date_start_processing})
+            packages = list(writer.packages(self.entry_generator(grouped_changes)))
+        finally:
+            if sorter is not None:
+                sorter.close()
+
+        sitemap_data_iter = []
+        generator = self.changedump_generator()
+        for sitemap_data, changedump in generator(packages):
+            sitemap_data_iter.append(sitemap_data)
+        return sitemap_data_iter
+
+    def post_process_documents(self, sitemap_data_iter: iter):
+        # previous changedumps are closed when written
+        pass
+
+    def package_location(self, ordinal) -> [str, str]:
+        # packages are named after the changedump that lists them, see changedump_generator
+        zero_fill = self.para.zero_fill_filename
+        dump_ordinal = self.dump_ordinal + ordinal // self.para.max_items_in_list
+        part = ordinal % self.para.max_items_in_list
+        path = self.para.abs_metadata_path("changedump_" + str(dump_ordinal).zfill(zero_fill) +
+                                           "_part_" + str(part).zfill(zero_fill) + ".zip")
+        return path, self.para.uri_from_path(path)
+
+    def period_changes(self) -> iter:
+        """
+        Changes after date_changelist_from, up to date_start_processing (md:until of the changedump), in
+        chronological order: published ones first, then pending ones. Later changes go into the next changedump.
+        """
+        date_from = str_to_datetime(self.date_changelist_from) if self.date_changelist_from else None
+        date_until = str_to_datetime(self.date_start_processing)
+
+        def after_from(date):
+            return date_from is None or date is None or str_to_datetime(date) > date_from
+
+        def in_period(date):
+            return after_from(date) and (date is None or str_to_datetime(date) <= date_until)
+
+        for cl_file in self.changelist_files:
+            entry = self.manifest.get(cl_file)
+            if entry is not None and entry['md_until'] is not None and not after_from(entry['md_until']):
+                # closed before the period
+                continue
+            changelist = self.read_sitemap(cl_file, ChangeList())
+            for r_change in changelist.resources:
+                if in_period(r_change.md_datetime):
+                    yield r_change
+
+        # pending changes are read without erasing them, see ElasticChangeListExecutor.resource_generator
+        resolver = self.location_resolver
+        for e_page in self.elastic_page_generator()():
+            for e_hit in e_page:
+                e_doc = ChangeDoc.from_source(e_hit['_source'])
+                if in_period(e_doc.datetime):
+                    yield Resource(uri=resolver.uri(e_doc.location), lastmod=e_doc.lastmod, change=e_doc.change,
+                                   md_datetime=e_doc.datetime)
+
+    def entry_generator(self, grouped_changes: iter) -> [Resource, str]:
+        resolver = self.location_resolver
+        for change_type, r_change in grouped_changes:
+            r_change.change = change_type
+            if change_type == "deleted":
+                yield r_change, None
+                continue
+            file_path = resolver.path_from_uri(r_change.uri)
+            if file_path is None:
+                LOG.warning("Not packaging %s: not a local file" % r_change.uri)
+                continue
+            yield r_change, file_path
+
+    def changedump_generator(self) -> iter:
+
+        def generator(packages: [Resource]) -> [SitemapData, ChangeDump]:
+            ordinal = self.dump_ordinal - 1
+            # a run without changes still closes the period, with an empty changedump
+            for start in range(0, max(1, len(packages)), self.para.max_items_in_list):
+                ordinal += 1
+                changedump = ChangeDump()
+                changedump.md_from = self.date_changelist_from
+                changedump.md_until = self.date_start_processing
+                for package in packages[start:start + self.para.max_items_in_list]:
+                    changedump.add(package)
+                LOG.info("Generating changedump #:" + str(ordinal) + "...")
+                sitemap_data = self.finish_sitemap(ordinal, changedump)
+                yield sitemap_data, changedump
+
+        return generator
+
+    def create_index(self, sitemap_data_iter: iter):
+        changedump_index_path = self.para.abs_metadata_path("changedump-index.xml")
+        changedump_index_uri = self.para.uri_from_path(changedump_index_path)
+        if os.path.exists(changedump_index_path):
+            os.remove(changedump_index_path)
+
+        changedump_files = sorted(glob(self.para.abs_metadata_path("changedump_*.xml")))
+        if len(changedump_files) > 1:
+            changedump_index = ChangeDump()
+            changedump_index.sitemapindex = True
+            changedump_index.md_from = self.date_resourcelist_completed
+            for cd_file in changedump_files:
+                changedump = self.read_sitemap_preamble(cd_file, ChangeDump())
+                changedump_index.resources.append(Resource(uri=self.para.uri_from_path(cd_file),
+                                                           md_from=changedump.md_from,
+                                                           md_until=changedump.md_until))
+                if self.para.is_saving_sitemaps and changedump.link("index") is None:
+                    # changedumps only list packages, rewriting them is cheap
+                    changedump = self.read_sitemap(cd_file, ChangeDump())
+                    changedump.link_set(rel="up", href=self.para.capabilitylist_url())
+                    changedump.link_set(rel="index", href=changedump_index_uri)
+                    self.save_sitemap(changedump, cd_file)
+
+            self.finish_sitemap(-1, changedump_index)
@@ -3,42 +3,51 @@
 
 import os
 from abc import ABCMeta
-from glob import glob
 
 import logging
 from resync import ChangeList
 from resync import Resource
-from resync import ResourceList
 from resync.list_base_with_index import ListBaseWithIndex
 from resync.sitemap import Sitemap
 from rspub.core.executors import Executor, SitemapData, ExecutorEvent
 from rspub.core.rs_enum import Capability
 from rspub.util import defaults
 
+from omtdrspub.elastic.append_changelist import AppendChangeList
 from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager
 from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
-from omtdrspub.elastic.utils import parse_xml_without_urls
+from omtdrspub.elastic.external_sort import ExternalSorter, last_changes
+from omtdrspub.elastic.manifest import PublicationManifest
+from omtdrspub.elastic.utils import LockedSharedDocuments, parse_xml_without_urls, write_atomically
 from omtdrspub.elastic.model.change_doc import ChangeDoc
+from omtdrspub.elastic.model.location import LocationResolver
+from omtdrspub.elastic.progress import ProgressEvents
 
 MAX_RESULT_WINDOW = 10000
 
 LOG = logging.getLogger(__name__)
 
 
-class ElasticChangeListExecutor(Executor, metaclass=ABCMeta):
+class ElasticChangeListExecutor(LockedSharedDocuments, Executor, metaclass=ABCMeta):
 
     def __init__(self, rs_parameters: ElasticRsParameters=None):
         Executor.__init__(self, rs_parameters)
 
         # next parameters will all be set in the method update_previous_state
-        self.previous_changes = None
+        self.state_loaded = False
+        self._previous_changes = None
         self.date_resourcelist_completed = None
         self.date_changelist_from = None
         self.resourcelist_files = []
         self.changelist_files = []
         ##
+        # set in changelist_generator, when the changelists will be more than one after this run
+        self.index_required = False
 
         self.query_manager = ElasticQueryManager(self.para.elastic_host, self.para.elastic_port)
+        self.location_resolver = LocationResolver(self.para.url_prefix, self.para.res_root_dir)
+        # loaded in execute, once the metadata dir exists
+        self.manifest = None
 
     def execute(self, filenames=None):
         # filenames is not necessary, we use it only to match the method signature
@@ -46,6 +55,7 @@ class ElasticChangeListExecutor(Executor, metaclass=ABCMeta):
         self.observers_inform(self, ExecutorEvent.execution_start, date_start_processing=self.date_start_processing)
         if not os.path.exists(self.para.abs_metadata_dir()):
             os.makedirs(self.para.abs_metadata_dir())
+        self.manifest = PublicationManifest.load(self.para)
 
         self.prepare_metadata_dir()
         sitemap_data_iter = self.generate_rs_documents()
@@ -65,38 +75,59 @@ class ElasticChangeListExecutor(Executor, metaclass=ABCMeta):
 
     def create_index(self, sitemap_data_iter: iter) -> SitemapData:
         changelist_index_path = self.para.abs_metadata_path("changelist-index.xml")
-        changelist_index_uri = self.para.uri_from_path(changelist_index_path)
+        changelist_index_uri = self.changelist_index_uri()
         if os.path.exists(changelist_index_path):
             os.remove(changelist_index_path)
 
-        changelist_files = sorted(glob(self.para.abs_metadata_path("changelist_*.xml")))
+        changelist_files = self.manifest.files(Capability.changelist.name)
         if len(changelist_files) > 1:
             changelist_index = ChangeList()
             changelist_index.sitemapindex = True
             changelist_index.md_from = self.date_resourcelist_completed
             for cl_file in changelist_files:
-                changelist = self.read_sitemap(cl_file, ChangeList())
+                # md_from, md_until and the links of every changelist are kept in the manifest
+                entry = self.manifest.get(cl_file)
                 uri = self.para.uri_from_path(cl_file)
-                changelist_index.resources.append(Resource(uri=uri, md_from=changelist.md_from,
-                                                           md_until=changelist.md_until))
+                changelist_index.resources.append(Resource(uri=uri, md_from=entry['md_from'],
+                                                           md_until=entry['md_until']))
 
-                if self.para.is_saving_sitemaps:
-                    index_link = changelist.link("index")
-                    if index_link is None:
-                        changelist.link_set(rel="index", href=changelist_index_uri)
-                        self.save_sitemap(changelist, cl_file)
+                if self.para.is_saving_sitemaps and not entry['index_link']:
+                    # changelists written while they were the only one lack the link: they are rewritten once
+                    LOG.info("Updating document: " + os.path.basename(cl_file))
+                    changelist = self.read_sitemap(cl_file, ChangeList())
+                    changelist.link_set(rel="index", href=changelist_index_uri)
+                    self.save_sitemap(changelist, cl_file)
 
             self.finish_sitemap(-1, changelist_index)
 
+    def changelist_index_uri(self):
+        return self.para.uri_from_path(self.para.abs_metadata_path("changelist-index.xml"))
+
+    def link_index(self, sitemap):
+        # "up" is set first, so that links keep the order in which finish_sitemap would write them
+        sitemap.link_set(rel="up", href=self.para.capabilitylist_url())
+        sitemap.link_set(rel="index", href=self.changelist_index_uri())
+
+    @staticmethod
+    def read_sitemap_preamble(path, sitemap):
+        with open(path, "r", encoding="utf-8") as sm_file:
+            sm = Sitemap()
+            parse_xml_without_urls(sm, fh=sm_file, resources=sitemap)
+        return sitemap
+
     def save_sitemap(self, sitemap, path):
         sitemap.pretty_xml = self.para.is_saving_pretty_xml
         # writing the string sitemap.as_xml() to disk results in encoding=ASCII on some systems.
         # due to https://docs.python.org/3.4/library/xml.etree.elementtree.html#write
         # sitemap.write(path)
         if sitemap.sitemapindex:
-            self.write_index(sitemap, path)
+            write_atomically(path, lambda tmp_path: self.write_index(sitemap, tmp_path))
+        elif isinstance(sitemap, AppendChangeList):
+            sitemap.write_appended(path, pretty_xml=self.para.is_saving_pretty_xml)
         else:
-            sitemap.write(path)
+            write_atomically(path, sitemap.write)
+        if self.manifest is not None:
+            self.manifest.record(path, sitemap)
 
     @staticmethod
     def write_index(sitemap: ListBaseWithIndex, path):
@@ -108,124 +139,160 @@ class ElasticChangeListExecutor(Executor, metaclass=ABCMeta):
         return s.resources_as_xml(sitemap, sitemapindex=True, fh=path)
 
     def update_previous_state(self):
-        if self.previous_changes is None:
-            self.previous_changes = {}
-
-            # search for resourcelists
-            self.resourcelist_files = sorted(glob(self.para.abs_metadata_path("resourcelist_*.xml")))
-            for rl_file_name in self.resourcelist_files:
-                resourcelist = ResourceList()
-                with open(rl_file_name, "r", encoding="utf-8") as rl_file:
-                    sm = Sitemap()
-                    # too slow
-                    # sm.parse_xml(rl_file, resources=resourcelist)
-                    parse_xml_without_urls(sm, fh=rl_file, resources=resourcelist)
-
-                self.date_resourcelist_completed = resourcelist.md_completed
+        if not self.state_loaded:
+            self.state_loaded = True
+
+            # resourcelists and changelists are known from the manifest, without parsing them
+            self.resourcelist_files = self.manifest.files(Capability.resourcelist.name)
+            last_resourcelist = self.manifest.last(Capability.resourcelist.name)
+            if last_resourcelist is not None:
+                self.date_resourcelist_completed = last_resourcelist['md_completed']
                 if self.date_resourcelist_completed is None:
-                    self.date_resourcelist_completed = resourcelist.md_at
+                    self.date_resourcelist_completed = last_resourcelist['md_at']
 
-                # self.previous_resources.update({resource.uri: resource for resource in resourcelist.resources})
+            self.changelist_files = self.manifest.files(Capability.changelist.name)
 
-            # search for changelists
-            self.changelist_files = sorted(glob(self.para.abs_metadata_path("changelist_*.xml")))
+    @property
+    def previous_changes(self):
+        # parsing every changelist is expensive: it is only done if previous changes are asked for
+        if self._previous_changes is None:
+            self.update_previous_state()
+            self._previous_changes = {}
             for cl_file_name in self.changelist_files:
-                changelist = ChangeList()
-                with open(cl_file_name, "r", encoding="utf-8") as cl_file:
-                    sm = Sitemap()
-                    sm.parse_xml(cl_file, resources=changelist)
-
+                changelist = self.read_sitemap(cl_file_name, ChangeList())
                 for r_change in changelist.resources:
-                    self.previous_changes.update({r_change.uri: r_change})
+                    self._previous_changes.update({r_change.uri: r_change})
+        return self._previous_changes
 
     def changelist_generator(self) -> iter:
 
         def generator(changelist=None) -> [SitemapData, ChangeList]:
-            new_changes = {}
-            resource_generator = self.resource_generator()
             self.update_previous_state()
-            prev_changes = self.previous_changes
-            es_changes = [resource for count, resource in resource_generator()]
+            counts, grouped_changes, sorter = self.last_changes()
+            try:
+                for sitemap_data_changelist in self._write_changelists(changelist, counts, grouped_changes):
+                    yield sitemap_data_changelist
+            finally:
+                if sorter is not None:
+                    sorter.close()
+
+        return generator
+
+    def last_changes(self, resources: iter=None) -> [dict, iter, ExternalSorter]:
+        """
+        The last change of every resource, as the number of changes per type and an iterator of
+        [change type, Resource] grouped by change type. With changes_memory_budget the changes are deduplicated
+        with an external sort, which is returned too so that it can be closed.
 
-            for r_change in es_changes:
+        resources are the changes in chronological order, by default the changes from resource_generator.
+        """
+        if resources is None:
+            resources = (resource for count, resource in self.resource_generator()())
+        budget = self.para.changes_memory_budget
+        if budget is None:
+            new_changes = {}
+            for r_change in resources:
                 new_changes.update({r_change.uri: r_change})
 
             created = [r for r in new_changes.values() if r.change == "created"]
             updated = [r for r in new_changes.values() if r.change == "updated"]
             deleted = [r for r in new_changes.values() if r.change == "deleted"]
-            # deleted = [r for r in new_changes.values() if r.change == "deleted" and
-            #           (True if ((r.uri in prev_changes and prev_changes[r.uri].change != "deleted") or r.uri not in prev_changes) else False)]
-
-            num_created = len(created)
-            num_updated = len(updated)
-            num_deleted = len(deleted)
-            tot_changes = num_created + num_updated + num_deleted
-            self.observers_inform(self, ExecutorEvent.found_changes, created=num_created, updated=num_updated,
-                                  deleted=num_deleted)
             all_changes = {"created": created, "updated": updated, "deleted": deleted}
+            counts = {change_type: len(changes) for change_type, changes in all_changes.items()}
+            grouped_changes = ((kv[0], r_change) for kv in all_changes.items() for r_change in kv[1])
+            return counts, grouped_changes, None
+
+        tmp_dir = None
+        if self.para.tmp_dir:
+            tmp_dir = self.para.abs_tmp_dir()
+            os.makedirs(tmp_dir, exist_ok=True)
+        changes = ([r.uri, r.lastmod, r.change, r.md_datetime] for r in resources)
+        counts, sorter = last_changes(changes, budget, tmp_dir=tmp_dir)
+        grouped_changes = ((record[2], Resource(uri=record[0], lastmod=record[1], change=record[2],
+                                                md_datetime=record[3])) for record in sorter)
+        return counts, grouped_changes, sorter
+
+    def _write_changelists(self, changelist, counts: dict, grouped_changes: iter) -> [SitemapData, ChangeList]:
+        num_created = counts["created"]
+        num_updated = counts["updated"]
+        num_deleted = counts["deleted"]
+        tot_changes = num_created + num_updated + num_deleted
+        self.observers_inform(self, ExecutorEvent.found_changes, created=num_created, updated=num_updated,
+                              deleted=num_deleted)
+
+        ordinal = self.find_ordinal(Capability.changelist.name)
+
+        resource_count = 0
+        if changelist:
+            ordinal -= 1
+            resource_count = len(changelist)
+            if resource_count >= self.para.max_items_in_list:
+                changelist = None
+                ordinal += 1
+                resource_count = 0
+
+        # the number of changelists is known before writing them: if they will be more than one,
+        # the rel="index" link is written along with each of them
+        chunks = 0
+        if tot_changes > 0:
+            chunks = -(-(resource_count + tot_changes) // self.para.max_items_in_list)
+        self.index_required = ordinal + chunks > 0
+        if changelist and self.index_required:
+            self.link_index(changelist)
+
+        for change_type, r_change in grouped_changes:
+            if changelist is None:
+                changelist = ChangeList()
+                changelist.md_from = self.date_changelist_from
+                if self.index_required:
+                    self.link_index(changelist)
 
-            ordinal = self.find_ordinal(Capability.changelist.name)
-
-            resource_count = 0
-            if changelist:
-                ordinal -= 1
-                resource_count = len(changelist)
-                if resource_count >= self.para.max_items_in_list:
-                    changelist = None
-                    ordinal += 1
-                    resource_count = 0
-
-            for kv in all_changes.items():
-                for r_change in kv[1]:
-                    if changelist is None:
-                        changelist = ChangeList()
-                        changelist.md_from = self.date_changelist_from
-
-                    r_change.change = kv[0] # type of change: created, updated or deleted
-                    # r_change.md_datetime = self.date_start_processing
-                    changelist.add(r_change)
-                    resource_count += 1
-
-                    # under conditions: yield the current changelist
-                    if resource_count % self.para.max_items_in_list == 0:
-                        ordinal += 1
-                        sitemap_data = self.finish_sitemap(ordinal, changelist)
-                        yield sitemap_data, changelist
-                        changelist = None
-
-            # under conditions: yield the current and last changelist
-            if changelist and tot_changes > 0:
+            r_change.change = change_type # type of change: created, updated or deleted
+            # r_change.md_datetime = self.date_start_processing
+            changelist.add(r_change)
+            resource_count += 1
+
+            # under conditions: yield the current changelist
+            if resource_count % self.para.max_items_in_list == 0:
                 ordinal += 1
                 sitemap_data = self.finish_sitemap(ordinal, changelist)
                 yield sitemap_data, changelist
+                changelist = None
 
-        return generator
+        # under conditions: yield the current and last changelist
+        if changelist and tot_changes > 0:
+            ordinal += 1
+            sitemap_data = self.finish_sitemap(ordinal, changelist)
+            yield sitemap_data, changelist
 
     def resource_generator(self) -> iter:
 
         def generator(count=0) -> [int, Resource]:
+            resolver = self.location_resolver
             elastic_page_generator = self.elastic_page_generator()
             erased_changes = False
-            for e_page in elastic_page_generator():
-                if not erased_changes:
-                    # this will happen at the first scroll
-                    self.erase_changes()
-                    LOG.info("Erasing changes")
-                    erased_changes = True
-                for e_hit in e_page:
-                    e_source = e_hit['_source']
-                    e_doc = ChangeDoc.as_change_doc(e_source)
-                    count += 1
-
-                    uri = e_doc.location.uri_from_path(para_url_prefix=self.para.url_prefix,
-                                                       para_res_root_dir=self.para.res_root_dir)
-                    resource = Resource(uri=uri,
-                                        lastmod=e_doc.lastmod,
-                                        change=e_doc.change,
-                                        md_datetime=e_doc.datetime)
-                    yield count, resource
-                    self.observers_inform(self, ExecutorEvent.created_resource, resource=resource,
-                                          count=count)
+            progress = ProgressEvents.from_parameters(self, self.para)
+            try:
+                for e_page in elastic_page_generator():
+                    if not erased_changes:
+                        # this will happen at the first scroll
+                        self.erase_changes()
+                        LOG.info("Erasing changes")
+                        erased_changes = True
+                    for e_hit in e_page:
+                        e_source = e_hit['_source']
+                        e_doc = ChangeDoc.from_source(e_source)
+                        count += 1
+
+                        uri = resolver.uri(e_doc.location)
+                        resource = Resource(uri=uri,
+                                            lastmod=e_doc.lastmod,
+                                            change=e_doc.change,
+                                            md_datetime=e_doc.datetime)
+                        yield count, resource
+                        progress.created_resource(count, resource=resource)
+            finally:
+                progress.close()
 
         return generator
 
@@ -293,9 +360,14 @@ class ElasticNewChangeListExecutor(ElasticChangeListExecutor):
         # self.changelist_files was globed before new documents were generated (self.update_previous_state).
         if self.para.is_saving_sitemaps:
             for filename in self.changelist_files:
+                if self.manifest.get(filename)['md_until'] is not None:
+                    continue
                 changelist = self.read_sitemap(filename, ChangeList())
                 if changelist.md_until is None:
                     changelist.md_until = self.date_start_processing
+                    if self.index_required:
+                        # the changelist is rewritten anyway, so the link is added here as well
+                        self.link_index(changelist)
                     self.save_sitemap(changelist, filename)
 
 
@@ -313,7 +385,14 @@ class ElasticIncrementalChangeListExecutor(ElasticChangeListExecutor):
         self.date_changelist_from = self.date_resourcelist_completed
         changelist = None
         if len(self.changelist_files) > 0:
-            changelist = self.read_sitemap(self.changelist_files[-1], ChangeList())
+            last_changelist = self.changelist_files[-1]
+            entry = self.manifest.get(last_changelist)
+            if entry['count'] is None:
+                # unknown after rebuilding the manifest: the changelist is parsed, and rewritten, once
+                changelist = self.read_sitemap(last_changelist, ChangeList())
+            else:
+                # new changes are appended to the file, it will only be parsed to roll it over
+                changelist = AppendChangeList(last_changelist, entry['count'], size=entry.get('size'))
 
         sitemap_data_iter = []
         generator = self.changelist_generator()
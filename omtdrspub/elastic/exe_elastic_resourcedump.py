@@ -0,0 +1,197 @@
+import os
+from datetime import datetime
+from glob import glob
+
+import logging
+from resync import Resource
+from resync.list_base_with_index import ListBaseWithIndex
+from resync.resource_dump import ResourceDump
+from resync.resource_dump_manifest import ResourceDumpManifest
+from rspub.core.executors import Executor, SitemapData, ExecutorEvent
+from rspub.util import defaults
+
+from omtdrspub.elastic.dump import PackageWriter
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager, resource_set_query
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.model.location import LocationResolver
+from omtdrspub.elastic.model.resource_doc import ResourceDoc
+from omtdrspub.elastic.progress import ProgressEvents
+from omtdrspub.elastic.utils import LockedSharedDocuments, write_atomically
+
+MAX_RESULT_WINDOW = 10000
+
+LOG = logging.getLogger(__name__)
+
+
+class ElasticResourceDumpExecutor(LockedSharedDocuments, Executor):
+    """
+    Publishes the resource set as a resourcedump: ZIP packages of the resource bitstreams found in
+    res_root_dir, each with its manifest, listed in resourcedump documents.
+
+    Resources are scrolled from elasticsearch and packaged as they come, see :class:`PackageWriter`.
+    Resourcelists and changelists in the metadata dir are left untouched.
+
+    Packages are written under names of their own run, and the documents and packages of the previous
+    resourcedump are only removed once the new documents are saved over them: harvesters see either dump, whole.
+    """
+
+    def __init__(self, rs_parameters: ElasticRsParameters):
+        super(ElasticResourceDumpExecutor, self).__init__(rs_parameters)
+        self.query_manager = ElasticQueryManager(self.para.elastic_host, self.para.elastic_port)
+        self.location_resolver = LocationResolver(self.para.url_prefix, self.para.res_root_dir)
+        # set in prepare_metadata_dir
+        self.run_name = None
+        self.previous_files = []
+
+    def execute(self, filenames=None):
+        # filenames is not necessary, we use it only to match the method signature
+        if not os.path.exists(self.para.abs_metadata_dir()):
+            os.makedirs(self.para.abs_metadata_dir())
+        self.date_start_processing = defaults.w3c_now()
+        self.observers_inform(self, ExecutorEvent.execution_start, date_start_processing=self.date_start_processing)
+
+        self.prepare_metadata_dir()
+        sitemap_data_iter = self.generate_rs_documents()
+        self.post_process_documents(sitemap_data_iter)
+        self.date_end_processing = defaults.w3c_now()
+        self.create_index(sitemap_data_iter)
+        self.remove_previous_files(sitemap_data_iter)
+
+        capabilitylist_data = self.create_capabilitylist()
+        self.update_resource_sync(capabilitylist_data)
+
+        self.observers_inform(self, ExecutorEvent.execution_end, date_end_processing=self.date_end_processing,
+                              new_sitemaps=sitemap_data_iter)
+        return sitemap_data_iter
+
+    def prepare_metadata_dir(self):
+        self.run_name = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        self.previous_files = []
+        if self.para.is_saving_sitemaps:
+            # packages left by an interrupted run
+            for file in glob(self.para.abs_metadata_path("resourcedump_part_*.zip.tmp")):
+                os.remove(file)
+            # only the documents and packages of a previous resourcedump are removed, once the new ones are saved
+            for pattern in ("resourcedump_*.xml", "resourcedump-index.xml", "resourcedump_part_*.zip"):
+                self.previous_files.extend(glob(self.para.abs_metadata_path(pattern)))
+
+    def remove_previous_files(self, sitemap_data_iter: [SitemapData]):
+        saved = set(os.path.abspath(sitemap_data.path) for sitemap_data in sitemap_data_iter)
+        if len(sitemap_data_iter) > 1:
+            saved.add(os.path.abspath(self.para.abs_metadata_path("resourcedump-index.xml")))
+        for file in self.previous_files:
+            if os.path.abspath(file) not in saved and os.path.exists(file):
+                os.remove(file)
+        self.previous_files = []
+
+    def generate_rs_documents(self, filenames: iter = None) -> [SitemapData]:
+        # filenames is not necessary, we use it only to match the method signature
+        self.query_manager.refresh_index(self.para.elastic_index)
+        writer = PackageWriter(ResourceDumpManifest, self.package_location, self.para.res_root_dir,
+                               max_size=self.para.dump_package_max_size,
+                               max_items=self.para.max_items_in_list,
+                               workers=self.para.dump_workers,
+                               pretty_xml=self.para.is_saving_pretty_xml)
+        packages = list(writer.packages(self.entry_generator()()))
+
+        sitemap_data_iter = []
+        generator = self.resourcedump_generator()
+        for sitemap_data, resourcedump in generator(packages):
+            sitemap_data_iter.append(sitemap_data)
+        return sitemap_data_iter
+
+    def package_location(self, ordinal) -> [str, str]:
+        path = self.para.abs_metadata_path("resourcedump_part_" + self.run_name + "_" +
+                                           str(ordinal).zfill(self.para.zero_fill_filename) + ".zip")
+        return path, self.para.uri_from_path(path)
+
+    def create_index(self, sitemap_data_iter: iter):
+        if len(sitemap_data_iter) > 1:
+            resourcedump_index = ResourceDump()
+            resourcedump_index.sitemapindex = True
+            resourcedump_index.md_at = self.date_start_processing
+            resourcedump_index.md_completed = self.date_end_processing
+            resourcedump_index.link_set(rel="up", href=self.para.capabilitylist_url())
+            for sitemap_data in sitemap_data_iter:
+                resourcedump_index.add(Resource(uri=sitemap_data.uri, md_at=sitemap_data.doc_start,
+                                                md_completed=sitemap_data.doc_end))
+
+            self.finish_sitemap(-1, resourcedump_index)
+
+    def save_sitemap(self, sitemap, path):
+        sitemap.pretty_xml = self.para.is_saving_pretty_xml
+        if sitemap.sitemapindex:
+            write_atomically(path, lambda tmp_path: self.write_index(sitemap, tmp_path))
+        else:
+            write_atomically(path, sitemap.write)
+
+    @staticmethod
+    def write_index(sitemap: ListBaseWithIndex, path):
+        """Return XML serialization of this list taken to be sitemapindex entries
+
+        """
+        sitemap.default_capability()
+        s = sitemap.new_sitemap()
+        return s.resources_as_xml(sitemap, sitemapindex=True, fh=path)
+
+    def resourcedump_generator(self) -> iter:
+
+        def generator(packages: [Resource]) -> [SitemapData, ResourceDump]:
+            # packages are known before writing the documents: the rel="index" link is written along with them
+            index_url = None
+            if len(packages) > self.para.max_items_in_list:
+                index_url = self.para.uri_from_path(self.para.abs_metadata_path("resourcedump-index.xml"))
+            ordinal = -1
+            for start in range(0, len(packages), self.para.max_items_in_list):
+                ordinal += 1
+                resourcedump = ResourceDump()
+                doc_start = defaults.w3c_now()
+                resourcedump.md_at = doc_start
+                if index_url is not None:
+                    resourcedump.link_set(rel="up", href=self.para.capabilitylist_url())
+                    resourcedump.link_set(rel="index", href=index_url)
+                for package in packages[start:start + self.para.max_items_in_list]:
+                    resourcedump.add(package)
+                doc_end = defaults.w3c_now()
+                resourcedump.md_completed = doc_end
+                LOG.info("Generating resourcedump #:" + str(ordinal) + "...")
+                sitemap_data = self.finish_sitemap(ordinal, resourcedump, doc_start=doc_start, doc_end=doc_end)
+                yield sitemap_data, resourcedump
+
+        return generator
+
+    def entry_generator(self) -> iter:
+
+        def generator() -> [Resource, str]:
+            resolver = self.location_resolver
+            count = 0
+            progress = ProgressEvents.from_parameters(self, self.para)
+            try:
+                for e_page in self.elastic_page_generator()():
+                    for e_hit in e_page:
+                        e_doc = ResourceDoc.from_source(e_hit['_source'])
+                        file_path = resolver.path(e_doc.location)
+                        if file_path is None:
+                            LOG.warning("Not packaging %s: not a local file" % e_doc.location.value)
+                            continue
+                        count += 1
+                        resource = Resource(uri=resolver.uri(e_doc.location), length=e_doc.length,
+                                            lastmod=e_doc.lastmod,
+                                            mime_type=e_doc.mime)
+                        yield resource, file_path
+                        progress.created_resource(count, resource=resource)
+            finally:
+                progress.close()
+
+        return generator
+
+    def elastic_page_generator(self) -> iter:
+
+        def generator() -> iter:
+            return self.query_manager.scan_and_scroll(index=self.para.elastic_index,
+                                                      doc_type=self.para.elastic_resource_doc_type,
+                                                      query=resource_set_query(self.para.resource_set),
+                                                      max_items_in_list=self.para.max_items_in_list,
+                                                      max_result_window=MAX_RESULT_WINDOW)
+
+        return generator
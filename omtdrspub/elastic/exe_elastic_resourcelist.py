@@ -1,6 +1,6 @@
 import os
+from glob import glob
 from os.path import basename
-from urllib.parse import urljoin
 
 import logging
 from resync import Resource
@@ -10,8 +10,15 @@ from rspub.core.executors import Executor, SitemapData, ExecutorEvent
 from rspub.core.rs_enum import Capability
 from rspub.util import defaults
 
+from omtdrspub.elastic.checkpoint import CHECKPOINT_FILE, ResourceListCheckpoint, remove_checkpoint
 from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager
+from omtdrspub.elastic.manifest import PublicationManifest
+from omtdrspub.elastic.fast_xml import FragmentResourceList, UrlFragmentSerializer
 from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.model.location import LocationResolver
+from omtdrspub.elastic.progress import ProgressEvents
+from omtdrspub.elastic.staging import StagedPublication
+from omtdrspub.elastic.utils import LockedSharedDocuments, write_atomically
 from omtdrspub.elastic.model.resource_doc import ResourceDoc
 
 MAX_RESULT_WINDOW = 10000
@@ -19,17 +26,58 @@ MAX_RESULT_WINDOW = 10000
 LOG = logging.getLogger(__name__)
 
 
-class ElasticResourceListExecutor(Executor):
+class ElasticResourceListExecutor(LockedSharedDocuments, Executor):
     def __init__(self, rs_parameters: ElasticRsParameters):
         super(ElasticResourceListExecutor, self).__init__(rs_parameters)
         self.query_manager = ElasticQueryManager(self.para.elastic_host, self.para.elastic_port)
+        self.location_resolver = LocationResolver(self.para.url_prefix, self.para.res_root_dir)
+        # set in generate_rs_documents, when the resource set does not fit in a single resourcelist
+        self.index_url = None
+        # with para.resumable: progress of this run, or of the interrupted run we are resuming
+        self.checkpoint = None
+        # _id of the last resource generated
+        self.scroll_cursor = None
+        # set in prepare_metadata_dir
+        self.manifest = None
 
     def execute(self, filenames=None):
         # filenames is not necessary, we use it only to match the method signature
-        self.date_start_processing = defaults.w3c_now()
-        self.observers_inform(self, ExecutorEvent.execution_start, date_start_processing=self.date_start_processing)
+        staging = None
+        if self.para.staged_publication and self.para.is_saving_sitemaps:
+            # harvesters keep seeing the previous publication until this one is complete
+            staging = StagedPublication(self.para)
+            staging.begin(keep=[CHECKPOINT_FILE] if self.para.resumable else ())
+        try:
+            sitemap_data_iter, capabilitylist_data = self.generate_publication()
+            if staging is not None:
+                for sitemap_data in sitemap_data_iter + [capabilitylist_data]:
+                    sitemap_data.path = self.para.live_path(sitemap_data.path)
+                staging.publish()
+        finally:
+            if staging is not None:
+                staging.abort()
+        self.update_resource_sync(capabilitylist_data)
+
+        self.observers_inform(self, ExecutorEvent.execution_end, date_end_processing=self.date_end_processing,
+                              new_sitemaps=sitemap_data_iter)
+        return sitemap_data_iter
+
+    def generate_publication(self) -> [[SitemapData], SitemapData]:
         if not os.path.exists(self.para.abs_metadata_dir()):
             os.makedirs(self.para.abs_metadata_dir())
+        if self.para.resumable and self.para.is_saving_sitemaps:
+            self.checkpoint = ResourceListCheckpoint.load(self.para.abs_metadata_path(CHECKPOINT_FILE))
+            if self.checkpoint is not None:
+                self.clear_unfinished_documents()
+                if not self.checkpoint.matches(PublicationManifest.load(self.para)):
+                    LOG.warning("Not resuming: the resourcelists of the checkpoint have been written again since")
+                    self.checkpoint = None
+        if self.checkpoint is not None:
+            LOG.info("Resuming resourcelist generation after %d resources" % self.checkpoint.count)
+            self.date_start_processing = self.checkpoint.date_start_processing
+        else:
+            self.date_start_processing = defaults.w3c_now()
+        self.observers_inform(self, ExecutorEvent.execution_start, date_start_processing=self.date_start_processing)
 
         self.prepare_metadata_dir()
         sitemap_data_iter = self.generate_rs_documents()
@@ -38,20 +86,46 @@ class ElasticResourceListExecutor(Executor):
         self.create_index(sitemap_data_iter)
 
         capabilitylist_data = self.create_capabilitylist()
-        self.update_resource_sync(capabilitylist_data)
-
-        self.observers_inform(self, ExecutorEvent.execution_end, date_end_processing=self.date_end_processing,
-                              new_sitemaps=sitemap_data_iter)
-        return sitemap_data_iter
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+        return sitemap_data_iter, capabilitylist_data
 
     def prepare_metadata_dir(self):
         if self.para.is_saving_sitemaps:
-            self.clear_metadata_dir()
+            if self.checkpoint is not None:
+                self.manifest = PublicationManifest.load(self.para)
+            else:
+                self.clear_metadata_dir()
+                # left by an interrupted run, it would be resumed by the next resumable one
+                remove_checkpoint(self.para.abs_metadata_path(CHECKPOINT_FILE))
+                self.manifest = PublicationManifest(self.para)
+                self.manifest.clear()
+
+    def clear_unfinished_documents(self):
+        # keep the resourcelists finished by the interrupted run, remove anything written after them
+        finished_paths = self.checkpoint.finished_paths()
+        for xml_file in glob(self.para.abs_metadata_path("*.xml")):
+            if os.path.abspath(xml_file) not in finished_paths:
+                os.remove(xml_file)
 
     def generate_rs_documents(self, filenames: iter = None) -> [SitemapData]:
         self.query_manager.refresh_index(self.para.elastic_index)
         # filenames is not necessary, we use it only to match the method signature
+        # knowing in advance whether an index will be created allows to write the rel="index" link
+        # while generating each resourcelist, instead of rewriting every chunk afterwards
         sitemap_data_iter = []
+        if self.checkpoint is not None:
+            # resourcelists of the interrupted run have been written with its decision
+            self.index_url = self.checkpoint.index_url
+            sitemap_data_iter = self.checkpoint.sitemap_data()
+        else:
+            if self.count_resources() > self.para.max_items_in_list:
+                self.index_url = self.resourcelist_index_url()
+            if self.para.resumable and self.para.is_saving_sitemaps:
+                self.checkpoint = ResourceListCheckpoint(self.para.abs_metadata_path(CHECKPOINT_FILE),
+                                                         date_start_processing=self.date_start_processing,
+                                                         index_url=self.index_url)
+                self.checkpoint.save()
         generator = self.resourcelist_generator()
         for sitemap_data, sitemap in generator():
             sitemap_data_iter.append(sitemap_data)
@@ -59,33 +133,44 @@ class ElasticResourceListExecutor(Executor):
         return sitemap_data_iter
 
     def create_index(self, sitemap_data_iter: iter):
-        if len(sitemap_data_iter) > 1:
+        if len(sitemap_data_iter) > 1 or self.index_url is not None:
             resourcelist_index = ResourceList()
             resourcelist_index.sitemapindex = True
             resourcelist_index.md_at = self.date_start_processing
             resourcelist_index.md_completed = self.date_end_processing
-            index_path = self.para.abs_metadata_path("resourcelist-index.xml")
-            rel_index_path = os.path.relpath(index_path, self.para.resource_dir)
-            index_url = urljoin(self.para.url_prefix, defaults.sanitize_url_path(rel_index_path))
             resourcelist_index.link_set(rel="up", href=self.para.capabilitylist_url())
             for sitemap_data in sitemap_data_iter:
                 resourcelist_index.add(Resource(uri=sitemap_data.uri, md_at=sitemap_data.doc_start,
                                                 md_completed=sitemap_data.doc_end))
-                if sitemap_data.document_saved:
-                    LOG.info("Updating document: " + basename(sitemap_data.path))
-                    self.update_rel_index(index_url, sitemap_data.path)
+                if sitemap_data.document_saved and self.index_url is None:
+                    # the resource set grew between the count and the scroll: chunks were written without
+                    # the rel="index" link, so we have to fall back to rewriting them
+                    LOG.warning("Updating document: " + basename(sitemap_data.path))
+                    self.update_rel_index(self.resourcelist_index_url(), sitemap_data.path)
 
             self.finish_sitemap(-1, resourcelist_index)
 
+    def resourcelist_index_url(self):
+        return self.para.uri_from_path(self.para.abs_metadata_path("resourcelist-index.xml"))
+
+    def link_index(self, sitemap):
+        # "up" is set first, so that links keep the order in which finish_sitemap would write them
+        sitemap.link_set(rel="up", href=self.para.capabilitylist_url())
+        sitemap.link_set(rel="index", href=self.index_url)
+
     def save_sitemap(self, sitemap, path):
         sitemap.pretty_xml = self.para.is_saving_pretty_xml
         # writing the string sitemap.as_xml() to disk results in encoding=ASCII on some systems.
         # due to https://docs.python.org/3.4/library/xml.etree.elementtree.html#write
         #sitemap.write(path)
         if sitemap.sitemapindex:
-            self.write_index(sitemap, path)
+            write_atomically(path, lambda tmp_path: self.write_index(sitemap, tmp_path))
+        elif isinstance(sitemap, FragmentResourceList):
+            write_atomically(path, sitemap.write_fragments)
         else:
-            sitemap.write(path)
+            write_atomically(path, sitemap.write)
+        if self.manifest is not None:
+            self.manifest.record(path, sitemap)
 
     @staticmethod
     def write_index(sitemap: ListBaseWithIndex, path):
@@ -103,14 +188,22 @@ class ElasticResourceListExecutor(Executor):
             ordinal = self.find_ordinal(Capability.resourcelist.name)
             resource_count = 0
             doc_start = None
-            resource_generator = self.resource_generator()
-            for resource_count, resource in resource_generator():
+            fast_xml = self.para.fast_xml
+            # with fast_xml, resources are (uri, <url> element) pairs
+            resource_generator = self.fragment_generator() if fast_xml else self.resource_generator()
+            start_count = self.checkpoint.count if self.checkpoint is not None else 0
+            for resource_count, resource in resource_generator(count=start_count):
                 # stuff resource into resourcelist
                 if resourcelist is None:
-                    resourcelist = ResourceList()
+                    resourcelist = FragmentResourceList() if fast_xml else ResourceList()
                     doc_start = defaults.w3c_now()
                     resourcelist.md_at = doc_start
-                resourcelist.add(resource)
+                    if self.index_url is not None:
+                        self.link_index(resourcelist)
+                if fast_xml:
+                    resourcelist.add_fragment(*resource)
+                else:
+                    resourcelist.add(resource)
 
                 # under conditions: yield the current resourcelist
                 if resource_count % self.para.max_items_in_list == 0:
@@ -120,6 +213,8 @@ class ElasticResourceListExecutor(Executor):
                     LOG.info("Generating resourcelist #:" + str(ordinal) + "...")
                     sitemap_data = self.finish_sitemap(ordinal, resourcelist, doc_start=doc_start, doc_end=doc_end)
                     LOG.info("Resource list # " + str(ordinal) + " successfully generated")
+                    if self.checkpoint is not None:
+                        self.checkpoint.finished_file(sitemap_data, self.scroll_cursor)
                     yield sitemap_data, resourcelist
                     resourcelist = None
 
@@ -142,37 +237,69 @@ class ElasticResourceListExecutor(Executor):
         return generator
 
     def resource_generator(self) -> iter:
+        resolver = self.location_resolver
+
+        def output(e_source) -> [Resource, Resource]:
+            e_doc = ResourceDoc.from_source(e_source)
+            uri = resolver.uri(e_doc.location)
+            ln = []
+            if e_doc.ln:
+                for link in e_doc.ln:
+                    link_uri = resolver.uri(link.href)
+                    ln.append({'href': link_uri, 'rel': link.rel, 'mime': link.mime})
+
+            resource = Resource(uri=uri, length=e_doc.length,
+                                lastmod=e_doc.lastmod,
+                                md5=e_doc.md5,
+                                mime_type=e_doc.mime,
+                                ln=ln)
+            return resource, resource
+
+        return self.hit_generator(output)
+
+    def fragment_generator(self) -> iter:
+        serializer = UrlFragmentSerializer(self.location_resolver, pretty_xml=self.para.is_saving_pretty_xml)
+
+        def output(e_source) -> [[str, str], Resource]:
+            uri, fragment = serializer.fragment(e_source)
+            return (uri, fragment), serializer.resource(e_source, uri)
 
-        def generator(count=0) -> [int, Resource]:
+        return self.hit_generator(output)
+
+    def hit_generator(self, output) -> iter:
+        """
+        Generator of the resources of the resource set, as output(_source of the hit) turns them into an item
+        and the Resource given to observers. Erases the changes at the first scroll and skips the resources
+        written by the interrupted run being resumed.
+        """
+
+        def generator(count=0) -> [int, object]:
             elastic_page_generator = self.elastic_page_generator()
-            erased_changes = False
-            for e_page in elastic_page_generator():
-                if not erased_changes:
-                    # this will happen at the first scroll
-                    self.erase_changes()
-                    LOG.info("Changes erased")
-                    erased_changes = True
-                for e_hit in e_page:
-                    e_source = e_hit['_source']
-                    e_doc = ResourceDoc.as_resource_doc(e_source)
-                    count += 1
-                    uri = e_doc.location.uri_from_path(para_url_prefix=self.para.url_prefix,
-                                                       para_res_root_dir=self.para.res_root_dir)
-                    ln = []
-                    if e_doc.ln:
-                        for link in e_doc.ln:
-                            link_uri = link.href.uri_from_path(para_url_prefix=self.para.url_prefix,
-                                                               para_res_root_dir=self.para.res_root_dir)
-                            ln.append({'href': link_uri, 'rel': link.rel, 'mime': link.mime})
-
-                    resource = Resource(uri=uri, length=e_doc.length,
-                                        lastmod=e_doc.lastmod,
-                                        md5=e_doc.md5,
-                                        mime_type=e_doc.mime,
-                                        ln=ln)
-                    yield count, resource
-                    self.observers_inform(self, ExecutorEvent.created_resource, resource=resource,
-                                          count=count)
+            erased_changes = self.checkpoint is not None and self.checkpoint.changes_erased
+            resume_after = self.checkpoint.cursor if self.checkpoint is not None else None
+            progress = ProgressEvents.from_parameters(self, self.para)
+            try:
+                for e_page in elastic_page_generator():
+                    if not erased_changes:
+                        # this will happen at the first scroll
+                        self.erase_changes()
+                        LOG.info("Changes erased")
+                        erased_changes = True
+                        if self.checkpoint is not None:
+                            # a resumed run must not erase the changes recorded since the interruption
+                            self.checkpoint.changes_erased = True
+                            self.checkpoint.save()
+                    for e_hit in e_page:
+                        if resume_after is not None and e_hit['_id'] <= resume_after:
+                            # already written by the interrupted run
+                            continue
+                        self.scroll_cursor = e_hit['_id']
+                        count += 1
+                        item, resource = output(e_hit['_source'])
+                        yield count, item
+                        progress.created_resource(count, resource=resource)
+            finally:
+                progress.close()
 
         return generator
 
@@ -190,6 +317,12 @@ class ElasticResourceListExecutor(Executor):
                     }
                 }
             }
+            if self.para.resumable:
+                # a stable order allows a restarted run to continue after the last resource written
+                query["sort"] = [{"_uid": {"order": "asc"}}]
+                if self.checkpoint is not None and self.checkpoint.cursor is not None:
+                    uid = self.para.elastic_resource_doc_type + "#" + self.checkpoint.cursor
+                    query["query"]["bool"]["must"].append({"range": {"_uid": {"gt": uid}}})
 
             return self.query_manager.scan_and_scroll(index=self.para.elastic_index,
                                                       doc_type=self.para.elastic_resource_doc_type,
@@ -199,6 +332,22 @@ class ElasticResourceListExecutor(Executor):
 
         return generator
 
+    def count_resources(self):
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "term": {"resource_set": self.para.resource_set}
+                        }
+                    ]
+                }
+            }
+        }
+        return self.query_manager.count_documents(index=self.para.elastic_index,
+                                                  doc_type=self.para.elastic_resource_doc_type,
+                                                  query=query)
+
     def erase_changes(self):
         self.query_manager.delete_all_index_set_type_docs(index=self.para.elastic_index,
                                                           doc_type=self.para.elastic_change_doc_type,
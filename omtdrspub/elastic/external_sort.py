@@ -0,0 +1,127 @@
+import heapq
+import json
+import os
+import shutil
+import tempfile
+
+# runs merged at once: each one is an open file
+MAX_FAN_IN = 128
+
+
+class ExternalSorter(object):
+    """
+    Sorts more records than fit in memory.
+
+    Records (json serializable lists) are buffered and, every buffer_size records, sorted and spilled to a
+    run file in a temporary directory. Iterating merges the runs with the records still in memory, so that
+    at most buffer_size records, plus one per run, are held in memory at any time. With more than fan_in
+    runs, consecutive runs are first merged fan_in at a time into longer runs, so that no more than fan_in
+    files are open at once.
+    """
+
+    def __init__(self, key, buffer_size, tmp_dir=None, fan_in=MAX_FAN_IN):
+        self._key = key
+        self._buffer_size = max(1, buffer_size)
+        self._fan_in = max(2, fan_in)
+        self._tmp_dir = tmp_dir
+        self._run_dir = None
+        self._runs = []
+        self._buffer = []
+
+    def add(self, record: list):
+        self._buffer.append(record)
+        if len(self._buffer) >= self._buffer_size:
+            self._spill()
+
+    def _spill(self):
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix="rs-sort-", dir=self._tmp_dir)
+        self._buffer.sort(key=self._key)
+        self._runs.append(self._write_run(self._buffer))
+        self._buffer = []
+
+    def _write_run(self, records: iter) -> str:
+        fd, path = tempfile.mkstemp(prefix="run_", suffix=".jsonl", dir=self._run_dir)
+        with open(fd, "w", encoding="utf-8") as run_file:
+            for record in records:
+                run_file.write(json.dumps(record))
+                run_file.write("\n")
+        return path
+
+    def _merge_runs(self):
+        # one slot is left for the records in memory; runs are merged in order, so that equal keys keep it
+        while len(self._runs) > self._fan_in - 1:
+            runs = []
+            for i in range(0, len(self._runs), self._fan_in):
+                group = self._runs[i:i + self._fan_in]
+                if len(group) == 1:
+                    runs.append(group[0])
+                    continue
+                runs.append(self._write_run(heapq.merge(*[self._read_run(path) for path in group],
+                                                        key=self._key)))
+                for path in group:
+                    os.remove(path)
+            self._runs = runs
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, "r", encoding="utf-8") as run_file:
+            for line in run_file:
+                yield json.loads(line)
+
+    def __iter__(self):
+        if self._runs and self._buffer:
+            # free the buffer for whoever consumes the merge
+            self._spill()
+        self._buffer.sort(key=self._key)
+        self._merge_runs()
+        iterators = [self._read_run(path) for path in self._runs] + [iter(self._buffer)]
+        return heapq.merge(*iterators, key=self._key)
+
+    def close(self):
+        self._buffer = []
+        self._runs = []
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+
+
+CHANGE_TYPES = ("created", "updated", "deleted")
+
+
+def last_changes(changes: iter, buffer_size, tmp_dir=None) -> [dict, iter]:
+    """
+    Keep the last change of every uri, in bounded memory.
+
+    changes yields [uri, lastmod, change, md_datetime] in chronological order. Returns the number of changes
+    per change type and a sorter iterating the surviving changes as [uri, lastmod, change, md_datetime, ...],
+    grouped by change type (created, updated, deleted) and ordered by time within each group.
+    The sorter must be closed once done with it.
+    """
+    by_uri = ExternalSorter(key=lambda r: (r[0], r[4]), buffer_size=buffer_size, tmp_dir=tmp_dir)
+    by_group = ExternalSorter(key=lambda r: (r[5], r[4]), buffer_size=buffer_size, tmp_dir=tmp_dir)
+    try:
+        for seq, (uri, lastmod, change, md_datetime) in enumerate(changes):
+            by_uri.add([uri, lastmod, change, md_datetime, seq])
+
+        counts = {change_type: 0 for change_type in CHANGE_TYPES}
+        last = None
+        for record in by_uri:
+            if last is not None and last[0] != record[0]:
+                _add_last(by_group, last, counts)
+            last = record
+        if last is not None:
+            _add_last(by_group, last, counts)
+    except Exception:
+        by_group.close()
+        raise
+    finally:
+        by_uri.close()
+    return counts, by_group
+
+
+def _add_last(by_group, record, counts):
+    change = record[2]
+    if change in counts:
+        counts[change] += 1
+        by_group.add(record + [CHANGE_TYPES.index(change)])
@@ -0,0 +1,180 @@
+import logging
+import re
+import sys
+from xml.etree.ElementTree import Element, tostring
+
+from resync import Resource
+from resync import ResourceList
+from resync.resource_list import ResourceListDupeError
+from resync.sitemap import Sitemap
+
+from omtdrspub.elastic.model.location import LocationResolver
+
+LOG = logging.getLogger(__name__)
+
+# ElementTree sorts attributes by name before python 3.8, and keeps their insertion order since then
+SORTED_ATTRIBUTES = sys.version_info < (3, 8)
+# lastmod values in this form are written unchanged by resync
+PLAIN_LASTMOD = re.compile(r"\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ\Z")
+
+
+def escape_table(serialize) -> dict:
+    """The str.translate table of the characters ElementTree escapes, as serialize(character) shows them."""
+    table = {}
+    for char in "&<>\"'\r\n\t":
+        escaped = serialize(char)
+        if escaped != char:
+            table[ord(char)] = escaped
+    return table
+
+
+def serialized_text(text) -> str:
+    element = Element("e")
+    element.text = text
+    # <e>text</e>
+    return tostring(element, encoding="unicode")[3:-4]
+
+
+def serialized_attrib(value) -> str:
+    # <e a="value" />
+    return tostring(Element("e", a=value), encoding="unicode")[6:-4]
+
+
+# the escaping of ElementTree differs between python versions (whitespace in attributes): it is taken from the
+# serializer itself, so that the fragments stay byte-identical
+CDATA_ESCAPES = escape_table(serialized_text)
+ATTRIB_ESCAPES = escape_table(serialized_attrib)
+
+
+def escape_cdata(text) -> str:
+    return text.translate(CDATA_ESCAPES)
+
+
+def escape_attrib(value) -> str:
+    return value.translate(ATTRIB_ESCAPES)
+
+
+class FragmentResourceList(ResourceList):
+    """
+    A resourcelist whose <url> elements are already serialized.
+
+    fragments maps each uri to its <url> element, the preamble is still written by resync.
+    """
+
+    def __init__(self, fragments: dict=None):
+        super(FragmentResourceList, self).__init__()
+        self.fragments = fragments if fragments is not None else {}
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def add_fragment(self, uri, fragment):
+        if uri in self.fragments:
+            raise ResourceListDupeError("Attempt to add resource already in resource_list")
+        self.fragments[uri] = fragment
+
+    def write_fragments(self, path):
+        xml = self.as_xml()
+        # the preamble of an empty resourcelist, <url> elements go before the closing tag
+        split = xml.rindex("</urlset>")
+        with open(path, "w", encoding="utf-8") as sm_file:
+            sm_file.write(xml[:split])
+            # resync writes the resources of a resourcelist ordered by uri
+            for uri in sorted(self.fragments):
+                sm_file.write(self.fragments[uri])
+            sm_file.write(xml[split:])
+
+
+class UrlFragmentSerializer(object):
+    """
+    Serializes the _source of resource documents straight into <url> elements, skipping ResourceDoc,
+    Resource and the ElementTree serializer of resync.
+
+    The first document of every shape (which fields and links are set) is also serialized by resync:
+    if the results differ, the serializer logs a warning and falls back to resync for the rest of the run,
+    so the output is always the one resync would write.
+    """
+
+    def __init__(self, resolver: LocationResolver, pretty_xml=False):
+        self._resolver = resolver
+        self._pretty_xml = pretty_xml
+        self._sitemap = Sitemap()
+        self._sitemap.pretty_xml = pretty_xml
+        self._verified_shapes = set()
+        self.enabled = True
+
+    def fragment(self, e_source: dict) -> [str, str]:
+        uri = self._resolver.resolve(e_source['location']['value'], e_source['location']['type'])
+        if not self.enabled:
+            return uri, self.etree_fragment(e_source, uri)
+
+        fragment = self.fast_fragment(e_source, uri)
+        shape = self.shape(e_source)
+        if shape not in self._verified_shapes:
+            expected = self.etree_fragment(e_source, uri)
+            if fragment != expected:
+                LOG.warning("Fast xml serialization differs from resync, falling back to resync: %s != %s"
+                            % (fragment, expected))
+                self.enabled = False
+                return uri, expected
+            self._verified_shapes.add(shape)
+        return uri, fragment
+
+    def fast_fragment(self, e_source: dict, uri: str) -> str:
+        parts = ["<url><loc>", escape_cdata(uri), "</loc>"]
+        lastmod = e_source.get('lastmod')
+        if lastmod is not None:
+            if PLAIN_LASTMOD.match(lastmod) is None:
+                lastmod = Resource(uri=uri, lastmod=lastmod).lastmod
+            parts += ["<lastmod>", escape_cdata(lastmod), "</lastmod>"]
+
+        md_atts = []
+        if e_source.get('md5') is not None:
+            md_atts.append(('hash', "md5:" + e_source['md5']))
+        if e_source.get('length') is not None:
+            md_atts.append(('length', str(e_source['length'])))
+        if e_source.get('mime') is not None:
+            md_atts.append(('type', str(e_source['mime'])))
+        if md_atts:
+            parts.append(self.empty_element("rs:md", md_atts, tail=False))
+
+        for link in e_source.get('ln') or []:
+            ln_atts = [('href', self._resolver.resolve(link['href']['value'], link['href']['type']))]
+            if link.get('rel') is not None:
+                ln_atts.append(('rel', str(link['rel'])))
+            if link.get('mime') is not None:
+                ln_atts.append(('mime', str(link['mime'])))
+            parts.append(self.empty_element("rs:ln", ln_atts, tail=self._pretty_xml))
+
+        parts.append("</url>\n" if self._pretty_xml else "</url>")
+        return "".join(parts)
+
+    @staticmethod
+    def empty_element(tag, atts, tail):
+        if SORTED_ATTRIBUTES:
+            atts = sorted(atts)
+        element = "<" + tag + "".join([" %s=\"%s\"" % (k, escape_attrib(v)) for k, v in atts]) + " />"
+        return element + "\n" if tail else element
+
+    def etree_fragment(self, e_source: dict, uri: str) -> str:
+        e = self._sitemap.resource_etree_element(self.resource(e_source, uri))
+        return tostring(e, encoding="unicode")
+
+    def resource(self, e_source: dict, uri: str) -> Resource:
+        # same as ElasticResourceListExecutor.resource_generator
+        ln = []
+        for link in e_source.get('ln') or []:
+            link_uri = self._resolver.resolve(link['href']['value'], link['href']['type'])
+            ln.append({'href': link_uri, 'rel': link.get('rel'), 'mime': link.get('mime')})
+        return Resource(uri=uri, length=e_source.get('length'),
+                        lastmod=e_source.get('lastmod'),
+                        md5=e_source.get('md5'),
+                        mime_type=e_source.get('mime'),
+                        ln=ln)
+
+    @staticmethod
+    def shape(e_source: dict):
+        lastmod = e_source.get('lastmod')
+        return (lastmod is None or PLAIN_LASTMOD.match(lastmod) is not None,
+                tuple([e_source.get(key) is None for key in ('lastmod', 'md5', 'length', 'mime')]),
+                tuple([(link.get('rel') is None, link.get('mime') is None) for link in e_source.get('ln') or []]))
@@ -0,0 +1,314 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import base64
+import hashlib
+import mimetypes
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import logging
+
+from omtdrspub.elastic import utils
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager, location_key, resource_set_query
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.model.change_doc import ChangeDoc
+from omtdrspub.elastic.model.location import Location, LocationResolver
+from omtdrspub.elastic.model.resource_doc import ResourceDoc
+from omtdrspub.elastic.stat_cache import StatCache
+
+MAX_RESULT_WINDOW = 10000
+
+# bytes read at a time when hashing a file
+READ_SIZE = 1024 * 1024
+
+# locations looked up by a single search: the terms of a query are rewritten into one clause each, and
+# elasticsearch refuses queries of more than 1024 clauses (indices.query.bool.max_clause_count)
+MAX_TERMS = 1000
+
+LOG = logging.getLogger(__name__)
+
+
+def walk_files(root_dir) -> [str, os.stat_result]:
+    """Yield the path and stat of every regular file under root_dir, without following symbolic links."""
+    stack = [root_dir]
+    while len(stack) > 0:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as err:
+            LOG.warning("Cannot read %s: %s" % (directory, err))
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path, entry.stat(follow_symlinks=False)
+            except OSError as err:
+                LOG.warning("Cannot stat %s: %s" % (entry.path, err))
+
+
+def file_digest(path) -> [int, str]:
+    """Length and md5 (in base64, as resync expresses it) of the file at path, read in chunks of READ_SIZE."""
+    md5 = hashlib.md5()
+    length = 0
+    # unbuffered: every read goes straight into a chunk
+    with open(path, "rb", buffering=0) as file:
+        chunk = file.read(READ_SIZE)
+        while chunk:
+            md5.update(chunk)
+            length += len(chunk)
+            chunk = file.read(READ_SIZE)
+    return length, base64.b64encode(md5.digest()).decode("ascii")
+
+
+def elastic_id(resource_set, location: Location) -> str:
+    """The id of a new resource document of a location, the same at every ingestion."""
+    key = "\0".join((resource_set, location.loc_type, location.value))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def change_operation(para: ElasticRsParameters, location: Location, change, lastmod=None, change_datetime=None):
+    """Bulk operation recording a change, that happened at change_datetime (default: now)."""
+    now = utils.formatted_date(datetime.now())
+    change_doc = ChangeDoc(resource_set=para.resource_set, location=location, lastmod=lastmod, change=change,
+                           datetime=change_datetime or now, timestamp=now)
+    return 'index', para.elastic_change_doc_type, None, change_doc.to_source()
+
+
+def index_operations(para: ElasticRsParameters, resource_doc: ResourceDoc, change, record_change=True,
+                     change_datetime=None):
+    """Bulk operations indexing a resource document and, if record_change, its change ('created' or 'updated')."""
+    operations = [('index', para.elastic_resource_doc_type, resource_doc.resync_id, resource_doc.to_source())]
+    if record_change:
+        operations.append(change_operation(para, resource_doc.location, change, resource_doc.lastmod,
+                                           change_datetime))
+    return operations
+
+
+def delete_operations(para: ElasticRsParameters, resync_id, location: Location, record_change=True,
+                      change_datetime=None):
+    """Bulk operations deleting a resource document and, if record_change, recording its deletion."""
+    operations = [('delete', para.elastic_resource_doc_type, resync_id, None)]
+    if record_change:
+        operations.append(change_operation(para, location, 'deleted', change_datetime=change_datetime))
+    return operations
+
+
+class ElasticIngester(object):
+    """
+    Fills the resource type of a resource set with the files found in res_root_dir.
+
+    Files are hashed by ingest_workers threads, in chunks of READ_SIZE. Every ingest_bulk_size files, the
+    documents already in the index are fetched by location (MAX_TERMS locations per search), and only new and
+    modified files are written, with their changes, in a single bulk request. Modified files keep the id of their
+    document, whoever indexed it; new ones get an id derived from the resource set and the location (see
+    :func:`elastic_id`).
+    Once all files are ingested, the documents of files that are no longer on disk are deleted, with a
+    'deleted' change.
+
+    With a stat_cache_dir, the md5 of every file is kept in a :class:`StatCache` of the resource set, and
+    files whose size, mtime and inode have not changed since are not read again.
+    """
+
+    def __init__(self, para: ElasticRsParameters, query_manager: ElasticQueryManager=None):
+        if para.ingest_location_type not in ('rel_path', 'abs_path'):
+            raise ValueError("Files can only be ingested with rel_path or abs_path locations")
+        self.para = para
+        self.root_dir = os.path.abspath(para.res_root_dir)
+        self.workers = max(1, para.ingest_workers or os.cpu_count() or 1)
+        self.bulk_size = para.ingest_bulk_size
+        self.query_manager = query_manager if query_manager is not None \
+            else ElasticQueryManager(para.elastic_host, para.elastic_port)
+        self.location_resolver = LocationResolver(para.url_prefix, para.res_root_dir)
+        self.counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'failed': 0}
+        self.stat_cache = None
+
+    def open_stat_cache(self) -> StatCache:
+        if self.para.stat_cache_dir is None:
+            return None
+        return StatCache.for_resource_set(self.para.abs_stat_cache_dir(), self.para.resource_set)
+
+    def ingest(self) -> dict:
+        """Ingest res_root_dir, then delete the documents of missing files. Returns the counts per outcome."""
+        self.stat_cache = self.open_stat_cache()
+        complete = False
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = deque()
+                batch = []
+                for path, stat in walk_files(self.root_dir):
+                    md5 = self.stat_cache.get(path, stat) if self.stat_cache is not None else None
+                    pending.append((path, stat, pool.submit(self.describe, path, stat, md5)))
+                    # files are hashed in order, a few per worker ahead of the current batch
+                    while len(pending) > 4 * self.workers:
+                        self._append(batch, *pending.popleft())
+                while len(pending) > 0:
+                    self._append(batch, *pending.popleft())
+                self.write_batch(batch)
+            complete = True
+        finally:
+            if self.stat_cache is not None:
+                self.stat_cache.close(complete=complete)
+        self.delete_missing()
+        LOG.info("Ingested %s: %s" % (self.para.resource_set, self.counts))
+        return self.counts
+
+    def _append(self, batch, path, stat, future):
+        resource_doc = future.result()
+        if resource_doc is None:
+            return
+        if self.stat_cache is not None:
+            self.stat_cache.put(path, stat, resource_doc.md5)
+        batch.append(resource_doc)
+        if len(batch) >= self.bulk_size:
+            self.write_batch(batch)
+            batch.clear()
+
+    def location(self, path) -> Location:
+        if self.para.ingest_location_type == 'abs_path':
+            return Location(path, 'abs_path')
+        return Location(os.path.relpath(path, self.root_dir).replace(os.sep, '/'), 'rel_path')
+
+    def describe(self, path, stat: os.stat_result, md5=None) -> ResourceDoc:
+        """The resource document of a file, or None if the file cannot be read. The file is hashed unless md5
+        is given."""
+        if md5 is not None:
+            length = stat.st_size
+        else:
+            try:
+                length, md5 = file_digest(path)
+            except OSError as err:
+                LOG.warning("Not ingesting %s: %s" % (path, err))
+                return None
+        location = self.location(path)
+        return ResourceDoc(resync_id=elastic_id(self.para.resource_set, location),
+                           resource_set=self.para.resource_set, location=location, length=length, md5=md5,
+                           mime=mimetypes.guess_type(path)[0],
+                           lastmod=utils.formatted_date(datetime.utcfromtimestamp(stat.st_mtime)),
+                           timestamp=utils.formatted_date(datetime.now()))
+
+    def write_batch(self, resource_docs: [ResourceDoc], record_change=True, keep_links=True,
+                    change_datetimes: dict=None) -> list:
+        """
+        Index new and modified resource documents, with their changes if record_change. The links of modified
+        documents are kept if keep_links. Changes happen now, or at the time change_datetimes gives for their
+        location (by :func:`location_key`). Returns the failed operations, see :func:`bulk`.
+        """
+        if len(resource_docs) == 0:
+            return []
+        existing = self.existing_documents([doc.location for doc in resource_docs])
+        # the time they are indexed, see ElasticQueryManager.use_location_filter
+        timestamp = utils.formatted_date(datetime.now())
+        operations = []
+        for resource_doc in resource_docs:
+            e_id, e_source = existing.get(location_key(resource_doc.location), (None, None))
+            if e_source is None:
+                change = 'created'
+            elif e_source.get('md5') == resource_doc.md5 and e_source.get('length') == resource_doc.length \
+                    and e_source.get('lastmod') == resource_doc.lastmod \
+                    and (keep_links or e_source.get('ln', []) == resource_doc.to_source()['ln']):
+                self.counts['unchanged'] += 1
+                continue
+            else:
+                change = 'updated'
+                resource_doc.resync_id = e_id
+                if keep_links:
+                    # links are not found on disk, keep the ones the document has
+                    resource_doc.ln = ResourceDoc.from_source(e_source).ln
+            resource_doc.timestamp = timestamp
+            change_datetime = change_datetimes.get(location_key(resource_doc.location)) if change_datetimes else None
+            operations.extend(index_operations(self.para, resource_doc, change, record_change=record_change,
+                                               change_datetime=change_datetime))
+            self.counts[change] += 1
+        failed = self.bulk(operations)
+        if self.stat_cache is not None:
+            # an interrupted ingestion keeps the md5 computed so far
+            self.stat_cache.commit()
+        return failed
+
+    def delete_paths(self, paths: [str]):
+        """Delete the documents of files that are no longer on disk, if they are in the index."""
+        return self.delete_documents([self.location(path) for path in paths])
+
+    def delete_documents(self, locations: [Location], record_change=True, change_datetimes: dict=None) -> list:
+        """
+        Delete the documents of the given locations that are in the index, with their changes if record_change
+        (see :func:`write_batch` for change_datetimes). Returns the failed operations, see :func:`bulk`.
+        """
+        operations = []
+        for e_hit in self.documents_by_location(locations):
+            location = Location.from_source(e_hit['_source']['location'])
+            change_datetime = change_datetimes.get(location_key(location)) if change_datetimes else None
+            operations.extend(delete_operations(self.para, e_hit['_id'], location, record_change=record_change,
+                                                change_datetime=change_datetime))
+            self.counts['deleted'] += 1
+        return self.bulk(operations)
+
+    def documents_by_location(self, locations: [Location]) -> iter:
+        """The hits of the resource documents of the given locations, searched MAX_TERMS locations at a time."""
+        for start in range(0, len(locations), MAX_TERMS):
+            yield from self.query_manager.get_documents_by_locations(index=self.para.elastic_index,
+                                                                     doc_type=self.para.elastic_resource_doc_type,
+                                                                     resource_set=self.para.resource_set,
+                                                                     locations=locations[start:start + MAX_TERMS])
+
+    def existing_documents(self, locations: [Location]) -> dict:
+        """The id and source of the resource documents of the given locations that are in the index, by
+        :func:`location_key`."""
+        existing = {}
+        for e_hit in self.documents_by_location(locations):
+            key = location_key(Location.from_source(e_hit['_source']['location']))
+            if key in existing:
+                LOG.warning("More than one document with location %s" % key.replace("\0", " "))
+                continue
+            existing[key] = e_hit['_id'], e_hit['_source']
+        return existing
+
+    def delete_missing(self):
+        self.query_manager.refresh_index(self.para.elastic_index)
+        operations = []
+        for e_page in self.query_manager.scan_and_scroll(index=self.para.elastic_index,
+                                                         doc_type=self.para.elastic_resource_doc_type,
+                                                         query=resource_set_query(self.para.resource_set),
+                                                         max_items_in_list=self.para.max_items_in_list,
+                                                         max_result_window=MAX_RESULT_WINDOW):
+            for e_hit in e_page:
+                location = Location.from_source(e_hit['_source']['location'])
+                path = self.location_resolver.path(location)
+                if path is None or os.path.exists(path):
+                    continue
+                operations.extend(delete_operations(self.para, e_hit['_id'], location))
+                self.counts['deleted'] += 1
+                if len(operations) >= 2 * self.bulk_size:
+                    self.bulk(operations)
+                    operations = []
+        self.bulk(operations)
+
+    def bulk(self, operations) -> list:
+        """Send operations in a bulk request. Returns the (op_type, result) of the operations that failed."""
+        failed = []
+        if len(operations) == 0:
+            return failed
+        for item in self.query_manager.bulk(index=self.para.elastic_index, operations=operations):
+            op_type, result = next(iter(item.items()))
+            if result.get('status', 200) >= 300 and not (op_type == 'delete' and result.get('status') == 404):
+                LOG.error("Failed to %s %s: %s" % (op_type, result.get('_id'), result.get('error')))
+                self.counts['failed'] += 1
+                failed.append((op_type, result))
+        return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest the files of a resource set into Elasticsearch")
+    parser.add_argument("config", help="yaml file with the parameters of the resource set")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    ElasticIngester(ElasticRsParameters.from_yaml_params(args.config)).ingest()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import json
+import queue
+import socketserver
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import logging
+
+from omtdrspub.elastic import utils
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.ingest import change_operation
+from omtdrspub.elastic.model.link import Link
+from omtdrspub.elastic.model.location import Location
+from omtdrspub.elastic.model.resource_doc import ResourceDoc
+
+LOG = logging.getLogger(__name__)
+
+# operation -> bulk op_type of the resource document
+OPERATIONS = {
+    'create_or_update': 'index',
+    'create': 'create',
+    'update': 'index',
+    'delete': 'delete'
+}
+
+# seconds a producer waits for the result of an operation
+RESULT_TIMEOUT = 60
+
+
+class PendingOperation(object):
+    """An operation submitted by a producer, waiting to be written."""
+
+    __slots__ = ('para', 'op', 'elastic_id', 'location', 'resource_doc', 'record_change', 'result', 'done')
+
+    def __init__(self, para: ElasticRsParameters, dct: dict):
+        self.para = para
+        self.op = dct.get('op', 'create_or_update')
+        if self.op not in OPERATIONS:
+            raise ValueError("Unknown operation: %s" % self.op)
+        self.elastic_id = dct.get('id')
+        if self.elastic_id is None:
+            raise ValueError("Operations need an id")
+        if dct.get('location') is None:
+            raise ValueError("Operations need a location")
+        self.location = Location.from_source(dct['location'])
+        self.resource_doc = None
+        if self.op != 'delete':
+            self.resource_doc = ResourceDoc(resync_id=self.elastic_id, resource_set=para.resource_set,
+                                            location=self.location, length=dct.get('length'), md5=dct.get('md5'),
+                                            mime=dct.get('mime'), lastmod=dct.get('lastmod'),
+                                            ln=[Link.from_source(link) for link in dct.get('ln') or []],
+                                            timestamp=utils.formatted_date(datetime.now()))
+        self.record_change = dct.get('record_change', True)
+        self.result = None
+        self.done = threading.Event()
+
+    def bulk_operation(self):
+        doc = None
+        if self.resource_doc is not None:
+            # the time it is indexed, see ElasticQueryManager.use_location_filter
+            self.resource_doc.timestamp = utils.formatted_date(datetime.now())
+            doc = self.resource_doc.to_source()
+        return OPERATIONS[self.op], self.para.elastic_resource_doc_type, self.elastic_id, doc
+
+    def change(self, result: dict) -> str:
+        """The change recorded for the outcome of the operation, or None."""
+        status = result.get('status', 500)
+        if self.op == 'delete':
+            return 'deleted' if status < 300 else None
+        if status >= 300:
+            return None
+        if self.op == 'create':
+            return 'created'
+        if self.op == 'update':
+            return 'updated'
+        return 'created' if status == 201 or result.get('created') else 'updated'
+
+    def finish(self, result: dict):
+        self.result = result
+        self.done.set()
+
+
+class IngestBatcher(object):
+    """
+    Coalesces the operations of all producers into bulk requests.
+
+    Operations are queued by :func:`submit`; a single thread takes them, at most bulk_size at a time, waiting
+    up to max_delay seconds after the first one for more to come. The resource documents of a batch are
+    written with one bulk request per index, then the changes of the operations that succeeded with a second
+    one: a create that fails because the resource exists records no change, as with
+    :func:`ElasticQueryManager.create_resource`.
+
+    query_manager, if given, replaces the Elasticsearch clients of the resource sets (e.g. a stand-in in tests).
+    """
+
+    def __init__(self, bulk_size=500, max_delay=0.05, query_manager: ElasticQueryManager=None):
+        self.bulk_size = bulk_size
+        self.max_delay = max_delay
+        self.query_manager = query_manager
+        self._queue = queue.Queue()
+        self._thread = None
+        self.bulk_requests = 0
+
+    def query_manager_for(self, para: ElasticRsParameters) -> ElasticQueryManager:
+        if self.query_manager is not None:
+            return self.query_manager
+        # clients are shared per host and port, see ElasticQueryManager
+        return ElasticQueryManager(para.elastic_host, para.elastic_port)
+
+    def submit(self, operations: [PendingOperation]):
+        for operation in operations:
+            self._queue.put(operation)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="ingest-batcher", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        while True:
+            operation = self._queue.get()
+            if operation is None:
+                return
+            batch = [operation]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.bulk_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    operation = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if operation is None:
+                    # write what was taken, then stop
+                    self._queue.put(None)
+                    break
+                batch.append(operation)
+            self.write(batch)
+
+    def stop(self):
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+
+    def write(self, batch: [PendingOperation]):
+        groups = {}
+        for operation in batch:
+            para = operation.para
+            groups.setdefault((para.elastic_host, para.elastic_port, para.elastic_index), []).append(operation)
+        for (host, port, index), operations in groups.items():
+            try:
+                self.write_group(index, operations)
+            except Exception as err:
+                LOG.exception("Failed to write %d operations to %s" % (len(operations), index))
+                for operation in operations:
+                    if not operation.done.is_set():
+                        operation.finish({'status': 503, 'error': repr(err)})
+
+    def write_group(self, index, operations: [PendingOperation]):
+        query_manager = self.query_manager_for(operations[0].para)
+        items = query_manager.bulk(index=index, operations=[op.bulk_operation() for op in operations])
+        self.bulk_requests += 1
+        results = []
+        # (index of the result, change operation)
+        changes = []
+        for operation, item in zip(operations, items):
+            result = next(iter(item.values()))
+            change = operation.change(result)
+            if change is not None and operation.record_change:
+                lastmod = operation.resource_doc.lastmod if operation.resource_doc is not None else None
+                changes.append((len(results), change_operation(operation.para, operation.location, change, lastmod)))
+            results.append({'id': operation.elastic_id, 'status': result.get('status'), 'change': change,
+                            'error': result.get('error')})
+        # producers are answered once their changes are recorded, or have failed to be
+        for i, error in self.write_changes(query_manager, index, changes):
+            LOG.error("Failed to record the change of %s: %s" % (results[i]['id'], error))
+            results[i]['change'] = None
+            results[i]['error'] = "Failed to record the change: %s" % error
+        for operation, result in zip(operations, results):
+            operation.finish(result)
+
+    def write_changes(self, query_manager: ElasticQueryManager, index, changes) -> [int, str]:
+        """Write the changes, returning the index of the result and the error of those that failed."""
+        if len(changes) == 0:
+            return []
+        try:
+            items = query_manager.bulk(index=index, operations=[operation for i, operation in changes])
+        except Exception as err:
+            LOG.exception("Failed to write %d changes to %s" % (len(changes), index))
+            return [(i, repr(err)) for i, operation in changes]
+        finally:
+            self.bulk_requests += 1
+        failed = []
+        for (i, operation), item in zip(changes, items):
+            result = next(iter(item.values()))
+            if result.get('status', 500) >= 300:
+                failed.append((i, result.get('error') or "status %s" % result.get('status')))
+        return failed
+
+
+class IngestRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /resource_sets/<resource_set>/operations with a json list of operations, answered with the json list
+    of their results, in the same order.
+    """
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "resource_sets" or parts[2] != "operations":
+            return self.respond(404, {'error': "Unknown path: %s" % self.path})
+        para = self.server.paras.get(parts[1])
+        if para is None:
+            return self.respond(404, {'error': "Unknown resource set: %s" % parts[1]})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode("utf-8"))
+            if isinstance(body, dict):
+                body = [body]
+            operations = [PendingOperation(para, dct) for dct in body]
+        except (ValueError, TypeError, KeyError, AttributeError) as err:
+            return self.respond(400, {'error': str(err)})
+
+        self.server.batcher.submit(operations)
+        results = []
+        for operation in operations:
+            if operation.done.wait(RESULT_TIMEOUT):
+                results.append(operation.result)
+            else:
+                results.append({'id': operation.elastic_id, 'status': 504, 'error': "Timed out"})
+        self.respond(200, results)
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        LOG.debug("%s - %s" % (self.address_string(), format % args))
+
+
+class IngestServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    A local http service registering the resources of a number of resource sets for any producer, whatever its
+    language: operations of all producers are coalesced into bulk requests by an :class:`IngestBatcher`.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, paras: [ElasticRsParameters], batcher: IngestBatcher=None):
+        self.paras = {para.resource_set: para for para in paras}
+        self.batcher = batcher if batcher is not None else IngestBatcher()
+        super(IngestServer, self).__init__(server_address, IngestRequestHandler)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.batcher.start()
+        try:
+            super(IngestServer, self).serve_forever(poll_interval)
+        finally:
+            self.batcher.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Register resources of resource sets over http, in bulk")
+    parser.add_argument("configs", nargs="+", help="yaml files with the parameters of the resource sets")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--bulk-size", type=int, default=500, help="operations per bulk request")
+    parser.add_argument("--max-delay", type=float, default=0.05,
+                        help="seconds an operation can wait for others to share its bulk request")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    paras = [ElasticRsParameters.from_yaml_params(config) for config in args.configs]
+    server = IngestServer((args.host, args.port), paras,
+                          batcher=IngestBatcher(bulk_size=args.bulk_size, max_delay=args.max_delay))
+    LOG.info("Listening on %s:%d" % server.server_address[:2])
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from glob import glob
+
+import logging
+
+from omtdrspub.elastic import utils
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager, location_key
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.ingest import ElasticIngester
+from omtdrspub.elastic.model.location import Location
+from omtdrspub.elastic.model.resource_doc import ResourceDoc
+
+LOG = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "journal-"
+SEGMENT_SUFFIX = ".log"
+
+# a segment is closed once it holds this many bytes, even if it is not being replayed
+MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_segment(path) -> [dict]:
+    """The records of a segment; a last record cut short by a crash is left out."""
+    records = []
+    with open(path, "rb") as segment:
+        for line in segment:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("incomplete record")
+                records.append(json.loads(line.decode("utf-8")))
+            except ValueError:
+                LOG.warning("Ignoring an incomplete record at the end of %s" % path)
+                break
+    return records
+
+
+class IngestJournal(object):
+    """
+    Resource operations of a resource set, acknowledged as soon as they are on the local disk and written to
+    Elasticsearch in the background.
+
+    Operations are appended to the current segment of the journal dir, one json line each, and fsync'ed before
+    the call returns. :func:`replay` closes the current segment and writes the closed ones in order, through
+    :class:`ElasticIngester`: only the last operation on every location of a segment is written, whatever id it
+    was given, in journal order and in bulk requests, and a segment is deleted once all of them succeed. A process
+    that crashes leaves its segments behind, replayed by the next journal opened on the same dir; replaying a
+    segment again is harmless, as unchanged resources are not written twice. A journal dir is used by one process
+    at a time.
+
+    Operations are written as :func:`ElasticQueryManager.create_or_update_resource` and
+    :func:`ElasticQueryManager.delete_resource` do, except that the change type of a resource ('created' or
+    'updated') is only known once it is replayed, and that create_resource cannot fail on existing resources.
+    """
+
+    def __init__(self, para: ElasticRsParameters, journal_dir=None, query_manager: ElasticQueryManager=None):
+        self.para = para
+        self.journal_dir = journal_dir if journal_dir is not None else para.abs_journal_dir()
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self._dir_lock = open(os.path.join(self.journal_dir, ".lock"), "a")
+        if utils.fcntl is not None:
+            try:
+                utils.fcntl.flock(self._dir_lock.fileno(), utils.fcntl.LOCK_EX | utils.fcntl.LOCK_NB)
+            except OSError:
+                self._dir_lock.close()
+                raise RuntimeError("The journal in %s is used by another process" % self.journal_dir)
+        self.ingester = ElasticIngester(para, query_manager=query_manager)
+        self._lock = threading.Lock()
+        # one replay at a time
+        self._replay_lock = threading.Lock()
+        self._segment = None
+        self._segment_path = None
+        self._sequence = 0
+
+    # operations, as in ElasticQueryManager
+    def create_or_update_resource(self, params: ElasticRsParameters, elastic_id, location: Location, length, md5,
+                                  mime, lastmod, ln=None, record_change=True):
+        resource_doc = ResourceDoc(resync_id=elastic_id, resource_set=params.resource_set, location=location,
+                                   length=length, md5=md5, mime=mime, lastmod=lastmod, ln=ln,
+                                   timestamp=utils.formatted_date(datetime.now()))
+        return self.append(params, {'op': 'index', 'doc': resource_doc.to_source(), 'record_change': record_change})
+
+    def create_resource(self, params: ElasticRsParameters, elastic_id, location, length, md5, mime, lastmod,
+                        ln=None, record_change=True):
+        return self.create_or_update_resource(params, elastic_id, location, length, md5, mime, lastmod, ln=ln,
+                                              record_change=record_change)
+
+    def update_resource(self, params: ElasticRsParameters, elastic_id, location, length, md5, mime, lastmod,
+                        ln=None, record_change=True):
+        return self.create_or_update_resource(params, elastic_id, location, length, md5, mime, lastmod, ln=ln,
+                                              record_change=record_change)
+
+    def delete_resource(self, params: ElasticRsParameters, elastic_id, location: Location, record_change=True):
+        return self.append(params, {'op': 'delete', 'resync_id': elastic_id, 'location': location.to_source(),
+                                    'record_change': record_change})
+
+    def append(self, params: ElasticRsParameters, record: dict) -> dict:
+        if record.get('resync_id', record.get('doc', {}).get('resync_id')) is None:
+            # the id of the document, if the location is not indexed yet
+            raise ValueError("Journaled operations need an elastic_id")
+        if params.resource_set != self.para.resource_set:
+            raise ValueError("This journal holds the operations of resource set %s, not %s" %
+                             (self.para.resource_set, params.resource_set))
+        with self._lock:
+            if self._segment is None:
+                self._open_segment()
+            self._sequence += 1
+            record['seq'] = self._sequence
+            # the time of the change, whenever it is replayed
+            record['datetime'] = utils.formatted_date(datetime.now())
+            self._segment.write((json.dumps(record) + "\n").encode("utf-8"))
+            self._segment.flush()
+            os.fsync(self._segment.fileno())
+            if self._segment.tell() >= MAX_SEGMENT_SIZE:
+                self._close_segment()
+        return {'journaled': True, 'seq': record['seq']}
+
+    def _open_segment(self):
+        # segments are replayed in the order of their names
+        name = "%s%020d%s" % (SEGMENT_PREFIX, time.time() * 1000000, SEGMENT_SUFFIX)
+        self._segment_path = os.path.join(self.journal_dir, name)
+        self._segment = open(self._segment_path, "ab")
+        fsync_dir(self.journal_dir)
+
+    def _close_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+            self._segment_path = None
+
+    def closed_segments(self) -> [str]:
+        with self._lock:
+            self._close_segment()
+            return sorted(glob(os.path.join(self.journal_dir, SEGMENT_PREFIX + "*" + SEGMENT_SUFFIX)))
+
+    def replay(self) -> int:
+        """Write the operations journaled so far; returns the number of segments written."""
+        with self._replay_lock:
+            replayed = 0
+            for path in self.closed_segments():
+                self.replay_segment(path)
+                os.remove(path)
+                replayed += 1
+            return replayed
+
+    def replay_segment(self, path):
+        # the last operation on every location, in the order they were journaled
+        last = {}
+        for record in read_segment(path):
+            if record['op'] == 'index':
+                resource_set = record['doc']['resource_set']
+                location = Location.from_source(record['doc']['location'])
+            else:
+                resource_set = self.para.resource_set
+                location = Location.from_source(record['location'])
+            key = (resource_set, location_key(location))
+            last.pop(key, None)
+            last[key] = record
+
+        failed = []
+        batch = []
+        for record in last.values():
+            # consecutive operations of the same kind are written together
+            if len(batch) > 0 and (len(batch) >= self.ingester.bulk_size or
+                                   (record['op'], record['record_change']) !=
+                                   (batch[0]['op'], batch[0]['record_change'])):
+                failed += self.write_records(batch)
+                batch = []
+            batch.append(record)
+        failed += self.write_records(batch)
+        if any(result.get('status') == 429 or result.get('status', 0) >= 500 for op_type, result in failed):
+            # the segment is written again at the next replay
+            raise IOError("Elasticsearch failed to write operations of %s" % path)
+        LOG.info("Replayed %d operations of %s" % (len(last), path))
+
+    def write_records(self, records: [dict]) -> list:
+        """Write records that all have the same op and record_change; returns the failed operations."""
+        if len(records) == 0:
+            return []
+        record_change = records[0]['record_change']
+        change_datetimes = {}
+        resource_docs = []
+        deleted = []
+        for record in records:
+            if record['op'] == 'index':
+                resource_doc = ResourceDoc.from_source(record['doc'])
+                resource_docs.append(resource_doc)
+                location = resource_doc.location
+            else:
+                location = Location.from_source(record['location'])
+                deleted.append(location)
+            # segments written before records had a datetime are stamped with the replay time
+            if record.get('datetime') is not None:
+                change_datetimes[location_key(location)] = record['datetime']
+        if records[0]['op'] == 'index':
+            return self.ingester.write_batch(resource_docs, record_change=record_change, keep_links=False,
+                                             change_datetimes=change_datetimes)
+        return self.ingester.delete_documents(deleted, record_change=record_change,
+                                              change_datetimes=change_datetimes)
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+            self._dir_lock.close()
+
+
+class JournalReplayer(object):
+    """Replays a journal every interval seconds in a background thread, waiting longer after failures."""
+
+    def __init__(self, journal: IngestJournal, interval=1.0, max_interval=60.0):
+        self.journal = journal
+        self.interval = interval
+        self.max_interval = max_interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="journal-replayer", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        wait = self.interval
+        while not self._stopped.wait(wait):
+            try:
+                self.journal.replay()
+                wait = self.interval
+            except Exception:
+                LOG.exception("Replay of %s failed" % self.journal.journal_dir)
+                wait = min(wait * 2, self.max_interval)
+
+    def stop(self, replay=True):
+        """Stop the replayer; if replay, write what is left in the journal."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        if replay:
+            self.journal.replay()
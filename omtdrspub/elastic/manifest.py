@@ -0,0 +1,125 @@
+import json
+import os
+import re
+from glob import glob
+
+import logging
+from resync import ChangeList
+from resync import ResourceList
+from resync.sitemap import Sitemap
+from rspub.core.rs_enum import Capability
+
+from omtdrspub.elastic.utils import parse_xml_without_urls
+
+LOG = logging.getLogger(__name__)
+
+MANIFEST_FILE = ".publication-manifest.json"
+
+DOCUMENT_NAME = re.compile(r"(resourcelist|changelist)_(\d+)\.xml\Z")
+
+
+class PublicationManifest(object):
+    """
+    State of the resourcelists and changelists in the metadata dir, kept in a small json file.
+
+    For every document it records ordinal, md_at, md_completed, md_from, md_until, the number of resources,
+    its size and whether it links to its index, so that executors do not have to parse previous documents to find
+    where the publication stands. It is updated every time a document is saved; if it is missing or does not
+    match the documents on disk, it is rebuilt once from their preambles.
+    """
+
+    def __init__(self, para, documents: dict=None):
+        self.para = para
+        self.path = para.abs_metadata_path(MANIFEST_FILE)
+        # file name -> entry
+        self.documents = documents if documents is not None else {}
+
+    @staticmethod
+    def load(para):
+        manifest = None
+        path = para.abs_metadata_path(MANIFEST_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as mf_file:
+                manifest = PublicationManifest(para, json.load(mf_file)['documents'])
+        if manifest is None or not manifest.is_consistent():
+            manifest = PublicationManifest(para)
+            manifest.rebuild()
+        return manifest
+
+    def is_consistent(self):
+        # only the last document of each capability and the one after it are checked,
+        # so that loading does not depend on the length of the publication history
+        for capability in (Capability.resourcelist.name, Capability.changelist.name):
+            last = self.last(capability)
+            ordinal = -1 if last is None else last['ordinal']
+            if last is not None and not os.path.exists(self.para.abs_metadata_path(last['name'])):
+                return False
+            if os.path.exists(self.para.abs_metadata_path(self.file_name(capability, ordinal + 1))):
+                return False
+        return True
+
+    def rebuild(self):
+        LOG.info("Rebuilding publication manifest: " + self.path)
+        self.documents = {}
+        for capability, sitemap_class in ((Capability.resourcelist.name, ResourceList),
+                                          (Capability.changelist.name, ChangeList)):
+            for path in glob(self.para.abs_metadata_path(capability + "_*.xml")):
+                sitemap = sitemap_class()
+                with open(path, "r", encoding="utf-8") as sm_file:
+                    parse_xml_without_urls(Sitemap(), fh=sm_file, resources=sitemap)
+                # the number of resources is unknown without parsing the <url> elements, and the document may
+                # be torn
+                self.record(path, sitemap, count=None, size=None, save=False)
+        self.save()
+
+    def file_name(self, capability, ordinal):
+        return capability + "_" + str(ordinal).zfill(self.para.zero_fill_filename) + ".xml"
+
+    def record(self, path, sitemap, count=-1, size=-1, save=True):
+        """Record a saved document; paths that are not resourcelists or changelists are ignored."""
+        name = os.path.basename(path)
+        match = DOCUMENT_NAME.match(name)
+        if match is None:
+            return
+        self.documents[name] = {
+            'name': name,
+            'capability': match.group(1),
+            'ordinal': int(match.group(2)),
+            'md_at': getattr(sitemap, 'md_at', None),
+            'md_completed': getattr(sitemap, 'md_completed', None),
+            'md_from': getattr(sitemap, 'md_from', None),
+            'md_until': getattr(sitemap, 'md_until', None),
+            'count': len(sitemap) if count == -1 else count,
+            'size': os.path.getsize(path) if size == -1 else size,
+            'index_link': sitemap.link("index") is not None
+        }
+        if save:
+            self.save()
+
+    def discard(self, path):
+        if self.documents.pop(os.path.basename(path), None) is not None:
+            self.save()
+
+    def clear(self):
+        self.documents = {}
+        self.save()
+
+    def get(self, path) -> dict:
+        return self.documents.get(os.path.basename(path))
+
+    def entries(self, capability) -> [dict]:
+        return sorted([entry for entry in self.documents.values() if entry['capability'] == capability],
+                      key=lambda entry: entry['ordinal'])
+
+    def files(self, capability) -> [str]:
+        return [self.para.abs_metadata_path(entry['name']) for entry in self.entries(capability)]
+
+    def last(self, capability) -> dict:
+        entries = self.entries(capability)
+        return entries[-1] if len(entries) > 0 else None
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as mf_file:
+            json.dump({'documents': self.documents}, mf_file)
+        os.replace(tmp_path, self.path)
@@ -3,55 +3,38 @@ from omtdrspub.elastic.model.location import Location
 
 class ChangeDoc(object):
 
+    __slots__ = ('resource_set', 'location', 'lastmod', 'change', 'datetime', 'timestamp')
+
     def __init__(self, resource_set: str=None, location: Location=None,
                  lastmod: str=None, change: str=None, datetime: str=None, timestamp: str=None):
-        self._resource_set = resource_set
-        self._location = location
-        self._lastmod = lastmod
-        self._change = change
-        self._datetime = datetime
-        self._timestamp = timestamp
-
-    @property
-    def resource_set(self):
-        return self._resource_set
-
-    @property
-    def location(self):
-        return self._location
-
-    @property
-    def lastmod(self):
-        return self._lastmod
-
-    @property
-    def change(self):
-        return self._change
+        self.resource_set = resource_set
+        self.location = location
+        self.lastmod = lastmod
+        self.change = change
+        self.datetime = datetime
+        self.timestamp = timestamp
 
-    @property
-    def datetime(self):
-        return self._datetime
-
-    @property
-    def timestamp(self):
-        return self._timestamp
+    @staticmethod
+    def from_source(dct: dict):
+        get = dct.get
+        location = get('location')
+        return ChangeDoc(get('resource_set'), Location(location['value'], location['type']),
+                         get('lastmod'), get('change'), get('datetime'), get('timestamp'))
 
     @staticmethod
     def as_change_doc(dct: dict):
-        return ChangeDoc(resource_set=dct.get('resource_set'),
-                         location=Location.as_location(dct=dct.get('location')),
-                         lastmod=dct.get('lastmod'),
-                         change=dct.get('change'),
-                         datetime=dct.get('datetime'),
-                         timestamp=dct.get('timestamp'))
+        return ChangeDoc.from_source(dct)
 
-    def to_dict(self):
+    def to_source(self):
+        location = self.location
         return {
             'resource_set': self.resource_set,
             'change': self.change,
-            'location': self.location.to_dict(),
+            'location': {'type': location.loc_type, 'value': location.value},
             'lastmod': self.lastmod,
             'datetime': self.datetime,
             'timestamp': self.timestamp
         }
 
+    def to_dict(self):
+        return self.to_source()
@@ -3,47 +3,29 @@ from omtdrspub.elastic.model.location import Location
 
 class Link(object):
 
-    def __init__(self, href: Location, rel: str, mime: str):
-        self._href = href
-        self._rel = rel
-        self._mime = mime
-
-    @property
-    def href(self):
-        return self._href
-
-    @property
-    def rel(self):
-        return self._rel
+    __slots__ = ('href', 'rel', 'mime')
 
-    @property
-    def mime(self):
-        return self._mime
-
-    @rel.setter
-    def rel(self, rel):
-        self._rel = rel
-
-    @mime.setter
-    def mime(self, mime):
-        self._mime = mime
+    def __init__(self, href: Location, rel: str, mime: str):
+        self.href = href
+        self.rel = rel
+        self.mime = mime
 
-    @href.setter
-    def href(self, href: Location):
-        self._href = href
+    @staticmethod
+    def from_source(dct):
+        href = dct['href']
+        return Link(Location(href['value'], href['type']), dct['rel'], dct['mime'])
 
     @staticmethod
     def as_link(dct):
-        return Link(href=Location.as_location(dct['href']),
-                    rel=dct['rel'],
-                    mime=dct['mime'])
+        return Link.from_source(dct)
 
-    def to_dict(self) -> dict:
+    def to_source(self) -> dict:
+        href = self.href
         return {
-            'href': self.href.to_dict(),
+            'href': {'type': href.loc_type, 'value': href.value},
             'rel': self.rel,
             'mime': self.mime
         }
 
-
-
+    def to_dict(self) -> dict:
+        return self.to_source()
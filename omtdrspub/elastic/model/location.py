@@ -1,30 +1,20 @@
 import os
-from urllib.parse import urljoin
+from functools import lru_cache
+from urllib.parse import unquote, urljoin
 
 from rspub.util import defaults
 
+# directories whose uri is kept by a LocationResolver, per location type
+DIR_CACHE_SIZE = 4096
 
-class Location(object):
-
-    def __init__(self, value: str, loc_type: str):
-        self._value = value
-        self._loc_type = loc_type
 
-    @property
-    def value(self):
-        return self._value
-
-    @property
-    def loc_type(self):
-        return self._loc_type
+class Location(object):
 
-    @value.setter
-    def value(self, value):
-        self._value = value
+    __slots__ = ('value', 'loc_type')
 
-    @loc_type.setter
-    def loc_type(self, loc_type):
-        self._loc_type = loc_type
+    def __init__(self, value: str, loc_type: str):
+        self.value = value
+        self.loc_type = loc_type
 
     def uri_from_path(self, para_url_prefix, para_res_root_dir) -> str:
         uri = None
@@ -37,12 +27,102 @@ class Location(object):
             uri = para_url_prefix + defaults.sanitize_url_path(path)
         return uri
 
+    @staticmethod
+    def from_source(dct):
+        return Location(dct['value'], dct['type'])
+
     @staticmethod
     def as_location(dct):
-        return Location(value=dct['value'], loc_type=dct['type'])
+        return Location.from_source(dct)
+
+    def to_source(self) -> dict:
+        return {'type': self.loc_type, 'value': self.value}
 
     def to_dict(self) -> dict:
-        return {
-            'type': self.loc_type,
-            'value': self.value
-        }
+        return self.to_source()
+
+
+class LocationResolver(object):
+    """
+    Resolves locations into uris, with the same results of :func:`Location.uri_from_path`.
+
+    url_prefix and res_root_dir are processed once, and the sanitized form of the cache_size most recently used
+    directories is kept, so that resolving a location mostly amounts to joining the cached directory and the
+    file name. Create one per executor.
+    """
+
+    def __init__(self, url_prefix, res_root_dir, cache_size=DIR_CACHE_SIZE):
+        self._url_prefix = url_prefix
+        self._res_root_dir = os.path.abspath(res_root_dir)
+        self._rel_dirs = lru_cache(maxsize=cache_size)(self._rel_dir_uri)
+        self._abs_dirs = lru_cache(maxsize=cache_size)(self._abs_dir_uri)
+
+    @property
+    def url_prefix(self):
+        return self._url_prefix
+
+    @property
+    def res_root_dir(self):
+        return self._res_root_dir
+
+    def uri(self, location: Location) -> str:
+        return self.resolve(location.value, location.loc_type)
+
+    def resolve(self, value: str, loc_type: str) -> str:
+        if loc_type == 'url':
+            return value
+        elif loc_type == 'rel_path':
+            return self._resolve_rel_path(value)
+        elif loc_type == 'abs_path':
+            return self._resolve_abs_path(value)
+        return None
+
+    def _resolve_rel_path(self, value):
+        head, sep, tail = value.rpartition('/')
+        if tail in ('', '.', '..') or (not sep and ':' in tail):
+            return urljoin(self._url_prefix, defaults.sanitize_url_path(value))
+        dir_uri = self._rel_dirs(head + sep)
+        if dir_uri is False:
+            return urljoin(self._url_prefix, defaults.sanitize_url_path(value))
+        return dir_uri + defaults.sanitize_url_path(tail)
+
+    def _rel_dir_uri(self, rel_dir):
+        # the sanitized directory is computed as a prefix of a placeholder file name, so that it is
+        # sanitized the same way it would be as part of the whole path
+        sanitized = defaults.sanitize_url_path(rel_dir + "x")[:-1]
+        if sanitized.startswith('/') or sanitized.startswith('.') or '/.' in sanitized or '//' in sanitized \
+                or ':' in sanitized:
+            # leading slashes, dot and empty segments and schemes are resolved by urljoin
+            return False
+        return self._url_prefix + sanitized
+
+    def _resolve_abs_path(self, value):
+        head, tail = os.path.split(value)
+        if tail in ('', '.', '..'):
+            return self._url_prefix + defaults.sanitize_url_path(os.path.relpath(value, self._res_root_dir))
+        dir_uri = self._abs_dirs(head)
+        if dir_uri is False:
+            return self._url_prefix + defaults.sanitize_url_path(os.path.relpath(value, self._res_root_dir))
+        return dir_uri + defaults.sanitize_url_path(tail)
+
+    def _abs_dir_uri(self, head):
+        rel_dir = os.path.relpath(head, self._res_root_dir)
+        if rel_dir == os.pardir or rel_dir.startswith(os.pardir + os.sep):
+            # outside res_root_dir, the file may be res_root_dir itself or one of its parents
+            return False
+        rel_dir = '' if rel_dir == os.curdir else rel_dir + os.sep
+        return self._url_prefix + defaults.sanitize_url_path(rel_dir + "x")[:-1]
+
+    def path(self, location: Location) -> str:
+        """The local file of a location, or None for url locations."""
+        if location.loc_type == 'rel_path':
+            return os.path.join(self._res_root_dir, location.value)
+        elif location.loc_type == 'abs_path':
+            return location.value
+        return None
+
+    def path_from_uri(self, uri: str) -> str:
+        """The local file a uri has been resolved from, or None if the uri is not under url_prefix."""
+        if not uri.startswith(self._url_prefix):
+            return None
+        return os.path.join(self._res_root_dir, *unquote(uri[len(self._url_prefix):]).split('/'))
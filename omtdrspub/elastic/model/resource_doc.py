@@ -3,84 +3,47 @@ from omtdrspub.elastic.model.location import Location
 
 
 class ResourceDoc(object):
+
+    __slots__ = ('resync_id', 'resource_set', 'location', 'length', 'md5', 'mime', 'lastmod', 'ln', 'timestamp')
+
     def __init__(self, resync_id=None, resource_set=None,
                  location: Location=None, length: int=None, md5: str=None,
                  mime: str=None, lastmod: str=None, ln: [Link]=None, timestamp: str=None):
-        self._resync_id = resync_id
-        self._resource_set = resource_set
-        self._location = location
-        self._length = length
-        self._md5 = md5
-        self._mime = mime
-        self._lastmod = lastmod
-        self._ln = ln if ln is not None else []
-        self._timestamp = timestamp
-
-    @property
-    def resync_id(self):
-        return self._resync_id
-
-    @property
-    def resource_set(self):
-        return self._resource_set
-
-    @property
-    def location(self):
-        return self._location
-
-    @property
-    def length(self):
-        return self._length
-
-    @property
-    def md5(self):
-        return self._md5
-
-    @property
-    def mime(self):
-        return self._mime
+        self.resync_id = resync_id
+        self.resource_set = resource_set
+        self.location = location
+        self.length = length
+        self.md5 = md5
+        self.mime = mime
+        self.lastmod = lastmod
+        self.ln = ln if ln is not None else []
+        self.timestamp = timestamp
 
-    @property
-    def lastmod(self):
-        return self._lastmod
-
-    @property
-    def ln(self):
-        return self._ln
-
-    @ln.setter
-    def ln(self, ln):
-        self._ln = ln
-
-    @property
-    def timestamp(self):
-        return self._timestamp
-
-    @location.setter
-    def location(self, location: Location):
-        self._location = location
+    @staticmethod
+    def from_source(dct):
+        location = dct['location']
+        link_from_source = Link.from_source
+        return ResourceDoc(dct['resync_id'], dct['resource_set'], Location(location['value'], location['type']),
+                           dct['length'], dct['md5'], dct['mime'], dct['lastmod'],
+                           [link_from_source(link) for link in dct['ln']], dct['timestamp'])
 
     @staticmethod
     def as_resource_doc(dct):
-        return ResourceDoc(resync_id=dct['resync_id'],
-                           resource_set=dct['resource_set'],
-                           location=Location.as_location(dct=dct['location']),
-                           length=dct['length'],
-                           md5=dct['md5'],
-                           mime=dct['mime'],
-                           lastmod=dct['lastmod'],
-                           ln=[Link.as_link(dct=link) for link in dct['ln']],
-                           timestamp=dct['timestamp'])
+        return ResourceDoc.from_source(dct)
 
-    def to_dict(self):
+    def to_source(self):
+        location = self.location
         return {
             'resync_id': self.resync_id,
             'resource_set': self.resource_set,
-            'location': self.location.to_dict(),
+            'location': {'type': location.loc_type, 'value': location.value},
             'length': self.length,
             'md5': self.md5,
             'mime': self.mime,
             'lastmod': self.lastmod,
-            'ln': [link.to_dict() for link in self.ln],
+            'ln': [link.to_source() for link in self.ln],
             'timestamp': self.timestamp
         }
+
+    def to_dict(self):
+        return self.to_source()
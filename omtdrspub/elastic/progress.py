@@ -0,0 +1,98 @@
+import threading
+import time
+
+import logging
+from rspub.core.executors import ExecutorEvent
+from rspub.util.observe import Observable
+
+LOG = logging.getLogger(__name__)
+
+
+class ProgressEvents(object):
+    """
+    Informs the observers of an executor about created resources in batches.
+
+    Instead of one :samp:`ExecutorEvent.created_resource` per resource, a single event is sent every
+    batch_size resources or every interval_ms milliseconds, whichever comes first. The event carries the
+    running count, the number of resources in the batch (batch_size) and the keyword arguments of the last
+    resource. With batch_size=1 and no interval every resource gets its own event, as before.
+
+    In background mode the observers are informed by a separate thread: if they are slower than the
+    generation, pending batches are merged instead of queued, so that generation never waits for them.
+    """
+
+    def __init__(self, observable: Observable, batch_size=1, interval_ms=None, background=False):
+        self._observable = observable
+        self._batch_size = max(1, int(batch_size or 1))
+        self._interval = interval_ms / 1000.0 if interval_ms else None
+        self._pending = 0
+        self._last_kwargs = None
+        self._last_flush = time.monotonic()
+
+        self._thread = None
+        self._condition = threading.Condition()
+        # batch waiting for the background thread and whether the thread should stop
+        self._queued = None
+        self._closed = False
+        if background:
+            self._thread = threading.Thread(target=self._run, name="progress-events", daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def from_parameters(observable: Observable, para):
+        return ProgressEvents(observable, batch_size=para.progress_batch_size,
+                              interval_ms=para.progress_interval_ms,
+                              background=para.progress_in_background)
+
+    def created_resource(self, count, **kwargs):
+        self._pending += 1
+        self._last_kwargs = kwargs
+        self._last_kwargs['count'] = count
+        if self._pending >= self._batch_size or \
+                (self._interval is not None and time.monotonic() - self._last_flush >= self._interval):
+            self.flush()
+
+    def flush(self):
+        if self._pending == 0:
+            return
+        kwargs = self._last_kwargs
+        kwargs['batch_size'] = self._pending
+        self._pending = 0
+        self._last_kwargs = None
+        self._last_flush = time.monotonic()
+        if self._thread is None:
+            self._inform(kwargs)
+        else:
+            with self._condition:
+                if self._queued is not None:
+                    # the observers are still busy with a previous batch: merge them
+                    kwargs['batch_size'] += self._queued['batch_size']
+                self._queued = kwargs
+                self._condition.notify()
+
+    def close(self):
+        """Send the last batch and, in background mode, wait for the observers to receive it."""
+        self.flush()
+        if self._thread is not None:
+            with self._condition:
+                self._closed = True
+                self._condition.notify()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._queued is None and not self._closed:
+                    self._condition.wait()
+                kwargs = self._queued
+                self._queued = None
+                if kwargs is None:
+                    return
+            try:
+                self._inform(kwargs)
+            except Exception:
+                LOG.exception("Observer failed while informing about created resources")
+
+    def _inform(self, kwargs):
+        self._observable.observers_inform(self._observable, ExecutorEvent.created_resource, **kwargs)
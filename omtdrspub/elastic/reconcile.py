@@ -0,0 +1,204 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import os
+from collections import namedtuple
+from datetime import datetime
+
+import logging
+
+from omtdrspub.elastic import utils
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.ingest import ElasticIngester, MAX_RESULT_WINDOW, delete_operations, file_digest
+from omtdrspub.elastic.model.location import Location
+
+LOG = logging.getLogger(__name__)
+
+# on disk, not in the index
+MISSING = "missing"
+# in the index, not on disk; or a second document of the same location
+EXTRA = "extra"
+# on disk and in the index, with a different length, lastmod or md5
+STALE = "stale"
+
+Discrepancy = namedtuple("Discrepancy", ["kind", "value", "path", "stat", "e_hit"])
+
+
+def sorted_files(root_dir) -> [str, os.stat_result]:
+    """
+    Yield the path and stat of every regular file under root_dir, in the order of their paths.
+
+    The entries of a directory are sorted with a trailing separator on directory names, so that a depth first
+    walk yields whole paths in order, holding only the listings of the directories it is in.
+    """
+    stack = [iter(_sorted_entries(root_dir))]
+    while len(stack) > 0:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(iter(_sorted_entries(entry.path)))
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path, entry.stat(follow_symlinks=False)
+        except OSError as err:
+            LOG.warning("Cannot stat %s: %s" % (entry.path, err))
+
+
+def _sorted_entries(directory):
+    try:
+        entries = list(os.scandir(directory))
+    except OSError as err:
+        LOG.warning("Cannot read %s: %s" % (directory, err))
+        return []
+    return sorted(entries, key=lambda e: e.name + "/" if e.is_dir(follow_symlinks=False) else e.name)
+
+
+class ElasticReconciler(object):
+    """
+    Compares the files under res_root_dir with the resource documents of the resource set, and optionally
+    fixes the index.
+
+    Both sides are streamed in the order of the location values: files with :func:`sorted_files`, documents
+    with a scroll sorted on location.value, fetching only the fields compared. The two streams are merge
+    joined, so that memory does not depend on the number of files. Only documents with locations of type
+    ingest_location_type are compared. A file is stale if its length or mtime differ from the document, or,
+    with check_md5, its md5.
+
+    Fixes go through :class:`ElasticIngester`, in bulk requests: missing and stale files are indexed, extra
+    documents deleted, with their changes.
+    """
+
+    def __init__(self, para: ElasticRsParameters, check_md5=False, query_manager: ElasticQueryManager=None):
+        self.para = para
+        self.check_md5 = check_md5
+        self.ingester = ElasticIngester(para, query_manager=query_manager)
+        self.counts = {MISSING: 0, EXTRA: 0, STALE: 0}
+
+    def sorted_documents_query(self):
+        return {
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "term": {"resource_set": self.para.resource_set}
+                        },
+                        {
+                            "nested": {
+                                "path": "location",
+                                "query": {
+                                    "term": {"location.type": self.para.ingest_location_type}
+                                }
+                            }
+                        }
+                    ]
+                }
+            },
+            "sort": [
+                {"location.value": {"order": "asc", "nested_path": "location"}}
+            ],
+            "_source": ["location", "length", "lastmod", "md5"]
+        }
+
+    def sorted_documents(self) -> [str, dict]:
+        for e_page in self.ingester.query_manager.scan_and_scroll(index=self.para.elastic_index,
+                                                                  doc_type=self.para.elastic_resource_doc_type,
+                                                                  query=self.sorted_documents_query(),
+                                                                  max_items_in_list=self.para.max_items_in_list,
+                                                                  max_result_window=MAX_RESULT_WINDOW):
+            for e_hit in e_page:
+                yield e_hit['_source']['location']['value'], e_hit
+
+    def discrepancies(self) -> [Discrepancy]:
+        location = self.ingester.location
+        disk = ((location(path).value, path, stat) for path, stat in sorted_files(self.ingester.root_dir))
+        index = self.sorted_documents()
+        d_item = next(disk, None)
+        e_item = next(index, None)
+        last_value = None
+        while d_item is not None or e_item is not None:
+            if e_item is not None and e_item[0] == last_value:
+                yield Discrepancy(EXTRA, e_item[0], None, None, e_item[1])
+                e_item = next(index, None)
+            elif e_item is None or (d_item is not None and d_item[0] < e_item[0]):
+                yield Discrepancy(MISSING, d_item[0], d_item[1], d_item[2], None)
+                d_item = next(disk, None)
+            elif d_item is None or e_item[0] < d_item[0]:
+                yield Discrepancy(EXTRA, e_item[0], None, None, e_item[1])
+                last_value = e_item[0]
+                e_item = next(index, None)
+            else:
+                if self.is_stale(d_item[1], d_item[2], e_item[1]['_source']):
+                    yield Discrepancy(STALE, d_item[0], d_item[1], d_item[2], e_item[1])
+                last_value = e_item[0]
+                d_item = next(disk, None)
+                e_item = next(index, None)
+
+    def is_stale(self, path, stat: os.stat_result, e_source: dict) -> bool:
+        if e_source.get('length') != stat.st_size or \
+                e_source.get('lastmod') != utils.formatted_date(datetime.utcfromtimestamp(stat.st_mtime)):
+            return True
+        if self.check_md5:
+            try:
+                return e_source.get('md5') != file_digest(path)[1]
+            except OSError:
+                # gone in the meantime, the next reconciliation will find it
+                return False
+        return False
+
+    def reconcile(self, fix=False, report=None) -> dict:
+        """
+        Find the discrepancies, passing each to report if given, and fix them if fix. Returns the number of
+        discrepancies per kind.
+        """
+        resource_docs = []
+        operations = []
+        for discrepancy in self.discrepancies():
+            self.counts[discrepancy.kind] += 1
+            if report is not None:
+                report(discrepancy)
+            if not fix:
+                continue
+            if discrepancy.kind == EXTRA:
+                operations.extend(delete_operations(self.para, discrepancy.e_hit['_id'],
+                                                    Location.from_source(discrepancy.e_hit['_source']['location'])))
+                self.ingester.counts['deleted'] += 1
+                if len(operations) >= 2 * self.ingester.bulk_size:
+                    self.ingester.bulk(operations)
+                    operations = []
+            else:
+                resource_doc = self.ingester.describe(discrepancy.path, discrepancy.stat)
+                if resource_doc is None:
+                    continue
+                if discrepancy.e_hit is not None:
+                    # update the document that is there, whatever its id
+                    resource_doc.resync_id = discrepancy.e_hit['_id']
+                resource_docs.append(resource_doc)
+                if len(resource_docs) >= self.ingester.bulk_size:
+                    self.ingester.write_batch(resource_docs)
+                    resource_docs = []
+        self.ingester.write_batch(resource_docs)
+        self.ingester.bulk(operations)
+        LOG.info("Reconciled %s: %s" % (self.para.resource_set, self.counts))
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the files of a resource set with its documents")
+    parser.add_argument("config", help="yaml file with the parameters of the resource set")
+    parser.add_argument("--fix", action="store_true", help="update the index to match the files")
+    parser.add_argument("--check-md5", action="store_true", help="also compare the md5 of every file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    def report(discrepancy: Discrepancy):
+        print("%s\t%s" % (discrepancy.kind, discrepancy.value))
+
+    reconciler = ElasticReconciler(ElasticRsParameters.from_yaml_params(args.config), check_md5=args.check_md5)
+    reconciler.reconcile(fix=args.fix, report=report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+from datetime import datetime
+
+import logging
+
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+
+LOG = logging.getLogger(__name__)
+
+# from <fcntl.h> and <linux/fs.h>
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+class StagedPublication(object):
+    """
+    Generates the documents of a publication in a staging dir and swaps them into place when complete, so that
+    harvesters always see a complete publication.
+
+    The staging dir is <metadata dir name>.staging, next to the metadata dir: staged and published versions stay on
+    the file system of the metadata dir. While staging, :func:`ElasticRsParameters.abs_metadata_dir` points to it
+    and uris are still computed from the live metadata dir. Files of the live publication that are not sitemaps
+    (e.g. dump packages) are carried over as hard links, hidden state files (the manifest, locks) are copied.
+
+    Once published, the staging dir is renamed to a versioned dir, and the metadata dir is a symbolic link to it,
+    replaced atomically at every publication. The first time, the metadata dir is still a real directory: it is
+    exchanged with the link in a single renameat2 call, which needs Linux 3.15 and glibc 2.28. Elsewhere the
+    metadata dir has to be turned into a link once by hand, see :func:`migrate`.
+    """
+
+    def __init__(self, para: ElasticRsParameters):
+        self.para = para
+        self.live_dir = para.abs_live_metadata_dir()
+        self.name = os.path.basename(self.live_dir)
+        self.root = os.path.dirname(self.live_dir)
+        self.staging_dir = os.path.join(self.root, self.name + ".staging")
+
+    def begin(self, keep: iter=()):
+        """
+        Start generating in the staging dir. If it already holds one of the keep files (e.g. the checkpoint of
+        an interrupted run), it is left as it is, otherwise it is created from scratch.
+        """
+        if not any(os.path.exists(os.path.join(self.staging_dir, name)) for name in keep):
+            if os.path.exists(self.staging_dir):
+                shutil.rmtree(self.staging_dir)
+            os.makedirs(self.staging_dir)
+            self.carry_over()
+        self.para.staging_dir = self.staging_dir
+        LOG.info("Staging publication in " + self.staging_dir)
+
+    def carry_over(self):
+        if not os.path.isdir(self.live_dir):
+            return
+        for name in os.listdir(self.live_dir):
+            src = os.path.join(self.live_dir, name)
+            dst = os.path.join(self.staging_dir, name)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, copy_function=link_or_copy)
+            elif not name.endswith(".xml"):
+                link_or_copy(src, dst)
+
+    def new_version_dir(self) -> str:
+        return os.path.join(self.root, self.name + "." + datetime.utcnow().strftime("%Y%m%dT%H%M%S%f"))
+
+    def link(self, version_dir) -> str:
+        """A new symbolic link to version_dir, next to the metadata dir."""
+        tmp_link = self.live_dir + ".link.tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.relpath(version_dir, self.root), tmp_link)
+        return tmp_link
+
+    def publish(self):
+        """Swap the staging dir into place."""
+        self.para.staging_dir = None
+        version_dir = self.new_version_dir()
+        os.rename(self.staging_dir, version_dir)
+        tmp_link = self.link(version_dir)
+
+        if os.path.isdir(self.live_dir) and not os.path.islink(self.live_dir):
+            # first staged publication: the metadata dir becomes a link to the published version
+            if not exchange(tmp_link, self.live_dir):
+                os.remove(tmp_link)
+                # left for a later run
+                os.rename(version_dir, self.staging_dir)
+                raise RuntimeError("Cannot replace %s with a link atomically on this system, turn it into a link "
+                                   "once with StagedPublication.migrate()" % self.live_dir)
+            # the former metadata dir now has the name of the link
+            shutil.rmtree(tmp_link)
+            previous_dir = None
+        else:
+            previous_dir = os.path.realpath(self.live_dir) if os.path.islink(self.live_dir) else None
+            os.replace(tmp_link, self.live_dir)
+        LOG.info("Published " + version_dir)
+
+        if previous_dir is not None and os.path.isdir(previous_dir):
+            shutil.rmtree(previous_dir)
+
+    def migrate(self):
+        """
+        Turn the metadata dir into a link to a versioned dir holding its files, if it is a real directory.
+
+        A one-time step for systems without renameat2, to be run while the metadata dir is not served: between
+        the rename of the directory and the creation of the link, the metadata dir does not exist.
+        """
+        if os.path.islink(self.live_dir) or not os.path.isdir(self.live_dir):
+            return
+        version_dir = self.new_version_dir()
+        tmp_link = self.link(version_dir)
+        os.rename(self.live_dir, version_dir)
+        os.replace(tmp_link, self.live_dir)
+        LOG.info("Migrated %s to a link to %s" % (self.live_dir, version_dir))
+
+    def abort(self):
+        """Stop generating in the staging dir, which is left for a later run."""
+        self.para.staging_dir = None
+
+
+def exchange(path1, path2) -> bool:
+    """Atomically exchange the files at path1 and path2; returns False if the system cannot."""
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    if not hasattr(libc, "renameat2"):
+        return False
+    if libc.renameat2(AT_FDCWD, os.fsencode(path1), AT_FDCWD, os.fsencode(path2), RENAME_EXCHANGE) != 0:
+        err = ctypes.get_errno()
+        if err in (errno.ENOSYS, errno.EINVAL):
+            # not supported by the kernel or the file system
+            return False
+        raise OSError(err, os.strerror(err), path2)
+    return True
+
+
+def link_or_copy(src, dst):
+    if os.path.basename(src).startswith("."):
+        # state files are rewritten in place, the published version must keep its own
+        shutil.copy2(src, dst)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. a file system without hard links
+        shutil.copy2(src, dst)
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+
+import logging
+
+LOG = logging.getLogger(__name__)
+
+
+class StatCache(object):
+    """
+    The md5 of the files of a resource set, as last computed by the ingester, kept in an sqlite file.
+
+    A cached md5 is only used while the size, mtime_ns and inode of the file are the ones it was computed
+    with. Every entry written or confirmed by an ingestion is tagged with the ordinal of that run: once a run
+    has seen all the files, :func:`close` drops the entries of files it has not seen.
+    Use a cache from a single thread.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, "
+                                "mtime_ns INTEGER, inode INTEGER, md5 TEXT, run INTEGER)")
+        last_run = self.connection.execute("SELECT MAX(run) FROM files").fetchone()[0]
+        self.run = (last_run or 0) + 1
+
+    @staticmethod
+    def for_resource_set(cache_dir, resource_set):
+        os.makedirs(cache_dir, exist_ok=True)
+        return StatCache(os.path.join(cache_dir, resource_set + ".stat-cache.sqlite"))
+
+    def get(self, path, stat: os.stat_result) -> str:
+        """The md5 of the file at path, or None if the file is not cached or has changed since."""
+        row = self.connection.execute("SELECT size, mtime_ns, inode, md5 FROM files WHERE path = ?",
+                                      (path,)).fetchone()
+        if row is None or row[:3] != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return None
+        return row[3]
+
+    def put(self, path, stat: os.stat_result, md5):
+        self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, md5, self.run))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self, complete=True):
+        """Save the cache; if complete, the run has seen every file, forget the ones it has not seen."""
+        if complete:
+            removed = self.connection.execute("DELETE FROM files WHERE run < ?", (self.run,)).rowcount
+            LOG.debug("Removed %d files from %s" % (removed, self.path))
+        self.connection.commit()
+        self.connection.close()
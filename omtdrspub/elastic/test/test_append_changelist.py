@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from resync import ChangeList
+from resync import Resource
+
+from omtdrspub.elastic.append_changelist import AppendChangeList
+
+
+def change(i):
+    return Resource(uri="http://example.com/file%d.txt" % i, change="updated", lastmod="2017-02-03T12:25:00Z",
+                    md_datetime="2017-02-03T12:26:00Z")
+
+
+class TestAppendChangeList(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def new_changelist(self, pretty_xml, n):
+        changelist = ChangeList()
+        changelist.md_from = "2017-02-03T12:25:00Z"
+        changelist.pretty_xml = pretty_xml
+        changelist.link_set(rel="up", href="http://example.com/capabilitylist.xml")
+        for i in range(n):
+            changelist.add(change(i))
+        return changelist
+
+    def assert_same_as_resync(self, pretty_xml, add_index):
+        path = os.path.join(self.tmp_dir, "changelist_0000.xml")
+        self.new_changelist(pretty_xml, 3).write(path)
+
+        appended = AppendChangeList(path, 3)
+        expected = self.new_changelist(pretty_xml, 3)
+        for changelist in (appended, expected):
+            if add_index:
+                changelist.link_set(rel="index", href="http://example.com/changelist-index.xml")
+            for i in range(3, 5):
+                changelist.add(change(i))
+        self.assertEqual(len(appended), 5)
+        appended.write_appended(path, pretty_xml=pretty_xml)
+
+        expected_path = os.path.join(self.tmp_dir, "expected.xml")
+        expected.write(expected_path)
+        with open(path, "rb") as actual_file, open(expected_path, "rb") as expected_file:
+            self.assertEqual(actual_file.read(), expected_file.read())
+
+    def test_append(self):
+        self.assert_same_as_resync(pretty_xml=False, add_index=False)
+        self.assert_same_as_resync(pretty_xml=True, add_index=False)
+
+    def test_append_with_new_preamble(self):
+        self.assert_same_as_resync(pretty_xml=False, add_index=True)
+        self.assert_same_as_resync(pretty_xml=True, add_index=True)
+
+    def assert_recovered(self, pretty_xml, record_size):
+        path = os.path.join(self.tmp_dir, "changelist_0000.xml")
+        self.new_changelist(pretty_xml, 3).write(path)
+        size = os.path.getsize(path)
+
+        # a crash in the middle of an append: one change written, the next one cut short, no closing tag
+        interrupted = AppendChangeList(path, 3, size=size)
+        interrupted.add(change(3))
+        interrupted.add(change(4))
+        interrupted.write_appended(path, pretty_xml=pretty_xml)
+        with open(path, "rb+") as cl_file:
+            cl_file.truncate(os.path.getsize(path) - 60)
+
+        # the manifest still has the changelist as it was before the append, unless it did not record its size
+        appended = AppendChangeList(path, 3, size=size if record_size else None)
+        expected = self.new_changelist(pretty_xml, 3)
+        if not record_size:
+            # the change complete before the crash is kept
+            expected.add(change(3))
+        for changelist in (appended, expected):
+            for i in range(5, 7):
+                changelist.add(change(i))
+        appended.write_appended(path, pretty_xml=pretty_xml)
+        self.assertEqual(appended.size, os.path.getsize(path))
+
+        expected_path = os.path.join(self.tmp_dir, "expected.xml")
+        expected.write(expected_path)
+        with open(path, "rb") as actual_file, open(expected_path, "rb") as expected_file:
+            self.assertEqual(actual_file.read(), expected_file.read())
+
+    def test_interrupted_append(self):
+        for pretty_xml in (False, True):
+            self.assert_recovered(pretty_xml=pretty_xml, record_size=True)
+            self.assert_recovered(pretty_xml=pretty_xml, record_size=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import threading
+import unittest
+from unittest import mock
+
+from omtdrspub.elastic.elastic_generator import ElasticBatchGenerator, ElasticGenerator
+
+
+class Config(object):
+
+    def __init__(self, resource_set):
+        self.resource_set = resource_set
+
+
+class TestElasticBatchGenerator(unittest.TestCase):
+
+    def test_failures_are_isolated(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def generate_resourcelist(generator):
+            # all sets are generated at the same time
+            barrier.wait()
+            if generator.config.resource_set == "set2":
+                raise ValueError("index not found")
+            return [generator.config.resource_set]
+
+        with mock.patch.object(ElasticGenerator, "generate_resourcelist", generate_resourcelist):
+            results = ElasticBatchGenerator([Config("set1"), Config("set2"), Config("set3")],
+                                            max_workers=3).generate_resourcelist()
+
+        self.assertEqual(sorted(results), ["set1", "set2", "set3"])
+        self.assertEqual(results["set1"].sitemaps, ["set1"])
+        self.assertFalse(results["set3"].failed)
+        self.assertTrue(results["set2"].failed)
+        self.assertIsInstance(results["set2"].error, ValueError)
+        self.assertIn("index not found", results["set2"].trace)
+
+    def test_duplicate_sets(self):
+        with self.assertRaises(ValueError):
+            ElasticBatchGenerator([Config("set1"), Config("set1")])
+
+
+if __name__ == '__main__':
+    unittest.main()
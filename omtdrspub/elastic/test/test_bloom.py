@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+
+from omtdrspub.elastic.bloom import BloomFilter
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager
+from omtdrspub.elastic.model.location import Location
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_filter(self):
+        bloom_filter = BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom_filter.add("file%d" % i)
+        self.assertTrue(all("file%d" % i in bloom_filter for i in range(1000)))
+        false_positives = sum(1 for i in range(1000, 11000) if "file%d" % i in bloom_filter)
+        self.assertLess(false_positives, 300)
+
+    def test_save(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        bloom_filter = BloomFilter(100)
+        bloom_filter.add("file1")
+        path = os.path.join(tmp_dir, "filters", "set.bloom")
+        bloom_filter.save(path, saved_at="2017-01-01T00:00:00Z")
+
+        loaded, metadata = BloomFilter.load(path)
+        self.assertEqual(metadata, {'saved_at': "2017-01-01T00:00:00Z"})
+        self.assertEqual((loaded.num_bits, loaded.num_hashes, loaded.count), (bloom_filter.num_bits,
+                                                                              bloom_filter.num_hashes, 1))
+        self.assertIn("file1", loaded)
+        self.assertNotIn("file2", loaded)
+
+    def test_count(self):
+        bloom_filter = BloomFilter(100)
+        self.assertTrue(bloom_filter.add("file1"))
+        self.assertFalse(bloom_filter.add("file1"))
+        self.assertEqual(bloom_filter.count, 1)
+
+    def test_count_over_capacity(self):
+        bloom_filter = BloomFilter(1000, error_rate=0.01)
+        for i in range(5000):
+            bloom_filter.add("file%d" % i)
+        # most strings added to an overfull filter set no new bit, the estimate still sees them
+        self.assertGreater(bloom_filter.count, 4000)
+        self.assertGreater(bloom_filter.count, bloom_filter.capacity)
+
+
+class Para(object):
+    resource_set = "elsevier-meta"
+    elastic_index = "test-resourcesync"
+    elastic_resource_doc_type = "resource"
+    elastic_change_doc_type = "change"
+    max_items_in_list = 50000
+    location_filter_capacity = 1000
+    location_filter_refresh = 10
+
+    def __init__(self, path):
+        self.path = path
+
+    def abs_location_filter_path(self):
+        return self.path
+
+
+class FakeElasticsearch(object):
+
+    def __init__(self, values):
+        self.values = values
+        self.searches = []
+
+    def count(self, index, doc_type, body):
+        return {'count': len(self.values)}
+
+    def search(self, **kwargs):
+        self.searches.append(kwargs['body'])
+        hits = [{'_id': value, '_source': {'location': {'type': "rel_path", 'value': value}}}
+                for value in self.values] if 'scroll' in kwargs else []
+        return {'_scroll_id': "1", 'hits': {'hits': hits}}
+
+    def scroll(self, scroll_id, scroll):
+        return {'_scroll_id': "1", 'hits': {'hits': []}}
+
+    def index(self, **kwargs):
+        return {'created': True}
+
+
+class TestLocationFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.para = Para(os.path.join(self.tmp_dir, "elsevier-meta.bloom"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        ElasticQueryManager._location_filters.clear()
+
+    def query_manager(self, values):
+        query_manager = ElasticQueryManager("localhost", 9200)
+        query_manager._instance = FakeElasticsearch(values)
+        return query_manager
+
+    def exists(self, query_manager, value):
+        return query_manager.resource_exists(self.para.elastic_index, self.para.elastic_resource_doc_type,
+                                             self.para.resource_set, Location(value, "rel_path"))
+
+    def test_resource_exists(self):
+        query_manager = self.query_manager(["file1.txt", "file2.txt"])
+        query_manager.use_location_filter(self.para)
+        self.assertEqual(query_manager._instance.searches[-1]["_source"], ["location"])
+        searches = len(query_manager._instance.searches)
+
+        # not in the filter: Elasticsearch is not queried
+        self.assertFalse(self.exists(query_manager, "file3.txt"))
+        self.assertEqual(len(query_manager._instance.searches), searches)
+        self.exists(query_manager, "file1.txt")
+        self.assertEqual(len(query_manager._instance.searches), searches + 1)
+
+        query_manager.create_or_update_resource(self.para, "3", Location("file3.txt", "rel_path"), length=1,
+                                                md5="md5", mime="text/plain", lastmod="2017-01-01T00:00:00Z",
+                                                record_change=False)
+        self.exists(query_manager, "file3.txt")
+        self.assertEqual(len(query_manager._instance.searches), searches + 2)
+
+    def test_refresh(self):
+        query_manager = self.query_manager(["file1.txt"])
+        query_manager.use_location_filter(self.para)
+        # indexed by another process
+        query_manager._instance.values.append("file2.txt")
+        searches = len(query_manager._instance.searches)
+        self.assertFalse(self.exists(query_manager, "file2.txt"))
+        self.assertEqual(len(query_manager._instance.searches), searches)
+
+        location_filter = next(iter(ElasticQueryManager._location_filters.values()))
+        location_filter.refreshed_at -= timedelta(seconds=10)
+        self.exists(query_manager, "file2.txt")
+        # caught up with the documents indexed since the last refresh, then asked Elasticsearch
+        refresh, search = query_manager._instance.searches[searches:]
+        self.assertIn("range", refresh["query"]["bool"]["must"][-1])
+        self.assertIn("nested", search["query"]["bool"]["must"][-1])
+
+    def test_saved_filter(self):
+        query_manager = self.query_manager(["file1.txt"])
+        query_manager.use_location_filter(self.para)
+        query_manager.save_location_filters()
+        ElasticQueryManager._location_filters.clear()
+
+        query_manager = self.query_manager([])
+        bloom_filter = query_manager.use_location_filter(self.para)
+        self.assertIn("rel_path\0file1.txt", bloom_filter)
+        # only the documents indexed since the filter was saved are scrolled
+        self.assertIn("range", query_manager._instance.searches[-1]["query"]["bool"]["must"][-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
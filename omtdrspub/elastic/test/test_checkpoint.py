@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import unittest
+from glob import glob
+
+from rspub.core.executors import SitemapData
+
+from omtdrspub.elastic.checkpoint import CHECKPOINT_FILE, ResourceListCheckpoint
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_resourcelist import ElasticResourceListExecutor
+from omtdrspub.elastic.verify import sitemap_resources
+
+
+class TestResourceListCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, CHECKPOINT_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resume(self):
+        self.assertIsNone(ResourceListCheckpoint.load(self.path))
+
+        checkpoint = ResourceListCheckpoint(self.path, date_start_processing="2017-02-03T12:25:00Z",
+                                            index_url="http://example.com/resourcelist-index.xml")
+        checkpoint.changes_erased = True
+        sitemap_data = SitemapData()
+        sitemap_data.resource_count = 2
+        sitemap_data.ordinal = 0
+        sitemap_data.uri = "http://example.com/resourcelist_0000.xml"
+        sitemap_data.path = os.path.join(self.tmp_dir, "resourcelist_0000.xml")
+        sitemap_data.capability_name = "resourcelist"
+        checkpoint.finished_file(sitemap_data, cursor="AVoQ")
+
+        resumed = ResourceListCheckpoint.load(self.path)
+        self.assertEqual(resumed.date_start_processing, "2017-02-03T12:25:00Z")
+        self.assertEqual(resumed.index_url, "http://example.com/resourcelist-index.xml")
+        self.assertTrue(resumed.changes_erased)
+        self.assertEqual(resumed.cursor, "AVoQ")
+        self.assertEqual(resumed.count, 2)
+        self.assertEqual(resumed.finished_paths(), {sitemap_data.path})
+        self.assertEqual(resumed.sitemap_data()[0].uri, sitemap_data.uri)
+
+        resumed.remove()
+        self.assertFalse(os.path.exists(self.path))
+
+
+class Interrupted(Exception):
+    pass
+
+
+class ScrollQueryManager(object):
+    """Scrolls resource documents in _uid order; fails after fail_after hits if set."""
+
+    def __init__(self, values, fail_after=None):
+        self.values = values
+        self.fail_after = fail_after
+        self.erased = 0
+
+    def refresh_index(self, index):
+        pass
+
+    def count_documents(self, index, doc_type, query):
+        return len(self.values)
+
+    def delete_all_index_set_type_docs(self, index, doc_type, resource_set):
+        self.erased += 1
+
+    def scan_and_scroll(self, index, doc_type, query, max_items_in_list, max_result_window):
+        hits = []
+        for i, value in enumerate(self.values):
+            if i == self.fail_after:
+                break
+            hits.append({'_id': "%04d" % i,
+                         '_source': {'resync_id': "%04d" % i, 'resource_set': "elsevier-meta",
+                                     'location': {'type': "rel_path", 'value': value}, 'length': 1,
+                                     'md5': "md5", 'mime': "text/plain", 'lastmod': "2017-02-03T12:25:00Z",
+                                     'ln': [], 'timestamp': None}})
+        yield hits
+        if self.fail_after is not None:
+            raise Interrupted()
+
+
+class TestResumableResourceList(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.values = ["file%d.txt" % i for i in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def execute(self, query_manager, resumable=True):
+        para = ElasticRsParameters(resource_set="elsevier-meta", res_root_dir=self.tmp_dir,
+                                   resource_dir=self.tmp_dir, metadata_dir="metadata",
+                                   description_dir=self.tmp_dir, url_prefix="http://example.com/",
+                                   elastic_host="localhost", elastic_port=9200, elastic_index="test-resourcesync",
+                                   elastic_resource_doc_type="resource", elastic_change_doc_type="change",
+                                   max_items_in_list=2, resumable=resumable)
+        executor = ElasticResourceListExecutor(para)
+        executor.query_manager = query_manager
+        executor.execute()
+        return para
+
+    def interrupt(self):
+        # the first resourcelist is finished, the second one is not
+        with self.assertRaises(Interrupted):
+            self.execute(ScrollQueryManager(self.values, fail_after=3))
+        metadata_dir = os.path.join(self.tmp_dir, "metadata")
+        self.assertTrue(os.path.exists(os.path.join(metadata_dir, CHECKPOINT_FILE)))
+        return metadata_dir
+
+    @staticmethod
+    def uris(path):
+        return [uri for uri, md5, length in sitemap_resources(path)]
+
+    def test_resume(self):
+        metadata_dir = self.interrupt()
+        with open(os.path.join(metadata_dir, "resourcelist_0000.xml"), "rb") as rl_file:
+            first = rl_file.read()
+        # written after the checkpoint by the interrupted run
+        with open(os.path.join(metadata_dir, "resourcelist_0001.xml"), "w") as rl_file:
+            rl_file.write("unfinished")
+
+        query_manager = ScrollQueryManager(self.values)
+        self.execute(query_manager)
+        self.assertFalse(os.path.exists(os.path.join(metadata_dir, CHECKPOINT_FILE)))
+        # changes were erased by the interrupted run
+        self.assertEqual(query_manager.erased, 0)
+        with open(os.path.join(metadata_dir, "resourcelist_0000.xml"), "rb") as rl_file:
+            self.assertEqual(rl_file.read(), first)
+        paths = sorted(glob(os.path.join(metadata_dir, "resourcelist_*.xml")))
+        self.assertEqual([os.path.basename(path) for path in paths],
+                         ["resourcelist_0000.xml", "resourcelist_0001.xml", "resourcelist_0002.xml"])
+        self.assertEqual([uri for path in paths for uri in self.uris(path)],
+                         ["http://example.com/" + value for value in self.values])
+
+    def test_fresh_run_removes_checkpoint(self):
+        metadata_dir = self.interrupt()
+        self.execute(ScrollQueryManager(self.values), resumable=False)
+        self.assertFalse(os.path.exists(os.path.join(metadata_dir, CHECKPOINT_FILE)))
+
+    def test_stale_checkpoint(self):
+        metadata_dir = self.interrupt()
+        checkpoint = ResourceListCheckpoint.load(os.path.join(metadata_dir, CHECKPOINT_FILE))
+        # the finished resourcelist is not the one the manifest records
+        checkpoint.files[0]['doc_end'] = "2000-01-01T00:00:00Z"
+        checkpoint.save()
+
+        query_manager = ScrollQueryManager(self.values)
+        self.execute(query_manager)
+        # started over
+        self.assertEqual(query_manager.erased, 1)
+        paths = sorted(glob(os.path.join(metadata_dir, "resourcelist_*.xml")))
+        self.assertEqual([uri for path in paths for uri in self.uris(path)],
+                         ["http://example.com/" + value for value in self.values])
+
+
+if __name__ == '__main__':
+    unittest.main()
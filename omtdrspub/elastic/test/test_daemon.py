@@ -0,0 +1,132 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from omtdrspub.elastic import daemon
+from omtdrspub.elastic.daemon import ElasticDaemon, PublicationSet
+
+
+class Para(object):
+
+    def __init__(self, resource_set, metadata_dir):
+        self.resource_set = resource_set
+        self.metadata_dir = metadata_dir
+
+    def abs_metadata_path(self, name):
+        return os.path.join(self.metadata_dir, name)
+
+
+class RecordingExecutor(object):
+    runs = []
+    done = threading.Semaphore(0)
+
+    def __init__(self, para):
+        self.para = para
+
+    def execute(self):
+        RecordingExecutor.runs.append((self.__class__.__name__, self.para.resource_set))
+        RecordingExecutor.done.release()
+
+
+class ResourceListExecutor(RecordingExecutor):
+    pass
+
+
+class ChangeListExecutor(RecordingExecutor):
+    pass
+
+
+class FailingExecutor(RecordingExecutor):
+
+    def execute(self):
+        RecordingExecutor.done.release()
+        raise ValueError("index not found")
+
+
+class TestElasticDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        RecordingExecutor.runs = []
+        RecordingExecutor.done = threading.Semaphore(0)
+        patcher = mock.patch.dict(daemon.EXECUTORS, {"resourcelist": ResourceListExecutor,
+                                                     "inc_changelist": ChangeListExecutor,
+                                                     "new_changelist": FailingExecutor})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def publication_set(self, name, published=True, schedules=None):
+        metadata_dir = os.path.join(self.tmp_dir, name)
+        os.makedirs(metadata_dir)
+        if published:
+            open(os.path.join(metadata_dir, "resourcelist_0000.xml"), "w").close()
+        return PublicationSet(Para(name, metadata_dir), schedules=schedules)
+
+    def test_run_job(self):
+        elastic_daemon = ElasticDaemon([self.publication_set("set1"), self.publication_set("set2", published=False),
+                                        self.publication_set("set3")])
+        elastic_daemon.run_job("set1", "inc_changelist")
+        # a set without resourcelists starts with one
+        elastic_daemon.run_job("set2", "inc_changelist")
+        elastic_daemon.run_job("set3", "new_changelist")
+        self.assertEqual(RecordingExecutor.runs, [("ChangeListExecutor", "set1"), ("ResourceListExecutor", "set2")])
+
+        status = elastic_daemon.status()
+        self.assertIsNone(status["set1"]["runs"]["inc_changelist"]["error"])
+        self.assertIn("index not found", status["set3"]["runs"]["new_changelist"]["error"])
+
+    def test_change_trigger(self):
+        trigger = mock.Mock()
+        trigger.is_due.return_value = False
+        publication_set = self.publication_set("set1")
+        publication_set.trigger = trigger
+        elastic_daemon = ElasticDaemon([publication_set])
+        elastic_daemon._run_scheduled("set1", daemon.TRIGGER_JOB)
+        trigger.is_due.return_value = True
+        elastic_daemon._run_scheduled("set1", daemon.TRIGGER_JOB)
+        self.assertEqual(RecordingExecutor.runs, [("ChangeListExecutor", "set1")])
+
+        # the trigger is not checked while another job of the set holds its parameters
+        trigger.is_due.reset_mock()
+        with publication_set.lock:
+            elastic_daemon._run_scheduled("set1", daemon.TRIGGER_JOB)
+        trigger.is_due.assert_not_called()
+        self.assertEqual(len(RecordingExecutor.runs), 1)
+
+    def test_schedule_and_control(self):
+        elastic_daemon = ElasticDaemon([self.publication_set("set1", schedules={"inc_changelist": 3600})],
+                                       control_port=0)
+        thread = threading.Thread(target=elastic_daemon.serve_forever)
+        thread.start()
+        try:
+            self.assertTrue(elastic_daemon.ready.wait(5))
+            # scheduled jobs run as soon as the daemon starts
+            self.assertTrue(RecordingExecutor.done.acquire(timeout=5))
+            with socket.create_connection(elastic_daemon._control_server.server_address[:2], timeout=5) as conn:
+                control = conn.makefile("rwb")
+                control.write(b"run set1 resourcelist\n")
+                control.flush()
+                self.assertIn(b"queued", control.readline())
+                self.assertTrue(RecordingExecutor.done.acquire(timeout=5))
+                control.write(b"run set9 resourcelist\n")
+                control.flush()
+                self.assertIn(b"Unknown resource set", control.readline())
+                control.write(b"stop\n")
+                control.flush()
+                self.assertIn(b"stopping", control.readline())
+        finally:
+            elastic_daemon.stop()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(RecordingExecutor.runs, [("ChangeListExecutor", "set1"), ("ResourceListExecutor", "set1")])
+
+
+if __name__ == '__main__':
+    unittest.main()
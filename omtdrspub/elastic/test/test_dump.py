@@ -0,0 +1,238 @@
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from resync import Resource
+from resync.change_dump_manifest import ChangeDumpManifest
+from resync.resource_dump_manifest import ResourceDumpManifest
+
+from omtdrspub.elastic.dump import MANIFEST_NAME, PackageWriter
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_changedump import ElasticNewChangeDumpExecutor
+from omtdrspub.elastic.exe_elastic_resourcedump import ElasticResourceDumpExecutor
+from omtdrspub.elastic.test.test_checkpoint import ScrollQueryManager
+from omtdrspub.elastic.verify import sitemap_resources
+
+
+class FailingPackageWriter(PackageWriter):
+    """Fails to read the files named fail_name after their first chunk."""
+
+    fail_name = "broken.txt"
+
+    def read_files(self, batch, chunks, stop):
+        for resource, file_path in batch:
+            if file_path is None:
+                continue
+            if os.path.basename(file_path) == self.fail_name:
+                chunks.put(b"partial")
+                chunks.put(OSError(errno.EIO, "Input/output error", file_path))
+                continue
+            super(FailingPackageWriter, self).read_files([(resource, file_path)], chunks, stop)
+
+
+class TestPackageWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.res_root_dir = os.path.join(self.tmp_dir, "resources")
+        self.package_dir = os.path.join(self.tmp_dir, "packages")
+        os.makedirs(os.path.join(self.res_root_dir, "sub"))
+        os.makedirs(self.package_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def package_location(self, ordinal):
+        name = "part_%d.zip" % ordinal
+        return os.path.join(self.package_dir, name), "http://example.com/" + name
+
+    def entry(self, name, content):
+        path = os.path.join(self.res_root_dir, name)
+        with open(path, "wb") as file:
+            file.write(content)
+        return Resource(uri="http://example.com/" + name, length=len(content)), path
+
+    def test_packages(self):
+        entries = [self.entry("file1.txt", b"a" * 6), self.entry("sub/file2.txt", b"b" * 6),
+                   self.entry("file3.txt", b"c" * 6)]
+        entries.append((Resource(uri="http://example.com/missing.txt", length=1),
+                        os.path.join(self.res_root_dir, "missing.txt")))
+        writer = PackageWriter(ResourceDumpManifest, self.package_location, self.res_root_dir,
+                               max_size=12, max_items=10, workers=2)
+        packages = list(writer.packages(iter(entries)))
+
+        self.assertEqual([p.uri for p in packages], ["http://example.com/part_0.zip",
+                                                     "http://example.com/part_1.zip"])
+        self.assertEqual(packages[0].mime_type, "application/zip")
+        self.assertEqual(packages[0].length, os.path.getsize(os.path.join(self.package_dir, "part_0.zip")))
+
+        with zipfile.ZipFile(os.path.join(self.package_dir, "part_0.zip")) as package:
+            self.assertEqual(sorted(package.namelist()),
+                             [MANIFEST_NAME, "resources/file1.txt", "resources/sub/file2.txt"])
+            self.assertEqual(package.read("resources/sub/file2.txt"), b"b" * 6)
+            manifest = package.read(MANIFEST_NAME).decode("utf-8")
+        self.assertIn('path="/resources/sub/file2.txt"', manifest)
+
+        with zipfile.ZipFile(os.path.join(self.package_dir, "part_1.zip")) as package:
+            # the missing file is left out of the package and of its manifest
+            self.assertEqual(sorted(package.namelist()), [MANIFEST_NAME, "resources/file3.txt"])
+            self.assertNotIn("missing.txt", package.read(MANIFEST_NAME).decode("utf-8"))
+        self.assertEqual(sorted(os.listdir(self.package_dir)), ["part_0.zip", "part_1.zip"])
+
+    def test_changedump_package(self):
+        created, created_path = self.entry("file1.txt", b"a" * 6)
+        created.change = "created"
+        deleted = Resource(uri="http://example.com/file2.txt", change="deleted")
+        md = {'md_from': "2017-01-01T00:00:00Z", 'md_until': "2017-01-02T00:00:00Z"}
+        writer = PackageWriter(ChangeDumpManifest, self.package_location, self.res_root_dir,
+                               max_size=100, max_items=10, workers=1, md=md)
+        packages = list(writer.packages(iter([(created, created_path), (deleted, None)])))
+
+        self.assertEqual(len(packages), 1)
+        self.assertEqual(packages[0].md_from, md['md_from'])
+        self.assertEqual(packages[0].md_until, md['md_until'])
+        with zipfile.ZipFile(os.path.join(self.package_dir, "part_0.zip")) as package:
+            # deleted resources are listed in the manifest, without bytes
+            self.assertEqual(sorted(package.namelist()), [MANIFEST_NAME, "resources/file1.txt"])
+            manifest = package.read(MANIFEST_NAME).decode("utf-8")
+        self.assertIn("http://example.com/file2.txt", manifest)
+
+    def test_unreadable_files(self):
+        entries = [self.entry("file1.txt", b"a" * 6), self.entry("broken.txt", b"b" * 6),
+                   self.entry("file3.txt", b"c" * 6)]
+        # a directory where a file was expected
+        entries.append((Resource(uri="http://example.com/sub", length=1), os.path.join(self.res_root_dir, "sub")))
+        writer = FailingPackageWriter(ResourceDumpManifest, self.package_location, self.res_root_dir,
+                                      max_size=100, max_items=10, workers=1)
+        packages = list(writer.packages(iter(entries)))
+
+        self.assertEqual(len(packages), 1)
+        with zipfile.ZipFile(os.path.join(self.package_dir, "part_0.zip")) as package:
+            # the file that failed partway is not left truncated in the package
+            self.assertEqual(sorted(package.namelist()),
+                             [MANIFEST_NAME, "resources/file1.txt", "resources/file3.txt"])
+            self.assertEqual(package.read("resources/file3.txt"), b"c" * 6)
+            manifest = package.read(MANIFEST_NAME).decode("utf-8")
+        self.assertNotIn("broken.txt", manifest)
+        self.assertNotIn("http://example.com/sub", manifest)
+        self.assertEqual(sorted(os.listdir(self.package_dir)), ["part_0.zip"])
+
+    def test_failed_package(self):
+        class FailingManifest(ResourceDumpManifest):
+            def as_xml(self, **kwargs):
+                raise RuntimeError("cannot write the manifest")
+
+        writer = PackageWriter(FailingManifest, self.package_location, self.res_root_dir,
+                               max_size=100, max_items=10, workers=1)
+        with self.assertRaises(RuntimeError):
+            list(writer.packages(iter([self.entry("file1.txt", b"a" * 6)])))
+        self.assertEqual(os.listdir(self.package_dir), [])
+
+
+class TestResourceDump(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.metadata_dir = os.path.join(self.tmp_dir, "metadata")
+        self.values = ["file%d.txt" % i for i in range(3)]
+        for value in self.values:
+            with open(os.path.join(self.tmp_dir, value), "w") as file:
+                file.write(value)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def execute(self, executor_class=ElasticResourceDumpExecutor):
+        para = ElasticRsParameters(resource_set="elsevier-meta", res_root_dir=self.tmp_dir,
+                                   resource_dir=self.tmp_dir, metadata_dir="metadata",
+                                   description_dir=self.tmp_dir, url_prefix="http://example.com/",
+                                   elastic_host="localhost", elastic_port=9200, elastic_index="test-resourcesync",
+                                   elastic_resource_doc_type="resource", elastic_change_doc_type="change",
+                                   max_items_in_list=2, dump_package_max_size=100, dump_workers=1)
+        executor = executor_class(para)
+        executor.query_manager = ScrollQueryManager(self.values)
+        return executor.execute()
+
+    def packages(self):
+        return sorted(name for name in os.listdir(self.metadata_dir) if name.endswith(".zip"))
+
+    def test_replace_previous_dump(self):
+        self.execute()
+        first_packages = self.packages()
+        self.assertEqual(len(first_packages), 2)
+        seen = []
+
+        test = self
+
+        class CheckingExecutor(ElasticResourceDumpExecutor):
+            def save_sitemap(self, sitemap, path):
+                # the previous dump is served until the new documents are saved
+                if os.path.basename(path).startswith("resourcedump"):
+                    seen.append(all(os.path.exists(os.path.join(test.metadata_dir, name))
+                                    for name in first_packages))
+                super(CheckingExecutor, self).save_sitemap(sitemap, path)
+
+        sitemap_data_iter = self.execute(CheckingExecutor)
+        self.assertTrue(len(seen) > 0 and all(seen))
+        packages = self.packages()
+        self.assertEqual(len(packages), 2)
+        self.assertEqual(set(packages) & set(first_packages), set())
+        self.assertEqual([os.path.basename(sitemap_data.path) for sitemap_data in sitemap_data_iter],
+                         ["resourcedump_0000.xml"])
+        self.assertEqual(sorted(os.path.basename(uri) for uri, md5, length in
+                                sitemap_resources(sitemap_data_iter[0].path)), packages)
+
+
+class ChangeQueryManager(object):
+    """Scrolls change documents of (value, datetime)."""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def scan_and_scroll(self, index, doc_type, query, max_items_in_list, max_result_window):
+        yield [{'_source': {'resource_set': "elsevier-meta", 'change': "updated",
+                            'location': {'type': "rel_path", 'value': value}, 'lastmod': date,
+                            'datetime': date, 'timestamp': None}}
+               for value, date in self.changes]
+
+
+class TestChangeDump(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        para = ElasticRsParameters(resource_set="elsevier-meta", res_root_dir=self.tmp_dir,
+                                   resource_dir=self.tmp_dir, metadata_dir="metadata",
+                                   description_dir=self.tmp_dir, url_prefix="http://example.com/",
+                                   elastic_host="localhost", elastic_port=9200, elastic_index="test-resourcesync",
+                                   elastic_resource_doc_type="resource", elastic_change_doc_type="change",
+                                   max_items_in_list=2)
+        self.executor = ElasticNewChangeDumpExecutor(para)
+        self.executor.changelist_files = []
+        self.executor.dump_ordinal = 3
+        self.executor.date_changelist_from = "2017-02-01T00:00:00Z"
+        self.executor.date_start_processing = "2017-02-03T00:00:00Z"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_period_changes(self):
+        self.executor.query_manager = ChangeQueryManager([("before.txt", "2017-02-01T00:00:00Z"),
+                                                          ("in.txt", "2017-02-02T00:00:00Z"),
+                                                          ("until.txt", "2017-02-03T00:00:00Z"),
+                                                          ("during.txt", "2017-02-03T00:00:01Z")])
+        # changes stamped during the run belong to the next changedump
+        self.assertEqual([r_change.uri for r_change in self.executor.period_changes()],
+                         ["http://example.com/in.txt", "http://example.com/until.txt"])
+
+    def test_package_location(self):
+        # packages are named after the changedump listing them: max_items_in_list packages per changedump
+        names = [os.path.basename(self.executor.package_location(ordinal)[0]) for ordinal in range(3)]
+        self.assertEqual(names, ["changedump_0003_part_0000.zip", "changedump_0003_part_0001.zip",
+                                 "changedump_0004_part_0000.zip"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from omtdrspub.elastic.external_sort import ExternalSorter, last_changes
+
+
+class CountingSorter(ExternalSorter):
+    """Counts the run files open at the same time."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingSorter, self).__init__(*args, **kwargs)
+        self.open_runs = 0
+        self.max_open_runs = 0
+
+    def _read_run(self, path):
+        self.open_runs += 1
+        self.max_open_runs = max(self.max_open_runs, self.open_runs)
+        try:
+            for record in super(CountingSorter, self)._read_run(path):
+                yield record
+        finally:
+            self.open_runs -= 1
+
+
+class TestExternalSort(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sort_spills_runs(self):
+        sorter = ExternalSorter(key=lambda r: r[0], buffer_size=3, tmp_dir=self.tmp_dir)
+        for i in [5, 3, 9, 1, 7, 2, 8]:
+            sorter.add([i])
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 1)
+        self.assertEqual([r[0] for r in sorter], [1, 2, 3, 5, 7, 8, 9])
+        sorter.close()
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_bounded_fan_in(self):
+        values = [(i * 37) % 101 for i in range(101)]
+        sorter = CountingSorter(key=lambda r: r[0], buffer_size=2, tmp_dir=self.tmp_dir, fan_in=4)
+        for i, value in enumerate(values):
+            sorter.add([value // 2, i])
+        # 50 runs, merged 4 at a time
+        self.assertEqual([r[0] for r in sorter], sorted(value // 2 for value in values))
+        self.assertLessEqual(sorter.max_open_runs, 4)
+        sorted_records = sorted(([value // 2, i] for i, value in enumerate(values)), key=lambda r: r[0])
+        # equal keys keep the order in which they were added
+        self.assertEqual(list(sorter), sorted_records)
+        sorter.close()
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+    def test_last_changes(self):
+        changes = [
+            ["http://example.com/a.txt", "2017-01-01T00:00:00Z", "created", "2017-01-01T00:00:01Z"],
+            ["http://example.com/b.txt", "2017-01-01T00:00:00Z", "created", "2017-01-01T00:00:02Z"],
+            ["http://example.com/a.txt", "2017-01-02T00:00:00Z", "updated", "2017-01-02T00:00:01Z"],
+            ["http://example.com/c.txt", "2017-01-02T00:00:00Z", "created", "2017-01-02T00:00:02Z"],
+            ["http://example.com/b.txt", "2017-01-03T00:00:00Z", "deleted", "2017-01-03T00:00:01Z"],
+            ["http://example.com/d.txt", "2017-01-03T00:00:00Z", "updated", "2017-01-03T00:00:02Z"],
+        ]
+        counts, sorter = last_changes(iter(changes), buffer_size=2, tmp_dir=self.tmp_dir)
+        try:
+            survivors = [(r[0], r[2]) for r in sorter]
+        finally:
+            sorter.close()
+
+        self.assertEqual(counts, {"created": 1, "updated": 2, "deleted": 1})
+        self.assertEqual(survivors, [
+            ("http://example.com/c.txt", "created"),
+            ("http://example.com/a.txt", "updated"),
+            ("http://example.com/d.txt", "updated"),
+            ("http://example.com/b.txt", "deleted"),
+        ])
+        self.assertEqual(os.listdir(self.tmp_dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
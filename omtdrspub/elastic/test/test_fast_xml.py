@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from resync import Resource, ResourceList
+from rspub.core.executors import ExecutorEvent
+
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_resourcelist import ElasticResourceListExecutor
+from omtdrspub.elastic.fast_xml import FragmentResourceList, UrlFragmentSerializer, escape_attrib, escape_cdata, \
+    serialized_attrib, serialized_text
+from omtdrspub.elastic.model.location import LocationResolver
+from omtdrspub.elastic.test.test_checkpoint import ScrollQueryManager
+
+res_root_dir = "/test/path/"
+prefix = "http://example.com/"
+
+
+def e_source(name, **kwargs):
+    source = {
+        'resync_id': name,
+        'resource_set': "elsevier-meta",
+        'location': {'type': "abs_path", 'value': os.path.join(res_root_dir, name)},
+        'length': 5,
+        'md5': "3b5d5c3712955042212316173ccf37be",
+        'mime': "text/plain",
+        'lastmod': "2017-02-03T12:25:00Z",
+        'ln': [{'href': {'type': "rel_path", 'value': name + ".pdf"}, 'rel': "describes",
+                'mime': "application/pdf"}],
+        'timestamp': "2017-02-03T12:25:00Z"
+    }
+    source.update(kwargs)
+    return source
+
+
+SOURCES = [
+    e_source("file1.txt"),
+    e_source("dir/file & <2>.txt", mime='text/plain; charset="utf-8"'),
+    e_source("file3.txt", ln=[], md5=None, length=None, mime=None),
+    e_source("file4.txt", lastmod="2017-02-03T12:25:00.250000Z"),
+    e_source("file5.txt", lastmod=None,
+             ln=[{'href': {'type': "url", 'value': "http://example.org/?a=1&b=2"}, 'rel': "via", 'mime': None}]),
+    e_source("file6.txt", mime="text/plain;\tcharset='utf-8'\r\n")
+]
+
+
+class Observer(object):
+
+    def __init__(self):
+        self.created = []
+
+    def inform(self, *args, **kwargs):
+        if args[1] == ExecutorEvent.created_resource:
+            self.created.append(kwargs)
+
+
+class TestFastXml(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_both(self, pretty_xml):
+        resolver = LocationResolver(prefix, res_root_dir)
+        serializer = UrlFragmentSerializer(resolver, pretty_xml=pretty_xml)
+        resourcelist = ResourceList()
+        fragment_list = FragmentResourceList()
+        for sitemap in (resourcelist, fragment_list):
+            sitemap.md_at = "2017-02-03T12:25:00Z"
+            sitemap.pretty_xml = pretty_xml
+            sitemap.link_set(rel="up", href=prefix + "capabilitylist.xml")
+        # reversed, so that the fragments have to be sorted by uri
+        for source in reversed(SOURCES):
+            uri = resolver.resolve(source['location']['value'], source['location']['type'])
+            fragment = serializer.fast_fragment(source, uri)
+            resourcelist.add(serializer.resource(source, uri))
+            fragment_list.add_fragment(uri, fragment)
+
+        resync_path = os.path.join(self.tmp_dir, "resync.xml")
+        fast_path = os.path.join(self.tmp_dir, "fast.xml")
+        resourcelist.write(resync_path)
+        fragment_list.write_fragments(fast_path)
+        with open(resync_path, "rb") as resync_file, open(fast_path, "rb") as fast_file:
+            return resync_file.read(), fast_file.read()
+
+    def test_byte_identical(self):
+        expected, actual = self.write_both(pretty_xml=False)
+        self.assertEqual(expected, actual)
+
+    def test_byte_identical_pretty(self):
+        expected, actual = self.write_both(pretty_xml=True)
+        self.assertEqual(expected, actual)
+
+    def test_fragment_is_verified(self):
+        serializer = UrlFragmentSerializer(LocationResolver(prefix, res_root_dir))
+        for source in SOURCES:
+            uri, fragment = serializer.fragment(source)
+            self.assertEqual(fragment, serializer.etree_fragment(source, uri))
+        self.assertTrue(serializer.enabled)
+
+    def test_escape(self):
+        text = "a & b <c> \"d\" 'e'\r\n\tf"
+        self.assertEqual(escape_cdata(text), serialized_text(text))
+        self.assertEqual(escape_attrib(text), serialized_attrib(text))
+
+    def test_observers_get_resources(self):
+        para = ElasticRsParameters(resource_set="elsevier-meta", res_root_dir=self.tmp_dir,
+                                   resource_dir=self.tmp_dir, metadata_dir="metadata",
+                                   description_dir=self.tmp_dir, url_prefix="http://example.com/",
+                                   elastic_host="localhost", elastic_port=9200, elastic_index="test-resourcesync",
+                                   elastic_resource_doc_type="resource", elastic_change_doc_type="change",
+                                   max_items_in_list=2, fast_xml=True)
+        executor = ElasticResourceListExecutor(para)
+        executor.query_manager = ScrollQueryManager(["file1.txt", "file2.txt"])
+        observer = Observer()
+        executor.register(observer)
+        executor.execute()
+        self.assertEqual([kwargs['count'] for kwargs in observer.created], [1, 2])
+        for kwargs in observer.created:
+            self.assertIsInstance(kwargs['resource'], Resource)
+        self.assertEqual(observer.created[-1]['resource'].uri, "http://example.com/file2.txt")
+
+
+if __name__ == '__main__':
+    unittest.main()
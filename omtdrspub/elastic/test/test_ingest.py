@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from omtdrspub.elastic import ingest
+from omtdrspub.elastic.elastic_rs_paras import DEFAULT_WATCH_IGNORE
+from omtdrspub.elastic.ingest import ElasticIngester, elastic_id
+from omtdrspub.elastic.model.location import Location
+
+
+class Para(object):
+    resource_set = "elsevier-meta"
+    elastic_index = "test-resourcesync"
+    elastic_resource_doc_type = "resource"
+    elastic_change_doc_type = "change"
+    url_prefix = "http://example.com/"
+    max_items_in_list = 50000
+    ingest_workers = 2
+    ingest_bulk_size = 2
+    ingest_location_type = "rel_path"
+    watch_ignore = DEFAULT_WATCH_IGNORE
+
+    def __init__(self, res_root_dir, stat_cache_dir=None):
+        self.res_root_dir = res_root_dir
+        self.stat_cache_dir = stat_cache_dir
+
+    def abs_stat_cache_dir(self):
+        return self.stat_cache_dir
+
+
+class IndexQueryManager(object):
+    """Holds resource documents in a dict and change documents in a list."""
+
+    def __init__(self):
+        self.resources = {}
+        self.changes = []
+        self.bulk_sizes = []
+
+    def get_documents_by_locations(self, index, doc_type, resource_set, locations):
+        keys = set((location.loc_type, location.value) for location in locations)
+        return [{'_id': i, '_source': doc} for i, doc in self.resources.items()
+                if (doc['location']['type'], doc['location']['value']) in keys]
+
+    def bulk(self, index, operations):
+        self.bulk_sizes.append(len(operations))
+        items = []
+        for op_type, doc_type, doc_id, doc in operations:
+            if doc_type == "change":
+                self.changes.append(doc)
+            elif op_type == 'delete':
+                del self.resources[doc_id]
+            else:
+                self.resources[doc_id] = doc
+            items.append({op_type: {'_id': doc_id, 'status': 200}})
+        return items
+
+    def refresh_index(self, index):
+        pass
+
+    def scan_and_scroll(self, index, doc_type, query, max_items_in_list, max_result_window):
+        yield [{'_id': i, '_source': doc} for i, doc in list(self.resources.items())]
+
+
+class TestElasticIngester(unittest.TestCase):
+
+    def setUp(self):
+        self.res_root_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.res_root_dir, "sub"))
+        for name, content in (("file1.txt", b"abc"), ("sub/file2.xml", b"<a/>"), ("sub/file3.txt", b"")):
+            with open(os.path.join(self.res_root_dir, name), "wb") as file:
+                file.write(content)
+        self.query_manager = IndexQueryManager()
+
+    def tearDown(self):
+        shutil.rmtree(self.res_root_dir)
+
+    def ingest(self, stat_cache_dir=None):
+        return ElasticIngester(Para(self.res_root_dir, stat_cache_dir), query_manager=self.query_manager).ingest()
+
+    def test_ingest(self):
+        counts = self.ingest()
+        self.assertEqual((counts['created'], counts['updated'], counts['deleted']), (3, 0, 0))
+        # two resources and their changes per bulk request
+        self.assertEqual(self.query_manager.bulk_sizes, [4, 2])
+
+        doc = self.query_manager.resources[elastic_id("elsevier-meta", Location("sub/file2.xml", "rel_path"))]
+        self.assertEqual(doc['location'], {'type': "rel_path", 'value': "sub/file2.xml"})
+        self.assertEqual(doc['length'], 4)
+        # md5 of "<a/>" in base64
+        self.assertEqual(doc['md5'], "8BnumgOXiv+fm3jQ3fPttw==")
+        self.assertEqual(doc['mime'], "application/xml")
+        self.assertEqual(sorted(change['change'] for change in self.query_manager.changes), ["created"] * 3)
+
+    def test_lookup_batches(self):
+        self.ingest()
+        ingester = ElasticIngester(Para(self.res_root_dir), query_manager=self.query_manager)
+        locations = [Location(value, "rel_path") for value in ("file1.txt", "sub/file2.xml", "sub/file3.txt")]
+        with mock.patch.object(ingest, "MAX_TERMS", 2), \
+                mock.patch.object(self.query_manager, "get_documents_by_locations",
+                                  wraps=self.query_manager.get_documents_by_locations) as lookup:
+            self.assertEqual(len(ingester.existing_documents(locations)), 3)
+        # searches stay within the clause limit of elasticsearch
+        self.assertEqual([len(call[1]['locations']) for call in lookup.call_args_list], [2, 1])
+
+    def test_ingest_again(self):
+        self.ingest()
+        self.query_manager.changes = []
+        with open(os.path.join(self.res_root_dir, "file1.txt"), "wb") as file:
+            file.write(b"abcd")
+        os.remove(os.path.join(self.res_root_dir, "sub/file3.txt"))
+
+        counts = self.ingest()
+        self.assertEqual((counts['created'], counts['updated'], counts['unchanged'], counts['deleted']),
+                         (0, 1, 1, 1))
+        self.assertEqual(len(self.query_manager.resources), 2)
+        self.assertEqual(sorted((change['change'], change['location']['value'])
+                                for change in self.query_manager.changes),
+                         [("deleted", "sub/file3.txt"), ("updated", "file1.txt")])
+
+    def test_ingest_foreign_ids(self):
+        # indexed by another producer, with ids of its own
+        for resync_id, value, length in (("42", "file1.txt", 2), ("43", "sub/file2.xml", 4)):
+            self.query_manager.resources[resync_id] = {'resync_id': resync_id, 'resource_set': "elsevier-meta",
+                                                       'location': {'type': "rel_path", 'value': value},
+                                                       'length': length, 'md5': "8BnumgOXiv+fm3jQ3fPttw==",
+                                                       'mime': "text/plain", 'lastmod': "2017-02-03T12:25:00Z",
+                                                       'ln': [], 'timestamp': None}
+
+        counts = self.ingest()
+        self.assertEqual((counts['created'], counts['updated']), (1, 2))
+        self.assertEqual(len(self.query_manager.resources), 3)
+        self.assertEqual(self.query_manager.resources["42"]['length'], 3)
+        self.assertEqual(self.query_manager.resources["42"]['resync_id'], "42")
+        self.assertEqual(sorted((change['change'], change['location']['value'])
+                                for change in self.query_manager.changes),
+                         [("created", "sub/file3.txt"), ("updated", "file1.txt"), ("updated", "sub/file2.xml")])
+
+        self.query_manager.changes = []
+        counts = self.ingest()
+        self.assertEqual((counts['created'], counts['updated'], counts['unchanged']), (0, 0, 3))
+        self.assertEqual(len(self.query_manager.resources), 3)
+
+    def test_stat_cache(self):
+        stat_cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, stat_cache_dir)
+        self.ingest(stat_cache_dir)
+        resources = dict(self.query_manager.resources)
+        with open(os.path.join(self.res_root_dir, "file1.txt"), "wb") as file:
+            file.write(b"abcd")
+
+        with mock.patch.object(ingest, "file_digest", wraps=ingest.file_digest) as file_digest:
+            counts = self.ingest(stat_cache_dir)
+        # only the modified file is read again
+        file_digest.assert_called_once_with(os.path.join(self.res_root_dir, "file1.txt"))
+        self.assertEqual((counts['updated'], counts['unchanged']), (1, 2))
+        file2_id = elastic_id("elsevier-meta", Location("sub/file2.xml", "rel_path"))
+        self.assertEqual(self.query_manager.resources[file2_id]['md5'], resources[file2_id]['md5'])
+
+
+if __name__ == '__main__':
+    unittest.main()
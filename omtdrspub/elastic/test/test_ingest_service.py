@@ -0,0 +1,137 @@
+import json
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+from omtdrspub.elastic.ingest_service import IngestBatcher, IngestServer, PendingOperation
+
+
+class Para(object):
+    resource_set = "elsevier-meta"
+    elastic_host = "localhost"
+    elastic_port = 9200
+    elastic_index = "test-resourcesync"
+    elastic_resource_doc_type = "resource"
+    elastic_change_doc_type = "change"
+
+
+class StandInBackend(object):
+    """Applies bulk requests to dicts, answering as Elasticsearch does."""
+
+    def __init__(self):
+        self.resources = {}
+        self.changes = []
+        self.requests = []
+        # status of change documents, e.g. 429 when the cluster rejects them
+        self.change_status = 201
+
+    def bulk(self, index, operations):
+        self.requests.append(operations)
+        items = []
+        for op_type, doc_type, elastic_id, doc in operations:
+            if doc_type == "change":
+                status = self.change_status
+                if status < 300:
+                    self.changes.append(doc)
+            elif op_type == 'create' and elastic_id in self.resources:
+                status = 409
+            elif op_type == 'delete':
+                status = 200 if self.resources.pop(elastic_id, None) is not None else 404
+            else:
+                status = 200 if elastic_id in self.resources else 201
+                self.resources[elastic_id] = doc
+            items.append({op_type: {'_id': elastic_id, 'status': status}})
+        return items
+
+
+def operation(op, elastic_id, **kwargs):
+    dct = {'op': op, 'id': elastic_id, 'location': {'type': "rel_path", 'value': elastic_id + ".txt"},
+           'length': 3, 'md5': "md5", 'mime': "text/plain", 'lastmod': "2017-01-01T00:00:00Z"}
+    dct.update(kwargs)
+    return dct
+
+
+class TestIngestBatcher(unittest.TestCase):
+
+    def test_batch(self):
+        backend = StandInBackend()
+        backend.resources["b"] = {}
+        batcher = IngestBatcher(bulk_size=10, query_manager=backend)
+        operations = [PendingOperation(Para(), dct) for dct in
+                      (operation("create", "a"), operation("create", "b"), operation("create_or_update", "b"),
+                       operation("delete", "c"), operation("delete", "a", record_change=False))]
+        batcher.submit(operations)
+        batcher.stop()
+        batcher.run()
+
+        # all operations share a bulk request, their changes a second one
+        self.assertEqual(batcher.bulk_requests, 2)
+        self.assertEqual([(op.result['status'], op.result['change']) for op in operations],
+                         [(201, "created"), (409, None), (200, "updated"), (404, None), (200, "deleted")])
+        self.assertEqual([(change['change'], change['location']['value']) for change in backend.changes],
+                         [("created", "a.txt"), ("updated", "b.txt")])
+
+    def test_changes_rejected(self):
+        backend = StandInBackend()
+        backend.change_status = 429
+        batcher = IngestBatcher(bulk_size=10, query_manager=backend)
+        operations = [PendingOperation(Para(), dct) for dct in
+                      (operation("create", "a"), operation("create", "b", record_change=False))]
+        batcher.write(operations)
+
+        # the resource is written, producers learn that its change is not
+        self.assertEqual((operations[0].result['status'], operations[0].result['change']), (201, None))
+        self.assertIn("Failed to record the change", operations[0].result['error'])
+        self.assertEqual((operations[1].result['status'], operations[1].result['error']), (201, None))
+        self.assertEqual(backend.changes, [])
+
+
+class TestIngestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = StandInBackend()
+        self.server = IngestServer(("127.0.0.1", 0), [Para()],
+                                   batcher=IngestBatcher(max_delay=0.2, query_manager=self.backend))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def post(self, resource_set, body):
+        request = urllib.request.Request("http://127.0.0.1:%d/resource_sets/%s/operations" %
+                                         (self.server.server_address[1], resource_set),
+                                         data=json.dumps(body).encode("utf-8"), method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return response.status, json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as err:
+            return err.code, json.loads(err.read().decode("utf-8"))
+
+    def test_producers(self):
+        results = {}
+
+        def produce(name):
+            results[name] = self.post("elsevier-meta", [operation("create_or_update", name + str(i))
+                                                        for i in range(3)])
+
+        producers = [threading.Thread(target=produce, args=(name,)) for name in ("x", "y")]
+        for producer in producers:
+            producer.start()
+        for producer in producers:
+            producer.join()
+
+        self.assertEqual(results["x"][0], 200)
+        self.assertEqual([result['id'] for result in results["x"][1]], ["x0", "x1", "x2"])
+        self.assertEqual({result['change'] for result in results["y"][1]}, {"created"})
+        self.assertEqual(len(self.backend.resources), 6)
+
+    def test_errors(self):
+        self.assertEqual(self.post("unknown", [operation("create", "a")])[0], 404)
+        status, body = self.post("elsevier-meta", [{'op': "rename", 'id': "a"}])
+        self.assertEqual(status, 400)
+        self.assertIn("rename", body['error'])
+        self.assertEqual(self.backend.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from omtdrspub.elastic import journal as journal_module, utils
+from omtdrspub.elastic.journal import IngestJournal
+from omtdrspub.elastic.model.location import Location
+from omtdrspub.elastic.test.test_ingest import IndexQueryManager, Para
+
+
+class FailingQueryManager(IndexQueryManager):
+
+    def __init__(self):
+        super(FailingQueryManager, self).__init__()
+        self.failing = True
+
+    def bulk(self, index, operations):
+        if self.failing:
+            return [{op_type: {'_id': elastic_id, 'status': 503, 'error': "unavailable"}}
+                    for op_type, doc_type, elastic_id, doc in operations]
+        return super(FailingQueryManager, self).bulk(index, operations)
+
+
+class TestIngestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp()
+        self.para = Para("/data")
+
+    def tearDown(self):
+        shutil.rmtree(self.journal_dir)
+
+    def journal(self, query_manager):
+        journal = IngestJournal(self.para, journal_dir=self.journal_dir, query_manager=query_manager)
+        self.addCleanup(journal.close)
+        return journal
+
+    def create(self, journal, elastic_id, md5):
+        return journal.create_or_update_resource(self.para, elastic_id, Location(elastic_id + ".txt", "rel_path"),
+                                                 length=3, md5=md5, mime="text/plain",
+                                                 lastmod="2017-01-01T00:00:00Z")
+
+    def segments(self):
+        return [name for name in os.listdir(self.journal_dir) if name.endswith(".log")]
+
+    def test_replay(self):
+        query_manager = IndexQueryManager()
+        journal = self.journal(query_manager)
+        self.create(journal, "c", "md5-c")
+        journal.replay()
+        query_manager.changes = []
+
+        self.assertEqual(self.create(journal, "a", "md5-a1")['journaled'], True)
+        self.create(journal, "a", "md5-a2")
+        self.create(journal, "b", "md5-b")
+        journal.delete_resource(self.para, "b", Location("b.txt", "rel_path"))
+        journal.delete_resource(self.para, "c", Location("c.txt", "rel_path"))
+        # nothing is written until the journal is replayed
+        self.assertEqual(sorted(query_manager.resources), ["c"])
+        self.assertEqual(len(self.segments()), 1)
+
+        self.assertEqual(journal.replay(), 1)
+        self.assertEqual(sorted(query_manager.resources), ["a"])
+        self.assertEqual(query_manager.resources["a"]['md5'], "md5-a2")
+        # only the last operation on every resource is written
+        self.assertEqual(sorted((change['change'], change['location']['value'])
+                                for change in query_manager.changes),
+                         [("created", "a.txt"), ("deleted", "c.txt")])
+        self.assertEqual(self.segments(), [])
+
+    def test_same_location(self):
+        query_manager = IndexQueryManager()
+        journal = self.journal(query_manager)
+        location = Location("a.txt", "rel_path")
+        journal.create_or_update_resource(self.para, "a", location, length=3, md5="md5-a1", mime="text/plain",
+                                          lastmod="2017-01-01T00:00:00Z")
+        journal.replay()
+        query_manager.changes = []
+
+        # deleted and created again by a producer that chose another id
+        journal.delete_resource(self.para, "a", location)
+        journal.create_or_update_resource(self.para, "a-2", location, length=3, md5="md5-a2", mime="text/plain",
+                                          lastmod="2017-01-02T00:00:00Z")
+        journal.create_or_update_resource(self.para, "b-1", Location("b.txt", "rel_path"), length=3,
+                                          md5="md5-b1", mime="text/plain", lastmod="2017-01-01T00:00:00Z")
+        journal.create_or_update_resource(self.para, "b-2", Location("b.txt", "rel_path"), length=3,
+                                          md5="md5-b2", mime="text/plain", lastmod="2017-01-01T00:00:00Z")
+        journal.replay()
+        self.assertEqual(sorted(query_manager.resources), ["a", "b-2"])
+        self.assertEqual(query_manager.resources["a"]['md5'], "md5-a2")
+        self.assertEqual(query_manager.resources["b-2"]['md5'], "md5-b2")
+        self.assertEqual(sorted((change['change'], change['location']['value'])
+                                for change in query_manager.changes),
+                         [("created", "b.txt"), ("updated", "a.txt")])
+
+    def test_change_datetime(self):
+        query_manager = IndexQueryManager()
+        journal = self.journal(query_manager)
+        journaled_at = datetime(2017, 1, 1, 12, 0, 0)
+        with mock.patch.object(journal_module, "datetime", wraps=datetime) as journal_datetime:
+            journal_datetime.now.return_value = journaled_at
+            self.create(journal, "a", "md5-a")
+        self.create(journal, "b", "md5-b")
+        journal.replay()
+        # changes happened when they were journaled, not when they were replayed
+        datetimes = {change['location']['value']: change['datetime'] for change in query_manager.changes}
+        self.assertEqual(datetimes["a.txt"], utils.formatted_date(journaled_at))
+        self.assertNotEqual(datetimes["b.txt"], utils.formatted_date(journaled_at))
+        # documents are stamped when they are written
+        self.assertGreater(query_manager.resources["a"]['timestamp'], utils.formatted_date(journaled_at))
+
+    def test_crash(self):
+        journal = self.journal(IndexQueryManager())
+        self.create(journal, "a", "md5-a")
+        self.create(journal, "b", "md5-b")
+        journal.close()
+        segment = os.path.join(self.journal_dir, self.segments()[0])
+        with open(segment, "rb+") as segment_file:
+            # the last record was being written
+            segment_file.truncate(os.path.getsize(segment) - 5)
+
+        query_manager = IndexQueryManager()
+        self.journal(query_manager).replay()
+        self.assertEqual(sorted(query_manager.resources), ["a"])
+
+    def test_retry(self):
+        query_manager = FailingQueryManager()
+        journal = self.journal(query_manager)
+        self.create(journal, "a", "md5-a")
+        with self.assertRaises(IOError):
+            journal.replay()
+        self.assertEqual(len(self.segments()), 1)
+
+        query_manager.failing = False
+        self.assertEqual(journal.replay(), 1)
+        self.assertEqual(sorted(query_manager.resources), ["a"])
+
+    def test_single_process(self):
+        self.journal(IndexQueryManager())
+        with self.assertRaises(RuntimeError):
+            # flock locks are per open file: a second journal in the same process is refused as well
+            IngestJournal(self.para, journal_dir=self.journal_dir, query_manager=IndexQueryManager())
+
+
+if __name__ == '__main__':
+    unittest.main()
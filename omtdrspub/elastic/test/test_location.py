@@ -0,0 +1,53 @@
+import os
+import unittest
+
+from omtdrspub.elastic.model.location import Location, LocationResolver
+
+res_root_dir = "/test/path/"
+prefix = "http://example.com/"
+
+
+class TestLocationResolver(unittest.TestCase):
+
+    def assert_same_uri(self, location: Location, resolver: LocationResolver):
+        self.assertEqual(resolver.uri(location),
+                         location.uri_from_path(para_url_prefix=prefix, para_res_root_dir=res_root_dir))
+
+    def test_abs_path(self):
+        resolver = LocationResolver(prefix, res_root_dir)
+        for value in ["/test/path/file1.txt", "/test/path/sub dir/file 2.txt", "/test/path/sub dir/file3.txt",
+                      "/test/other/file4.txt", "/test/path/", "/test/path/a/../file5.txt", "/test/path",
+                      "/test", "/test/path//sub dir//file6.txt"]:
+            self.assert_same_uri(Location(value=value, loc_type="abs_path"), resolver)
+
+    def test_rel_path(self):
+        resolver = LocationResolver(prefix, res_root_dir)
+        for value in ["file1.pdf", "sub dir/file2.pdf", "sub dir/file3.pdf", "../file4.pdf", "./a/file5.pdf",
+                      "/root/file6.pdf", "a/", "mailto:file7.pdf", "dir//file8.pdf", "dir//sub/file9.pdf",
+                      "//file10.pdf"]:
+            self.assert_same_uri(Location(value=value, loc_type="rel_path"), resolver)
+
+    def test_cache_size(self):
+        resolver = LocationResolver(prefix, res_root_dir, cache_size=2)
+        for i in range(5):
+            self.assert_same_uri(Location(value="dir%d/file.pdf" % i, loc_type="rel_path"), resolver)
+            self.assert_same_uri(Location(value="/test/path/dir%d/file.pdf" % i, loc_type="abs_path"), resolver)
+        self.assertEqual(resolver._rel_dirs.cache_info().currsize, 2)
+        self.assertEqual(resolver._abs_dirs.cache_info().currsize, 2)
+
+    def test_url(self):
+        resolver = LocationResolver(prefix, res_root_dir)
+        self.assert_same_uri(Location(value="http://example.org/file1.txt", loc_type="url"), resolver)
+
+    def test_path(self):
+        resolver = LocationResolver(prefix, res_root_dir)
+        for location in [Location(value="/test/path/sub dir/file 2.txt", loc_type="abs_path"),
+                         Location(value="sub dir/file3.pdf", loc_type="rel_path")]:
+            path = resolver.path(location)
+            self.assertEqual(os.path.normpath(resolver.path_from_uri(resolver.uri(location))), path)
+        self.assertIsNone(resolver.path(Location(value="http://example.org/file1.txt", loc_type="url")))
+        self.assertIsNone(resolver.path_from_uri("http://example.org/file1.txt"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from resync import ChangeList
+from resync import Resource
+
+from omtdrspub.elastic.manifest import MANIFEST_FILE, PublicationManifest
+
+
+class MetadataDirParameters(object):
+
+    def __init__(self, metadata_dir):
+        self.metadata_dir = metadata_dir
+        self.zero_fill_filename = 4
+
+    def abs_metadata_path(self, file_name):
+        return os.path.join(self.metadata_dir, file_name)
+
+
+class TestPublicationManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.para = MetadataDirParameters(self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_changelist(self, ordinal, md_until=None, index=False):
+        changelist = ChangeList()
+        changelist.md_from = "2017-02-03T12:25:00Z"
+        changelist.md_until = md_until
+        if index:
+            changelist.link_set(rel="index", href="http://example.com/changelist-index.xml")
+        changelist.add(Resource(uri="http://example.com/file%d.txt" % ordinal, change="created"))
+        path = self.para.abs_metadata_path("changelist_%04d.xml" % ordinal)
+        changelist.write(path)
+        return path, changelist
+
+    def test_record_and_load(self):
+        manifest = PublicationManifest.load(self.para)
+        self.assertEqual(manifest.files("changelist"), [])
+        for ordinal in range(2):
+            manifest.record(*self.write_changelist(ordinal, md_until="2017-02-04T12:25:00Z" if ordinal == 0 else None,
+                                                   index=True))
+
+        loaded = PublicationManifest.load(self.para)
+        self.assertEqual([os.path.basename(f) for f in loaded.files("changelist")],
+                         ["changelist_0000.xml", "changelist_0001.xml"])
+        last = loaded.last("changelist")
+        self.assertEqual((last['ordinal'], last['count'], last['md_until'], last['index_link']), (1, 1, None, True))
+        self.assertIsNone(loaded.last("resourcelist"))
+
+    def test_rebuild_when_inconsistent(self):
+        self.write_changelist(0, md_until="2017-02-04T12:25:00Z")
+        # written without the manifest knowing about it
+        self.write_changelist(1)
+        manifest = PublicationManifest.load(self.para)
+        self.assertTrue(os.path.exists(self.para.abs_metadata_path(MANIFEST_FILE)))
+        self.assertEqual(len(manifest.files("changelist")), 2)
+        self.assertEqual(manifest.get(manifest.files("changelist")[0])['md_until'], "2017-02-04T12:25:00Z")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from omtdrspub.elastic.model.change_doc import ChangeDoc
+from omtdrspub.elastic.model.link import Link
+from omtdrspub.elastic.model.location import Location
+from omtdrspub.elastic.model.resource_doc import ResourceDoc
+
+
+class TestModel(unittest.TestCase):
+
+    def test_resource_doc_codec(self):
+        res_doc = ResourceDoc(location=Location(loc_type="abs_path", value="/test/path/file1.txt"),
+                              resource_set="elsevier-meta",
+                              length=5,
+                              md5="md5:",
+                              mime="text/plain",
+                              ln=[Link(href=Location(loc_type="rel_path", value="file1.pdf"), rel="describes",
+                                       mime="application/pdf")],
+                              lastmod="2017-02-03T12:25:00Z", resync_id="1",
+                              timestamp="2017-02-03T12:26:00Z")
+        source = res_doc.to_source()
+        self.assertEqual(source, res_doc.to_dict())
+        self.assertEqual(ResourceDoc.from_source(source).to_source(), source)
+        self.assertEqual(ResourceDoc.as_resource_doc(source).ln[0].href.value, "file1.pdf")
+
+    def test_change_doc_codec(self):
+        change_doc = ChangeDoc("elsevier-meta", Location(value="/test/path/file1.txt", loc_type="abs_path"),
+                               "2017-02-03T14:27:00Z", "deleted", "2017-02-03T14:28:00Z", "2017-02-03T14:28:00Z")
+        source = change_doc.to_source()
+        self.assertEqual(source, change_doc.to_dict())
+        self.assertEqual(ChangeDoc.from_source(source).to_source(), source)
+        self.assertEqual(ChangeDoc.as_change_doc(source).change, "deleted")
+
+    def test_no_instance_dict(self):
+        location = Location(value="/test/path/file1.txt", loc_type="abs_path")
+        for doc in (location, Link(href=location, rel="describes", mime="text/plain"),
+                    ResourceDoc(location=location), ChangeDoc(location=location)):
+            self.assertFalse(hasattr(doc, '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from rspub.core.executors import ExecutorEvent
+
+from omtdrspub.elastic.progress import ProgressEvents
+
+
+class RecordingObservable(object):
+
+    def __init__(self, delay=0.0):
+        self.events = []
+        self.delay = delay
+        self.threads = set()
+
+    def observers_inform(self, source, event, **kwargs):
+        time.sleep(self.delay)
+        self.threads.add(threading.current_thread().name)
+        self.events.append((event, kwargs))
+
+
+class TestProgressEvents(unittest.TestCase):
+
+    def test_every_resource(self):
+        observable = RecordingObservable()
+        progress = ProgressEvents(observable)
+        for count in range(1, 4):
+            progress.created_resource(count, resource=count)
+        progress.close()
+        self.assertEqual([kwargs['count'] for event, kwargs in observable.events], [1, 2, 3])
+
+    def test_batches(self):
+        observable = RecordingObservable()
+        progress = ProgressEvents(observable, batch_size=10)
+        for count in range(1, 26):
+            progress.created_resource(count, resource=count)
+        progress.close()
+        self.assertEqual([(kwargs['count'], kwargs['batch_size'], kwargs['resource'])
+                          for event, kwargs in observable.events], [(10, 10, 10), (20, 10, 20), (25, 5, 25)])
+        self.assertTrue(all(event == ExecutorEvent.created_resource for event, kwargs in observable.events))
+
+    def test_background(self):
+        observable = RecordingObservable(delay=0.01)
+        progress = ProgressEvents(observable, batch_size=1, background=True)
+        for count in range(1, 101):
+            progress.created_resource(count, resource=count)
+        progress.close()
+        # a slow observer gets fewer, merged batches, but every resource is accounted for
+        self.assertEqual(sum([kwargs['batch_size'] for event, kwargs in observable.events]), 100)
+        self.assertEqual(observable.events[-1][1]['count'], 100)
+        self.assertEqual(observable.threads, {"progress-events"})
+
+
+if __name__ == '__main__':
+    unittest.main()
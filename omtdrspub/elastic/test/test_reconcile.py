@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from omtdrspub.elastic.ingest import ElasticIngester
+from omtdrspub.elastic.reconcile import ElasticReconciler, sorted_files, EXTRA, MISSING, STALE
+from omtdrspub.elastic.test.test_ingest import IndexQueryManager, Para
+
+
+class SortedIndexQueryManager(IndexQueryManager):
+    """Scrolls documents in the order of their location values, two per page."""
+
+    def scan_and_scroll(self, index, doc_type, query, max_items_in_list, max_result_window):
+        self.queries = getattr(self, 'queries', []) + [query]
+        hits = sorted(({'_id': i, '_source': doc} for i, doc in self.resources.items()),
+                      key=lambda hit: hit['_source']['location']['value'])
+        for start in range(0, len(hits), 2):
+            yield hits[start:start + 2]
+
+
+class TestElasticReconciler(unittest.TestCase):
+
+    def setUp(self):
+        self.res_root_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.res_root_dir, "a"))
+        for name in ("a-b.txt", "a/c.txt", "a0.txt", "b.txt"):
+            self.write(name, "abc")
+        self.query_manager = SortedIndexQueryManager()
+        ElasticIngester(Para(self.res_root_dir), query_manager=self.query_manager).ingest()
+        self.query_manager.changes = []
+
+    def tearDown(self):
+        shutil.rmtree(self.res_root_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.res_root_dir, name), "w") as file:
+            file.write(content)
+
+    def reconcile(self, fix=False):
+        found = []
+        reconciler = ElasticReconciler(Para(self.res_root_dir), query_manager=self.query_manager)
+        reconciler.reconcile(fix=fix, report=lambda discrepancy: found.append((discrepancy.kind,
+                                                                                discrepancy.value)))
+        return found
+
+    def test_sorted_files(self):
+        paths = [os.path.relpath(path, self.res_root_dir) for path, stat in sorted_files(self.res_root_dir)]
+        self.assertEqual(paths, ["a-b.txt", "a/c.txt", "a0.txt", "b.txt"])
+        self.assertEqual(paths, sorted(paths))
+
+    def test_reconcile(self):
+        os.remove(os.path.join(self.res_root_dir, "b.txt"))
+        self.write("a/d.txt", "new")
+        self.write("a0.txt", "abcd")
+        duplicate = dict(next(doc for doc in self.query_manager.resources.values()
+                              if doc['location']['value'] == "a-b.txt"))
+        self.query_manager.resources["duplicate"] = duplicate
+
+        self.assertEqual(self.reconcile(), [(EXTRA, "a-b.txt"), (MISSING, "a/d.txt"), (STALE, "a0.txt"),
+                                            (EXTRA, "b.txt")])
+        self.assertEqual(self.query_manager.changes, [])
+        sort = self.query_manager.queries[-1]["sort"]
+        self.assertEqual(sort, [{"location.value": {"order": "asc", "nested_path": "location"}}])
+
+        self.reconcile(fix=True)
+        self.assertEqual(sorted((change['change'], change['location']['value'])
+                                for change in self.query_manager.changes),
+                         [("created", "a/d.txt"), ("deleted", "a-b.txt"), ("deleted", "b.txt"),
+                          ("updated", "a0.txt")])
+        self.assertEqual(self.reconcile(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from xml.etree import ElementTree
+
+from resync.sitemap import RS_NS
+
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_resourcelist import ElasticResourceListExecutor
+from omtdrspub.elastic import staging as staging_module
+from omtdrspub.elastic.staging import StagedPublication
+from omtdrspub.elastic.test.test_checkpoint import ScrollQueryManager
+from omtdrspub.elastic.verify import sitemap_resources
+
+
+class FakeParameters(object):
+
+    def __init__(self, metadata_dir):
+        self.metadata_dir = metadata_dir
+        self.staging_dir = None
+
+    def abs_live_metadata_dir(self):
+        return self.metadata_dir
+
+
+class TestStagedPublication(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.metadata_dir = os.path.join(self.tmp_dir, "metadata")
+        os.makedirs(os.path.join(self.metadata_dir, "packages"))
+        self.write(self.metadata_dir, "resourcelist_0000.xml", "old list")
+        self.write(self.metadata_dir, "packages/part_0000.zip", "package")
+        self.write(self.metadata_dir, "resourcedump_part_0000.zip", "dump")
+        self.write(self.metadata_dir, ".publication-manifest.json", "{}")
+        self.para = FakeParameters(self.metadata_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def write(directory, name, content):
+        with open(os.path.join(directory, name), "w") as file:
+            file.write(content)
+
+    @staticmethod
+    def read(directory, name):
+        with open(os.path.join(directory, name)) as file:
+            return file.read()
+
+    def test_publish(self):
+        staging = StagedPublication(self.para)
+        staging.begin()
+        self.assertEqual(self.para.staging_dir, os.path.join(self.tmp_dir, "metadata.staging"))
+        # sitemaps are regenerated, other files are carried over
+        self.assertEqual(sorted(os.listdir(self.para.staging_dir)),
+                         [".publication-manifest.json", "packages", "resourcedump_part_0000.zip"])
+        self.assertEqual(self.read(self.para.staging_dir, "packages/part_0000.zip"), "package")
+        # packages are shared, state files are not
+        self.assertTrue(os.path.samefile(os.path.join(self.metadata_dir, "resourcedump_part_0000.zip"),
+                                         os.path.join(self.para.staging_dir, "resourcedump_part_0000.zip")))
+        self.assertFalse(os.path.samefile(os.path.join(self.metadata_dir, ".publication-manifest.json"),
+                                          os.path.join(self.para.staging_dir, ".publication-manifest.json")))
+
+        self.write(self.para.staging_dir, "resourcelist_0000.xml", "new list")
+        # harvesters still see the previous publication
+        self.assertEqual(self.read(self.metadata_dir, "resourcelist_0000.xml"), "old list")
+        staging.publish()
+
+        self.assertIsNone(self.para.staging_dir)
+        self.assertTrue(os.path.islink(self.metadata_dir))
+        self.assertEqual(self.read(self.metadata_dir, "resourcelist_0000.xml"), "new list")
+        self.assertEqual(self.read(self.metadata_dir, "resourcedump_part_0000.zip"), "dump")
+        # the former metadata dir is removed, the published version is next to the link
+        first_version = os.path.realpath(self.metadata_dir)
+        self.assertEqual(os.path.dirname(first_version), os.path.realpath(self.tmp_dir))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ["metadata", os.path.basename(first_version)])
+
+        staging = StagedPublication(self.para)
+        staging.begin()
+        self.write(self.para.staging_dir, "resourcelist_0000.xml", "newer list")
+        staging.publish()
+
+        self.assertEqual(self.read(self.metadata_dir, "resourcelist_0000.xml"), "newer list")
+        self.assertFalse(os.path.exists(first_version))
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 2)
+
+    def test_migrate(self):
+        staging = StagedPublication(self.para)
+        staging.begin()
+        self.write(self.para.staging_dir, "resourcelist_0000.xml", "new list")
+        with mock.patch.object(staging_module, "exchange", return_value=False):
+            # the metadata dir cannot be replaced with a link atomically
+            with self.assertRaises(RuntimeError):
+                staging.publish()
+            self.assertEqual(self.read(self.metadata_dir, "resourcelist_0000.xml"), "old list")
+
+            staging.migrate()
+            self.assertTrue(os.path.islink(self.metadata_dir))
+            self.assertEqual(self.read(self.metadata_dir, "resourcelist_0000.xml"), "old list")
+
+            # the staged publication was kept
+            staging = StagedPublication(self.para)
+            staging.begin(keep=["resourcelist_0000.xml"])
+            staging.publish()
+        self.assertEqual(self.read(self.metadata_dir, "resourcelist_0000.xml"), "new list")
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 2)
+
+    def test_resume(self):
+        staging = StagedPublication(self.para)
+        staging.begin()
+        self.write(self.para.staging_dir, "checkpoint.json", "{}")
+        self.write(self.para.staging_dir, "resourcelist_0000.xml", "partial list")
+        staging.abort()
+        self.assertIsNone(self.para.staging_dir)
+
+        # an interrupted run is resumed in the same staging dir
+        staging = StagedPublication(self.para)
+        staging.begin(keep=["checkpoint.json"])
+        self.assertEqual(self.read(self.para.staging_dir, "resourcelist_0000.xml"), "partial list")
+
+        staging = StagedPublication(self.para)
+        staging.begin()
+        self.assertFalse(os.path.exists(os.path.join(self.para.staging_dir, "checkpoint.json")))
+
+
+class TestStagedResourceList(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.values = ["file%d.txt" % i for i in range(3)]
+        self.para = ElasticRsParameters(resource_set="elsevier-meta", res_root_dir=self.tmp_dir,
+                                        resource_dir=self.tmp_dir, metadata_dir="metadata",
+                                        description_dir=self.tmp_dir, url_prefix="http://example.com/",
+                                        elastic_host="localhost", elastic_port=9200,
+                                        elastic_index="test-resourcesync", elastic_resource_doc_type="resource",
+                                        elastic_change_doc_type="change", max_items_in_list=2,
+                                        staged_publication=True)
+        self.metadata_dir = os.path.join(self.tmp_dir, "metadata")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def uris(path):
+        return [uri for uri, md5, length in sitemap_resources(path)]
+
+    @staticmethod
+    def links(path):
+        return [(ln.get("rel"), ln.get("href")) for ln in ElementTree.parse(path).getroot().iter("{%s}ln" % RS_NS)]
+
+    def test_paths_and_uris(self):
+        self.para.staging_dir = os.path.join(self.tmp_dir, "metadata.staging")
+        staged_path = os.path.join(self.para.staging_dir, "resourcelist_0000.xml")
+        self.assertEqual(self.para.live_path(staged_path), os.path.join(self.metadata_dir, "resourcelist_0000.xml"))
+        self.assertEqual(self.para.uri_from_path(staged_path), "http://example.com/metadata/resourcelist_0000.xml")
+        self.assertEqual(self.para.capabilitylist_url(), "http://example.com/metadata/capabilitylist.xml")
+        # paths out of the staging dir are left alone
+        other_path = os.path.join(self.tmp_dir, "other.xml")
+        self.assertEqual(self.para.live_path(other_path), other_path)
+        self.para.staging_dir = None
+        self.assertEqual(self.para.live_path(staged_path), staged_path)
+
+    def test_publish(self):
+        executor = ElasticResourceListExecutor(self.para)
+        executor.query_manager = ScrollQueryManager(self.values)
+        sitemap_data_iter = executor.execute()
+
+        self.assertIsNone(self.para.staging_dir)
+        self.assertTrue(os.path.islink(self.metadata_dir))
+        names = ["resourcelist_0000.xml", "resourcelist_0001.xml"]
+        self.assertEqual([sitemap_data.path for sitemap_data in sitemap_data_iter],
+                         [os.path.join(self.metadata_dir, name) for name in names])
+        self.assertEqual([sitemap_data.uri for sitemap_data in sitemap_data_iter],
+                         ["http://example.com/metadata/" + name for name in names])
+        for sitemap_data in sitemap_data_iter:
+            self.assertTrue(os.path.exists(sitemap_data.path))
+
+        paths = [os.path.join(self.metadata_dir, name) for name in names]
+        self.assertEqual([uri for path in paths for uri in self.uris(path)],
+                         ["http://example.com/" + value for value in self.values])
+        for path in paths:
+            self.assertIn(("up", "http://example.com/metadata/capabilitylist.xml"), self.links(path))
+
+        capabilitylist_path = os.path.join(self.metadata_dir, "capabilitylist.xml")
+        capabilitylist_uris = self.uris(capabilitylist_path)
+        self.assertTrue(len(capabilitylist_uris) > 0)
+        for uri in capabilitylist_uris:
+            self.assertTrue(uri.startswith("http://example.com/metadata/resourcelist"), uri)
+        description_path = os.path.join(self.tmp_dir, ".well-known", "resourcesync")
+        self.assertEqual(self.uris(description_path), ["http://example.com/metadata/capabilitylist.xml"])
+
+
+if __name__ == '__main__':
+    unittest.main()
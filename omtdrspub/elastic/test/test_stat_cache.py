@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from omtdrspub.elastic.stat_cache import StatCache
+
+
+class TestStatCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.file1 = os.path.join(self.tmp_dir, "file1.txt")
+        self.file2 = os.path.join(self.tmp_dir, "file2.txt")
+        for path in (self.file1, self.file2):
+            with open(path, "w") as file:
+                file.write("abc")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cache(self):
+        cache = StatCache.for_resource_set(os.path.join(self.tmp_dir, "cache"), "elsevier-meta")
+        cache.put(self.file1, os.stat(self.file1), "md5-1")
+        cache.put(self.file2, os.stat(self.file2), "md5-2")
+        cache.close()
+
+        cache = StatCache.for_resource_set(os.path.join(self.tmp_dir, "cache"), "elsevier-meta")
+        self.assertEqual(cache.get(self.file1, os.stat(self.file1)), "md5-1")
+        with open(self.file2, "w") as file:
+            file.write("abcd")
+        # a changed file is not in the cache anymore
+        self.assertIsNone(cache.get(self.file2, os.stat(self.file2)))
+        cache.put(self.file1, os.stat(self.file1), "md5-1")
+        cache.close()
+
+        # files not seen by the previous run are forgotten
+        cache = StatCache.for_resource_set(os.path.join(self.tmp_dir, "cache"), "elsevier-meta")
+        self.assertEqual(cache.connection.execute("SELECT path FROM files").fetchall(), [(self.file1,)])
+        cache.close(complete=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+from omtdrspub.elastic.trigger import ChangeTrigger
+
+
+class Para(object):
+    resource_set = "elsevier-meta"
+    elastic_index = "test-resourcesync"
+    elastic_change_doc_type = "change"
+
+
+class CountingQueryManager(object):
+
+    def __init__(self, pending, old_pending):
+        self.pending = pending
+        self.old_pending = old_pending
+        self.queries = []
+
+    def count_documents(self, index, doc_type, query):
+        self.queries.append(query)
+        must = query["query"]["bool"]["must"]
+        return self.old_pending if len(must) > 1 else self.pending
+
+
+class TestChangeTrigger(unittest.TestCase):
+
+    def test_max_changes(self):
+        trigger = ChangeTrigger(Para(), max_changes=100, query_manager=CountingQueryManager(99, 0))
+        self.assertFalse(trigger.is_due())
+        trigger.query_manager.pending = 100
+        self.assertTrue(trigger.is_due())
+
+    def test_max_age(self):
+        query_manager = CountingQueryManager(5, 0)
+        trigger = ChangeTrigger(Para(), max_changes=100, max_age=300, query_manager=query_manager)
+        self.assertFalse(trigger.is_due())
+        query_manager.old_pending = 1
+        self.assertTrue(trigger.is_due())
+        age_query = query_manager.queries[-1]["query"]["bool"]["must"]
+        self.assertEqual(age_query[0], {"term": {"resource_set": "elsevier-meta"}})
+        self.assertIn("lte", age_query[1]["range"]["datetime"])
+
+    def test_thresholds_required(self):
+        with self.assertRaises(ValueError):
+            ChangeTrigger(Para(), query_manager=CountingQueryManager(0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from resync import ChangeList
+from resync import Resource
+from resync.sitemap import Sitemap
+
+from omtdrspub.elastic.utils import file_lock, iter_preamble, parse_xml_without_urls, write_atomically
+
+
+def changelist_xml(n):
+    changelist = ChangeList()
+    changelist.md_from = "2017-02-03T12:25:00Z"
+    changelist.link_set(rel="up", href="http://example.com/capabilitylist.xml")
+    for i in range(n):
+        changelist.add(Resource(uri="http://example.com/file%d.txt" % i, change="created"))
+    return changelist.as_xml()
+
+
+class TestParseXmlWithoutUrls(unittest.TestCase):
+
+    def test_preamble(self):
+        changelist = ChangeList()
+        parse_xml_without_urls(Sitemap(), fh=io.StringIO(changelist_xml(3)), resources=changelist)
+        self.assertEqual(changelist.md_from, "2017-02-03T12:25:00Z")
+        self.assertEqual(changelist.link("up")['href'], "http://example.com/capabilitylist.xml")
+        self.assertEqual(len(changelist), 0)
+
+    def test_stops_at_first_url(self):
+        fh = io.StringIO(changelist_xml(20000))
+        elements = list(iter_preamble(fh))
+        self.assertTrue(elements[-1].tag.endswith("}url"))
+        self.assertLess(fh.tell(), 64 * 1024)
+
+
+class TestSharedFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_write_atomically(self):
+        path = os.path.join(self.tmp_dir, "capabilitylist.xml")
+        with open(path, "w") as f:
+            f.write("previous")
+
+        def failing_write(tmp_path):
+            with open(tmp_path, "w") as f:
+                f.write("partial")
+            raise IOError("disk full")
+
+        with self.assertRaises(IOError):
+            write_atomically(path, failing_write)
+        with open(path) as f:
+            self.assertEqual(f.read(), "previous")
+        self.assertEqual(os.listdir(self.tmp_dir), ["capabilitylist.xml"])
+
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                f.write("new")
+
+        write_atomically(path, write)
+        with open(path) as f:
+            self.assertEqual(f.read(), "new")
+
+    def test_file_lock(self):
+        lock_path = os.path.join(self.tmp_dir, ".resourcesync.lock")
+        inside = []
+        overlaps = []
+
+        def update():
+            with file_lock(lock_path):
+                overlaps.append(len(inside))
+                inside.append(1)
+                time.sleep(0.01)
+                inside.pop()
+
+        threads = [threading.Thread(target=update) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(overlaps, [0] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
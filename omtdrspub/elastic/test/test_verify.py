@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from omtdrspub.elastic.verify import SitemapVerifier, sitemap_resources, LENGTH_MISMATCH, MD5_MISMATCH, \
+    NOT_INDEXED, NOT_PUBLISHED
+
+RESOURCELIST = """<?xml version='1.0' encoding='UTF-8'?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">
+<rs:md at="2017-01-01T00:00:00Z" capability="resourcelist"/>
+%s
+</urlset>
+"""
+
+URL = """<url><loc>http://example.com/%s</loc><lastmod>2017-01-01T00:00:00Z</lastmod>
+<rs:md hash="md5:%s" length="%d"/></url>"""
+
+
+class Para(object):
+    resource_set = "elsevier-meta"
+    elastic_index = "test-resourcesync"
+    elastic_resource_doc_type = "resource"
+    url_prefix = "http://example.com/"
+    res_root_dir = "/data"
+    max_items_in_list = 50000
+    tmp_dir = None
+
+    def __init__(self, metadata_dir):
+        self.metadata_dir = metadata_dir
+
+    def abs_metadata_path(self, filename):
+        return os.path.join(self.metadata_dir, filename)
+
+
+class DocumentsQueryManager(object):
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def scan_and_scroll(self, index, doc_type, query, max_items_in_list, max_result_window):
+        self.queries.append(query)
+        yield [{'_id': str(i), '_source': {'location': {'type': "rel_path", 'value': value}, 'md5': md5,
+                                           'length': length}}
+               for i, (value, md5, length) in enumerate(self.docs)]
+
+
+class TestSitemapVerifier(unittest.TestCase):
+
+    def setUp(self):
+        self.metadata_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.metadata_dir)
+
+    def write_resourcelist(self, name, resources):
+        with open(os.path.join(self.metadata_dir, name), "w") as rl_file:
+            rl_file.write(RESOURCELIST % "\n".join(URL % resource for resource in resources))
+
+    def test_sitemap_resources(self):
+        self.write_resourcelist("resourcelist_0000.xml", [("file1.txt", "abc==", 3)])
+        self.assertEqual(list(sitemap_resources(os.path.join(self.metadata_dir, "resourcelist_0000.xml"))),
+                         [("http://example.com/file1.txt", "abc==", 3)])
+
+    def test_verify(self):
+        self.write_resourcelist("resourcelist_0000.xml", [("file3.txt", "c==", 3), ("file1.txt", "a==", 1)])
+        self.write_resourcelist("resourcelist_0001.xml", [("file2.txt", "b==", 2), ("file5.txt", "e==", 5)])
+        # not a resourcelist
+        self.write_resourcelist("resourcelist-index.xml", [("file9.txt", "i==", 9)])
+        query_manager = DocumentsQueryManager([("file4.txt", "d==", 4), ("file1.txt", "a==", 1),
+                                               ("file2.txt", "x==", 2), ("file3.txt", "c==", 30)])
+        verifier = SitemapVerifier(Para(self.metadata_dir), buffer_size=2, query_manager=query_manager)
+        found = []
+        counts = verifier.verify(report=lambda mismatch: found.append((mismatch.kind, mismatch.uri)))
+
+        self.assertEqual(found, [(MD5_MISMATCH, "http://example.com/file2.txt"),
+                                 (LENGTH_MISMATCH, "http://example.com/file3.txt"),
+                                 (NOT_PUBLISHED, "http://example.com/file4.txt"),
+                                 (NOT_INDEXED, "http://example.com/file5.txt")])
+        self.assertEqual(counts[NOT_INDEXED], 1)
+        self.assertEqual(query_manager.queries[0]["_source"], ["location", "md5", "length"])
+
+
+if __name__ == '__main__':
+    unittest.main()
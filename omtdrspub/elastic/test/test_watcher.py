@@ -0,0 +1,114 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from omtdrspub.elastic.ingest import elastic_id
+from omtdrspub.elastic.model.location import Location
+from omtdrspub.elastic.test.test_ingest import IndexQueryManager, Para
+from omtdrspub.elastic.watcher import ElasticWatcher
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is only available on Linux")
+class TestElasticWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.res_root_dir = os.path.join(self.tmp_dir, "resources")
+        os.makedirs(os.path.join(self.res_root_dir, "sub"))
+        self.write("sub/file1.txt", "abc")
+        self.query_manager = IndexQueryManager()
+        self.watcher = ElasticWatcher(Para(self.res_root_dir), debounce=0.05, query_manager=self.query_manager)
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.inotify.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.res_root_dir, name), "w") as file:
+            file.write(content)
+
+    def settle(self):
+        deadline = time.monotonic() + 5
+        self.watcher.poll(timeout=0.01)
+        while len(self.watcher.dirty) > 0 and time.monotonic() < deadline:
+            self.watcher.poll(timeout=0.01)
+        self.assertEqual(self.watcher.dirty, {})
+
+    def changes(self):
+        changes = [(change['change'], change['location']['value']) for change in self.query_manager.changes]
+        self.query_manager.changes = []
+        return sorted(changes)
+
+    def test_changes(self):
+        self.settle()
+        self.assertEqual(self.changes(), [("created", "sub/file1.txt")])
+
+        # an editor saving through a temporary file
+        self.write("sub/.file1.txt.swp", "abcd")
+        os.replace(os.path.join(self.res_root_dir, "sub/.file1.txt.swp"),
+                   os.path.join(self.res_root_dir, "sub/file1.txt"))
+        self.settle()
+        self.assertEqual(self.changes(), [("updated", "sub/file1.txt")])
+
+        os.makedirs(os.path.join(self.res_root_dir, "new"))
+        self.write("new/file2.txt", "x")
+        self.settle()
+        self.assertEqual(self.changes(), [("created", "new/file2.txt")])
+        self.assertIn(elastic_id("elsevier-meta", Location("new/file2.txt", "rel_path")),
+                      self.query_manager.resources)
+
+        # a directory moved out of res_root_dir
+        shutil.move(os.path.join(self.res_root_dir, "sub"), os.path.join(self.tmp_dir, "sub"))
+        self.settle()
+        self.assertEqual(self.changes(), [("deleted", "sub/file1.txt")])
+
+        os.remove(os.path.join(self.res_root_dir, "new/file2.txt"))
+        self.settle()
+        self.assertEqual(self.changes(), [("deleted", "new/file2.txt")])
+        self.assertEqual(self.query_manager.resources, {})
+
+    def test_ignore(self):
+        self.settle()
+        self.changes()
+        for name in ("sub/.file1.txt.swp", "sub/file1.txt~", "sub/.#file1.txt", "sub/part_0000.zip.tmp"):
+            self.write(name, "x")
+        self.write("sub/file2.txt", "x")
+        self.settle()
+        self.assertEqual(self.changes(), [("created", "sub/file2.txt")])
+
+        self.watcher.inotify.close()
+        para = Para(self.res_root_dir)
+        para.watch_ignore = ["*.txt"]
+        self.watcher = ElasticWatcher(para, debounce=0.05, query_manager=self.query_manager)
+        self.watcher.start()
+        self.write("sub/file3.txt", "x")
+        self.write("sub/file4.xml", "x")
+        self.settle()
+        # the files written while nothing was watching are found when the watcher starts
+        self.assertEqual(self.changes(), [("created", "sub/.file1.txt.swp"), ("created", "sub/file1.txt~"),
+                                          ("created", "sub/file4.xml"), ("created", "sub/part_0000.zip.tmp")])
+
+    def test_slow_write(self):
+        self.settle()
+        self.changes()
+        self.watcher.debounce = 0.2
+        # written for longer than debounce, without closing the file in between
+        with open(os.path.join(self.res_root_dir, "sub/slow.txt"), "w") as file:
+            for _ in range(10):
+                file.write("abc")
+                file.flush()
+                time.sleep(0.05)
+                self.watcher.poll(timeout=0)
+                self.assertEqual(self.changes(), [])
+        self.settle()
+        self.assertEqual(self.changes(), [("created", "sub/slow.txt")])
+        doc = self.query_manager.resources[elastic_id("elsevier-meta", Location("sub/slow.txt", "rel_path"))]
+        self.assertEqual(doc['length'], 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+
+import logging
+
+from omtdrspub.elastic import utils
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.exe_elastic_changelist import ElasticIncrementalChangeListExecutor
+
+LOG = logging.getLogger(__name__)
+
+
+class ChangeTrigger(object):
+    """
+    Publishes the pending changes of a resource set when they are worth it: when there are at least max_changes
+    of them, or when the oldest is older than max_age seconds. Both conditions are checked with count queries
+    on the change type, without fetching any change; either can be left out.
+
+    Changes are published with the incremental changelist strategy, so that frequent small batches do not
+    multiply changelists.
+    """
+
+    def __init__(self, para: ElasticRsParameters, max_changes=None, max_age=None,
+                 query_manager: ElasticQueryManager=None):
+        if max_changes is None and max_age is None:
+            raise ValueError("A change trigger needs max_changes, max_age or both")
+        self.para = para
+        self.max_changes = max_changes
+        self.max_age = max_age
+        self.query_manager = query_manager if query_manager is not None \
+            else ElasticQueryManager(para.elastic_host, para.elastic_port)
+
+    def pending_changes_query(self, until: str=None):
+        query = {
+            "query": {
+                "bool": {
+                    "must": [
+                        {
+                            "term": {"resource_set": self.para.resource_set}
+                        }
+                    ]
+                }
+            }
+        }
+        if until is not None:
+            query["query"]["bool"]["must"].append({"range": {"datetime": {"lte": until}}})
+        return query
+
+    def count_pending_changes(self, until: str=None) -> int:
+        return self.query_manager.count_documents(index=self.para.elastic_index,
+                                                  doc_type=self.para.elastic_change_doc_type,
+                                                  query=self.pending_changes_query(until))
+
+    def is_due(self) -> bool:
+        if self.max_changes is not None and self.count_pending_changes() >= self.max_changes:
+            LOG.info("%s: at least %d pending changes" % (self.para.resource_set, self.max_changes))
+            return True
+        if self.max_age is not None:
+            # changes are stamped the way the query manager does, see ElasticQueryManager.create_resource
+            until = utils.formatted_date(datetime.now() - timedelta(seconds=self.max_age))
+            if self.count_pending_changes(until=until) > 0:
+                LOG.info("%s: pending changes older than %d seconds" % (self.para.resource_set, self.max_age))
+                return True
+        return False
+
+    def publish(self):
+        return ElasticIncrementalChangeListExecutor(self.para).execute()
+
+    def publish_if_due(self):
+        """Publish the pending changes if the trigger is due; returns the new sitemaps, or None."""
+        if self.is_due():
+            return self.publish()
+        return None
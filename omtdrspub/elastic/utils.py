@@ -1,25 +1,60 @@
+import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
 from resync.sitemap import RS_NS, SitemapParseError, SITEMAP_NS, SitemapIndexError
 
-from xml.etree.ElementTree import parse
+from xml.etree.ElementTree import iterparse
 from resync.resource_container import ResourceContainer
 
+RESOURCE_TAGS = ('{' + SITEMAP_NS + "}url", '{' + SITEMAP_NS + "}sitemap")
+
+
+def iter_preamble(fh):
+    """
+    Stream the root element of a sitemap and then its children, up to the first <url> or <sitemap>.
+
+    The first <url> or <sitemap> element is yielded as soon as it starts (incomplete), and nothing is read
+    after it: memory stays constant and only the first few kilobytes of the document are parsed.
+    """
+    depth = 0
+    root = None
+    for event, e in iterparse(fh, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                root = e
+                yield e
+            elif depth == 2 and e.tag in RESOURCE_TAGS:
+                yield e
+                return
+        else:
+            depth -= 1
+            if depth == 1:
+                yield e
+                root.remove(e)
+
 
 def parse_xml_without_urls(sm, fh=None, etree=None, resources=None, capability=None,
                           sitemapindex=None):
     """
     This is a modification of the Sitemap.parse_xml method of the resync library
-    We need to parse rs:md and rs:ln items, avoiding to parse <url> tags
+    We need to parse rs:md and rs:ln items, avoiding to parse <url> tags.
+    When reading from fh, the document is streamed and parsing stops at the first <url> tag
     """
     if resources is None:
         resources = ResourceContainer()
     if fh is not None:
-        etree = parse(fh)
-    elif etree is None:
+        elements = iter_preamble(fh)
+        root = next(elements)
+    elif etree is not None:
+        root = etree.getroot()
+        elements = iter(root)
+    else:
         raise ValueError("Neither fh or etree set")
     # check root element: urlset (for sitemap), sitemapindex or bad
-    root_tag = etree.getroot().tag
+    root_tag = root.tag
     resource_tag = None  # will be <url> or <sitemap> depending on type
     sm.parsed_index = None
     if root_tag == '{' + SITEMAP_NS + "}urlset":
@@ -43,11 +78,11 @@ def parse_xml_without_urls(sm, fh=None, etree=None, resources=None, capability=N
     in_preamble = True
     sm.resources_created = 0
     seen_top_level_md = False
-    for e in etree.getroot().getchildren():
+    for e in elements:
         # look for <rs:md> and <rs:ln>, first <url> ends
         # then look for resources in <url> blocks
         if e.tag == resource_tag:
-            pass
+            break
             # in_preamble = False  # any later rs:md or rs:ln is error
             # r = self.resource_from_etree(e, self.resource_class)
             # try:
@@ -98,3 +133,65 @@ def formatted_date(d: datetime):
     return d.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# file locks are not reentrant across threads on every platform: threads of a process also take this lock
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on the file at path (created if missing) against other processes and threads.
+
+    Where fcntl is not available only the threads of this process are excluded.
+    """
+    path = os.path.abspath(path)
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(path, threading.Lock())
+    with thread_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class LockedSharedDocuments(object):
+    """
+    Executor mixin that serializes the updates of the documents shared with other executors: the capability list
+    of the metadata dir and the source description of description_dir. List it before Executor in the bases.
+    """
+
+    def create_capabilitylist(self):
+        with file_lock(self.para.abs_metadata_path(".capabilitylist.lock")):
+            return super(LockedSharedDocuments, self).create_capabilitylist()
+
+    def update_resource_sync(self, capabilitylist_data):
+        # the source description is read, updated and saved by every resource set of description_dir
+        with file_lock(self.para.abs_description_lock_path()):
+            return super(LockedSharedDocuments, self).update_resource_sync(capabilitylist_data)
+
+
+def write_atomically(path, write):
+    """
+    Call write(tmp_path) with a temporary file next to path, then move it over path: readers see either the
+    previous document or the new one, never a partial one.
+    """
+    # unique per process and thread; not created with mkstemp, which would restrict the file permissions
+    tmp_path = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,167 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import sys
+from collections import namedtuple
+from glob import glob
+from xml.etree.ElementTree import iterparse
+
+import logging
+from resync.sitemap import RS_NS, SITEMAP_NS
+
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager, resource_set_query
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.external_sort import ExternalSorter
+from omtdrspub.elastic.model.location import Location, LocationResolver
+
+MAX_RESULT_WINDOW = 10000
+
+LOG = logging.getLogger(__name__)
+
+URL_TAG = "{" + SITEMAP_NS + "}url"
+LOC_TAG = "{" + SITEMAP_NS + "}loc"
+MD_TAG = "{" + RS_NS + "}md"
+
+# in the index, not in the resourcelists
+NOT_PUBLISHED = "not_published"
+# in the resourcelists, not in the index
+NOT_INDEXED = "not_indexed"
+MD5_MISMATCH = "md5_mismatch"
+LENGTH_MISMATCH = "length_mismatch"
+
+Mismatch = namedtuple("Mismatch", ["kind", "uri", "published", "indexed"])
+
+
+def sitemap_resources(path) -> [str, str, int]:
+    """
+    Stream the uri, md5 and length of the resources of a sitemap. Every <url> element is discarded once read,
+    so that memory stays constant whatever the size of the document.
+    """
+    root = None
+    for event, e in iterparse(path, events=('start', 'end')):
+        if root is None:
+            root = e
+        elif event == 'end' and e.tag == URL_TAG:
+            uri = e.findtext(LOC_TAG)
+            md5 = None
+            length = None
+            md = e.find(MD_TAG)
+            if md is not None:
+                for value in md.get('hash', "").split():
+                    if value.startswith("md5:"):
+                        md5 = value[len("md5:"):]
+                length = int(md.get('length')) if md.get('length') is not None else None
+            yield uri.strip() if uri is not None else None, md5, length
+            root.clear()
+
+
+class SitemapVerifier(object):
+    """
+    Verifies that the published resourcelists list the resource documents of the resource set, with their md5
+    and length.
+
+    The resources of the resourcelists are streamed with an incremental parser, the documents with a scroll
+    fetching only their location, md5 and length. Both sides are sorted by uri with an :class:`ExternalSorter`
+    of buffer_size records in tmp_dir, then merge joined: memory is bounded whatever the size of the set.
+    Changes recorded after the resourcelists were published show up as mismatches: verify right after
+    publishing a resourcelist.
+    """
+
+    def __init__(self, para: ElasticRsParameters, buffer_size=100000, query_manager: ElasticQueryManager=None):
+        self.para = para
+        self.buffer_size = buffer_size
+        self.query_manager = query_manager if query_manager is not None \
+            else ElasticQueryManager(para.elastic_host, para.elastic_port)
+        self.location_resolver = LocationResolver(para.url_prefix, para.res_root_dir)
+        self.counts = {NOT_PUBLISHED: 0, NOT_INDEXED: 0, MD5_MISMATCH: 0, LENGTH_MISMATCH: 0}
+
+    def resourcelist_files(self) -> [str]:
+        return sorted(glob(self.para.abs_metadata_path("resourcelist_*.xml")))
+
+    def published_resources(self) -> [str, str, int]:
+        for rl_file in self.resourcelist_files():
+            for resource in sitemap_resources(rl_file):
+                yield resource
+
+    def indexed_resources(self) -> [str, str, int]:
+        query = resource_set_query(self.para.resource_set)
+        query["_source"] = ["location", "md5", "length"]
+        resolver = self.location_resolver
+        for e_page in self.query_manager.scan_and_scroll(index=self.para.elastic_index,
+                                                         doc_type=self.para.elastic_resource_doc_type,
+                                                         query=query,
+                                                         max_items_in_list=self.para.max_items_in_list,
+                                                         max_result_window=MAX_RESULT_WINDOW):
+            for e_hit in e_page:
+                e_source = e_hit['_source']
+                yield resolver.uri(Location.from_source(e_source['location'])), e_source.get('md5'), \
+                    e_source.get('length')
+
+    def sorted_by_uri(self, resources: iter) -> ExternalSorter:
+        tmp_dir = self.para.abs_tmp_dir() if self.para.tmp_dir else None
+        sorter = ExternalSorter(key=lambda r: r[0] or "", buffer_size=self.buffer_size, tmp_dir=tmp_dir)
+        try:
+            for uri, md5, length in resources:
+                sorter.add([uri, md5, length])
+        except Exception:
+            sorter.close()
+            raise
+        return sorter
+
+    def mismatches(self) -> [Mismatch]:
+        published_sorter = self.sorted_by_uri(self.published_resources())
+        indexed_sorter = None
+        try:
+            indexed_sorter = self.sorted_by_uri(self.indexed_resources())
+            published = iter(published_sorter)
+            indexed = iter(indexed_sorter)
+            p_item = next(published, None)
+            i_item = next(indexed, None)
+            while p_item is not None or i_item is not None:
+                if i_item is None or (p_item is not None and (p_item[0] or "") < (i_item[0] or "")):
+                    yield Mismatch(NOT_INDEXED, p_item[0], p_item, None)
+                    p_item = next(published, None)
+                elif p_item is None or (i_item[0] or "") < (p_item[0] or ""):
+                    yield Mismatch(NOT_PUBLISHED, i_item[0], None, i_item)
+                    i_item = next(indexed, None)
+                else:
+                    if p_item[1] != i_item[1]:
+                        yield Mismatch(MD5_MISMATCH, p_item[0], p_item, i_item)
+                    elif p_item[2] != i_item[2]:
+                        yield Mismatch(LENGTH_MISMATCH, p_item[0], p_item, i_item)
+                    p_item = next(published, None)
+                    i_item = next(indexed, None)
+        finally:
+            published_sorter.close()
+            if indexed_sorter is not None:
+                indexed_sorter.close()
+
+    def verify(self, report=None) -> dict:
+        """Find the mismatches, passing each to report if given. Returns the number of mismatches per kind."""
+        for mismatch in self.mismatches():
+            self.counts[mismatch.kind] += 1
+            if report is not None:
+                report(mismatch)
+        LOG.info("Verified %s: %s" % (self.para.resource_set, self.counts))
+        return self.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the published resourcelists of a resource set with its "
+                                                 "documents")
+    parser.add_argument("config", help="yaml file with the parameters of the resource set")
+    parser.add_argument("--buffer-size", type=int, default=100000,
+                        help="resources held in memory per side while sorting")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    def report(mismatch: Mismatch):
+        print("%s\t%s" % (mismatch.kind, mismatch.uri))
+
+    verifier = SitemapVerifier(ElasticRsParameters.from_yaml_params(args.config), buffer_size=args.buffer_size)
+    counts = verifier.verify(report=report)
+    return 1 if sum(counts.values()) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
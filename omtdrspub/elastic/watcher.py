@@ -0,0 +1,265 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import os
+import re
+import select
+import struct
+import time
+from stat import S_ISREG
+
+import logging
+
+from omtdrspub.elastic.elastic_query_manager import ElasticQueryManager, location_prefix_query
+from omtdrspub.elastic.elastic_rs_paras import ElasticRsParameters
+from omtdrspub.elastic.ingest import ElasticIngester, MAX_RESULT_WINDOW
+from omtdrspub.elastic.model.location import Location
+
+LOG = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_ONLYDIR
+
+EVENT = struct.Struct("iIII")
+
+
+class Inotify(object):
+    """A minimal binding of the Linux inotify API, through ctypes."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available on this system")
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        # fails if the watch is already gone, e.g. its directory was deleted
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout) -> [int, int, int, str]:
+        """Wait at most timeout seconds for events, yield them as (wd, mask, cookie, name)."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            yield wd, mask, cookie, name
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ElasticWatcher(object):
+    """
+    Keeps the resource type of a resource set in line with res_root_dir as files change, without crawling.
+
+    Every directory under res_root_dir is watched with inotify. Events only mark paths as dirty: a path is
+    processed once it has been quiet for debounce seconds, according to what is on disk at that time, so that
+    bursts of events on the same file (an editor saving through a temporary file, a rename) end up in a
+    single operation, or in none. A file still being written keeps being marked, so it is only processed once
+    its writer has paused for debounce seconds. Processed paths are written in batches, through
+    :class:`ElasticIngester`: files are created or updated and missing files deleted, with their changes.
+
+    A directory moved away marks the indexed files under it as dirty. If the kernel queue overflows, events
+    are lost: the whole directory is ingested again.
+
+    Files whose name matches one of the shell patterns of para.watch_ignore (editor swap files, temporary files,
+    such as the ones dump packages are written to) are not recorded.
+    """
+
+    def __init__(self, para: ElasticRsParameters, debounce=1.0, query_manager: ElasticQueryManager=None):
+        self.para = para
+        self.debounce = debounce
+        self.ingester = ElasticIngester(para, query_manager=query_manager)
+        self.root_dir = self.ingester.root_dir
+        self.inotify = None
+        # wd -> directory
+        self.watches = {}
+        # path -> time it can be processed
+        self.dirty = {}
+        self.overflowed = False
+        self._stopped = False
+        patterns = para.watch_ignore or []
+        self._ignored = re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns)) \
+            if len(patterns) > 0 else None
+
+    def ignored(self, path) -> bool:
+        return self._ignored is not None and self._ignored.match(os.path.basename(path)) is not None
+
+    def start(self):
+        self.inotify = Inotify()
+        for path in self.watch_tree(self.root_dir):
+            # files written before the directory was watched
+            if not self.ignored(path):
+                self.mark(path)
+
+    def run(self):
+        """Process events until stop is called."""
+        if self.inotify is None:
+            self.start()
+        try:
+            while not self._stopped:
+                self.poll(timeout=min(self.debounce, 1.0))
+        finally:
+            self.flush(force=True)
+            self.inotify.close()
+            self.inotify = None
+
+    def poll(self, timeout):
+        for event in self.inotify.read_events(timeout):
+            self.handle(*event)
+        if self.overflowed:
+            LOG.warning("Events lost on %s, ingesting it again" % self.root_dir)
+            self.overflowed = False
+            self.dirty.clear()
+            self.ingester.ingest()
+        self.flush()
+
+    def stop(self):
+        self._stopped = True
+
+    def watch_tree(self, directory) -> [str]:
+        """Watch directory and the directories under it; yields the files found in them."""
+        stack = [directory]
+        while len(stack) > 0:
+            directory = stack.pop()
+            try:
+                self.watches[self.inotify.add_watch(directory, WATCH_MASK)] = directory
+                entries = list(os.scandir(directory))
+            except OSError as err:
+                LOG.warning("Cannot watch %s: %s" % (directory, err))
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry.path
+
+    def unwatch_tree(self, directory):
+        prefix = directory + os.sep
+        for wd, path in list(self.watches.items()):
+            if path == directory or path.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def handle(self, wd, mask, cookie, name):
+        if mask & IN_Q_OVERFLOW:
+            self.overflowed = True
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            del self.watches[wd]
+            return
+        if mask & IN_DELETE_SELF:
+            return
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                for file_path in self.watch_tree(path):
+                    if not self.ignored(file_path):
+                        self.mark(file_path)
+            elif mask & IN_MOVED_FROM:
+                self.unwatch_tree(path)
+                self.mark_indexed_tree(path)
+            # files of a deleted directory have their own delete events
+            return
+        if not self.ignored(path):
+            self.mark(path)
+
+    def mark(self, path):
+        self.dirty[path] = time.monotonic() + self.debounce
+
+    def mark_indexed_tree(self, directory):
+        location = self.ingester.location(directory)
+        query = location_prefix_query(self.para.resource_set, location.loc_type, location.value + "/")
+        for e_page in self.ingester.query_manager.scan_and_scroll(index=self.para.elastic_index,
+                                                                  doc_type=self.para.elastic_resource_doc_type,
+                                                                  query=query,
+                                                                  max_items_in_list=self.para.max_items_in_list,
+                                                                  max_result_window=MAX_RESULT_WINDOW):
+            for e_hit in e_page:
+                path = self.ingester.location_resolver.path(Location.from_source(e_hit['_source']['location']))
+                if path is not None:
+                    self.mark(path)
+
+    def flush(self, force=False):
+        """Write the paths that have been quiet long enough (all of them if force), in batches."""
+        now = time.monotonic()
+        ready = [path for path, due in self.dirty.items() if force or due <= now]
+        for start in range(0, len(ready), self.ingester.bulk_size):
+            batch = ready[start:start + self.ingester.bulk_size]
+            resource_docs = []
+            deleted = []
+            for path in batch:
+                del self.dirty[path]
+                try:
+                    stat = os.stat(path, follow_symlinks=False)
+                except FileNotFoundError:
+                    deleted.append(path)
+                    continue
+                except OSError as err:
+                    LOG.warning("Cannot stat %s: %s" % (path, err))
+                    continue
+                if not S_ISREG(stat.st_mode):
+                    # replaced by a directory or a link, which are not ingested
+                    deleted.append(path)
+                    continue
+                resource_doc = self.ingester.describe(path, stat)
+                if resource_doc is not None:
+                    resource_docs.append(resource_doc)
+            self.ingester.write_batch(resource_docs)
+            self.ingester.delete_paths(deleted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the changes of the files of a resource set as they happen")
+    parser.add_argument("config", help="yaml file with the parameters of the resource set")
+    parser.add_argument("--debounce", type=float, default=1.0,
+                        help="seconds a file must be left alone before its change is recorded")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    ElasticWatcher(ElasticRsParameters.from_yaml_params(args.config), debounce=args.debounce).run()
+
+
+if __name__ == '__main__':
+    main()